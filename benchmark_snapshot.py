@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+快照加载基准测试
+生成指定条数的模拟盲盒记录，分别保存为JSON数据文件和二进制快照，比较文件大小、保存和加载耗时
+加载包括解析文件和恢复各结构（用户名表、时间桶汇总、盲盒类型统计、分位数估计、历史记录）
+
+用法：
+    python benchmark_snapshot.py                 # 1万、10万、100万条
+    python benchmark_snapshot.py 10000 50000     # 指定条数
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import blind_box_snapshot as snapshot
+from blind_box_persist import dump_json
+from blind_box_rollup import Rollups
+from blind_box_sketch import DailySketches
+from blind_box_store import HistoryStore, UserDirectory, uid_key
+from blind_box_types import BoxTypeTable
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+BOXES = (("心动盲盒", 15000), ("奇遇盲盒", 5000), ("幸运盲盒", 10000), ("至尊盲盒", 50000))
+REPEAT = 3
+
+
+def generate(events: int):
+    """模拟一天的数据：约每20条记录一位用户，时间均匀分布在一天内"""
+    rng = random.Random(events)
+    users = max(100, events // 20)
+    start = int(time.time()) - 86400
+    history = HistoryStore()
+    user_names = UserDirectory()
+    user_stats = {}
+    rollups = Rollups()
+    box_types = BoxTypeTable()
+    sketches = DailySketches()
+    total = {"count": 0, "cost": 0, "value": 0}
+
+    for i in range(events):
+        uid = 10_000_000 + rng.randrange(users)
+        blind_name, cost = BOXES[rng.randrange(len(BOXES))]
+        value = int(cost * rng.expovariate(1.1)) // 100 * 100
+        ts = start + i * 86400 // events
+        user_names.update(uid, f"观众{uid}")
+        user = user_stats.setdefault(uid, {"count": 0, "cost": 0, "value": 0, "profit": 0})
+        user["count"] += 1
+        user["cost"] += cost
+        user["value"] += value
+        user["profit"] += value - cost
+        history.append(uid, blind_name, cost, value, ts=ts)
+        rollups.add(ts, uid, blind_name, cost, value)
+        box_types.add(blind_name, cost, value)
+        sketches.add(uid, blind_name, cost, value)
+        total["count"] += 1
+        total["cost"] += cost
+        total["value"] += value
+
+    header = {
+        "date": time.strftime("%Y-%m-%d"),
+        "wal_seq": events,
+        "user_stats": user_stats,
+        "users": user_names.to_dict(),
+        "total_stats": total,
+        "history_rows": len(history),
+        "rollups": rollups.to_dict(),
+        "box_types": box_types.to_dict(),
+        "sketches": sketches.to_dict()
+    }
+    return header, history
+
+
+def restore(header):
+    """与 web_server 启动时相同的恢复步骤"""
+    user_stats = {uid_key(uid): user for uid, user in header["user_stats"].items()}
+    UserDirectory.from_dict(header["users"])
+    Rollups.from_dict(header["rollups"])
+    BoxTypeTable.from_dict(header["box_types"])
+    DailySketches.from_dict(header["sketches"])
+    return user_stats
+
+
+def load_json(header_path, history_path):
+    with open(header_path, 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    restore(header)
+    summary = time.perf_counter()
+    with open(history_path, 'r', encoding='utf-8') as f:
+        history = HistoryStore.from_dict(json.load(f), header["history_rows"])
+    return summary, history
+
+
+def load_binary(header_path, history_path):
+    header = snapshot.read_state(header_path)
+    restore(header)
+    summary = time.perf_counter()
+    history = snapshot.load_history(history_path, header["history_rows"])
+    return summary, history
+
+
+def measure(loader, header_path, history_path, rows):
+    """多次加载取最快的一次，返回 (汇总耗时, 汇总+历史记录耗时)"""
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        summary, history = loader(header_path, history_path)
+        finished = time.perf_counter()
+        assert len(history) == rows
+        result = (summary - started, finished - started)
+        best = result if best is None or result[1] < best[1] else best
+    return best
+
+
+def run(events: int, directory: str):
+    print(f"\n==== {events:,} 条记录 ====")
+    started = time.perf_counter()
+    header, history = generate(events)
+    print(f"生成数据: {time.perf_counter() - started:.1f}s，用户 {len(header['user_stats']):,} 位")
+
+    formats = (
+        ("JSON", ".json", dump_json, history.to_dict, load_json),
+        ("二进制", ".snap", lambda data: snapshot.encode({"state": data}), history.to_columns, load_binary),
+    )
+    print(f"{'格式':<6}{'汇总文件':>12}{'历史记录文件':>14}{'保存':>10}{'加载汇总':>10}{'加载全部':>10}")
+    for name, suffix, encode_header, history_data, loader in formats:
+        header_path = os.path.join(directory, f"bench_{events}{suffix}")
+        history_path = os.path.join(directory, f"bench_{events}.history{suffix}")
+        started = time.perf_counter()
+        header_bytes = encode_header(header)
+        history_bytes = dump_json(history_data()) if suffix == ".json" else snapshot.encode(history_data())
+        saved = time.perf_counter() - started
+        with open(header_path, 'wb') as f:
+            f.write(header_bytes)
+        with open(history_path, 'wb') as f:
+            f.write(history_bytes)
+
+        summary, full = measure(loader, header_path, history_path, events)
+        print(f"{name:<6}{len(header_bytes) / 1e6:>10.2f}MB{len(history_bytes) / 1e6:>12.2f}MB"
+              f"{saved * 1000:>8.0f}ms{summary * 1000:>8.0f}ms{full * 1000:>8.0f}ms")
+        os.remove(header_path)
+        os.remove(history_path)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"元数据编码: {'MessagePack' if snapshot.msgpack is not None else 'JSON（未安装msgpack）'}")
+    with tempfile.TemporaryDirectory() as directory:
+        for events in sizes:
+            run(events, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+每日数据归档
+已结束的日期（今天之前）从 data/ 中的数据文件、历史记录和事件日志转换为压缩的列式归档
+data/archive/blind_box_YYYY-MM-DD.archive，校验无误后删除原文件
+
+归档沿用二进制快照的文件格式（blind_box_snapshot），每段单独zlib压缩：
+    summary      当天汇总：盲盒数、花费、价值、盈亏分布、参与人数、各盲盒类型和直播间的合计
+    uids / boxes / rooms / users / sketches    编号对应的uid、盲盒名称、直播间，用户名表，分位数估计
+    ts.N user.N box.N cost.N value.N room.N     第N块的各列，每块 CHUNK_ROWS 条记录
+金额为毫元整数。读取多天数据时逐天、逐块解压（iter_events / DayArchive.columns），
+不需要一次读入全部记录；只看汇总时只解压 summary 段
+
+用法：
+    python blind_box_archive.py compact [--keep]        # 归档今天之前的数据，--keep 保留原文件
+    python blind_box_archive.py summary [开始日期] [结束日期]   # 各天汇总和期间花费最多的用户
+"""
+
+import json
+import os
+import re
+import sys
+from array import array
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import blind_box_snapshot as snapshot
+from blind_box_index import EventIndex, records_file
+from blind_box_persist import atomic_write
+from blind_box_sketch import DailySketches
+from blind_box_store import HistoryStore, NameTable, UserDirectory, history_file, to_milli, uid_key
+
+CHUNK_ROWS = 65536
+COLUMNS = ("ts", "user", "box", "cost", "value", "room")
+TYPECODES = {"ts": 'I', "user": 'I', "box": 'H', "cost": 'I', "value": 'I', "room": 'H'}
+
+_DAY_PATTERN = re.compile(r"^blind_box_(?:data|events)_(\d{4}-\d{2}-\d{2})\.")
+_ARCHIVE_PATTERN = re.compile(r"^blind_box_(\d{4}-\d{2}-\d{2})\.archive$")
+
+
+def archive_dir_for(data_dir: str) -> str:
+    return os.path.join(data_dir, "archive")
+
+
+def archive_path(archive_dir: str, day: str) -> str:
+    return os.path.join(archive_dir, f"blind_box_{day}.archive")
+
+
+# ==================== 读取 ====================
+
+class DayArchive:
+    """单日归档，打开时只读取段表，各段按需解压"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reader = snapshot.SnapshotReader(path)
+        try:
+            self.summary = self._reader.get("summary")
+            self.uids = self._reader.get("uids")
+            self.boxes = self._reader.get("boxes")
+            self.rooms = self._reader.get("rooms")
+        except Exception:
+            self._reader.close()
+            raise
+        self.day = self.summary["date"]
+
+    def __enter__(self) -> 'DayArchive':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.summary["count"]
+
+    def close(self):
+        self._reader.close()
+
+    def columns(self, names=COLUMNS) -> Iterator[Dict[str, array]]:
+        """逐块读取指定的列，每次返回 列名 -> array（user/box/room 为编号）"""
+        for chunk in range(self.summary["chunks"]):
+            yield {name: self._reader.get(f"{name}.{chunk}") for name in names}
+
+    def users(self) -> UserDirectory:
+        """当天的用户名表"""
+        return UserDirectory.from_dict(self._reader.get("users"))
+
+    def events(self) -> Iterator[Dict]:
+        """逐条还原为完整记录（用户名为当天最后的名字）"""
+        users = self.users()
+        for chunk in self.columns():
+            for ts, user, box, cost, value, room in zip(*(chunk[name] for name in COLUMNS)):
+                uid = self.uids[user]
+                yield {"ts": ts, "uid": uid, "uname": users.uname(uid), "blind_name": self.boxes[box],
+                       "cost": cost, "value": value, "room_id": self.rooms[room]}
+
+    def sketches(self) -> Optional[Dict]:
+        """当天的分位数估计（DailySketches.to_dict 格式）"""
+        return self._reader.get("sketches") if "sketches" in self._reader else None
+
+
+def archived_days(archive_dir: str, since: Optional[str] = None, until: Optional[str] = None) -> List[str]:
+    """已归档的日期（YYYY-MM-DD，含首尾），按日期排序"""
+    if not os.path.isdir(archive_dir):
+        return []
+    days = []
+    for name in os.listdir(archive_dir):
+        match = _ARCHIVE_PATTERN.match(name)
+        if match and (since is None or match.group(1) >= since) and (until is None or match.group(1) <= until):
+            days.append(match.group(1))
+    return sorted(days)
+
+
+def iter_archives(archive_dir: str, since: Optional[str] = None,
+                  until: Optional[str] = None) -> Iterator[DayArchive]:
+    """按日期顺序逐个打开归档，迭代到下一天时关闭上一天；损坏的归档跳过"""
+    for day in archived_days(archive_dir, since, until):
+        try:
+            archive = DayArchive(archive_path(archive_dir, day))
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] 读取 {day} 的归档失败: {e}")
+            continue
+        with archive:
+            yield archive
+
+
+def iter_summaries(archive_dir: str, since: Optional[str] = None,
+                   until: Optional[str] = None) -> Iterator[Dict]:
+    """各天的汇总"""
+    for archive in iter_archives(archive_dir, since, until):
+        yield archive.summary
+
+
+def iter_events(archive_dir: str, since: Optional[str] = None,
+                until: Optional[str] = None) -> Iterator[Dict]:
+    """多天的记录，按时间顺序逐条返回，同一时刻只解压一块"""
+    for archive in iter_archives(archive_dir, since, until):
+        yield from archive.events()
+
+
+def day_sketches(archive_dir: str, day: str) -> Optional[Dict]:
+    """某天归档中的分位数估计，没有归档时返回None"""
+    path = archive_path(archive_dir, day)
+    if not os.path.exists(path):
+        return None
+    with DayArchive(path) as archive:
+        return archive.sketches()
+
+
+def day_rows(data_dir: str, day: str, since: Optional[float] = None) -> List[Tuple[float, object, int, int]]:
+    """
+    某天时间戳不早于since的记录 (时间戳, uid, 花费, 价值)，按时间排序
+    已归档时逐块读取归档（整块早于since的跳过），否则读取 data/ 中的原始文件；都没有时返回空列表
+    """
+    path = archive_path(archive_dir_for(data_dir), day)
+    rows = []
+    if os.path.exists(path):
+        with DayArchive(path) as archive:
+            uids = archive.uids
+            for chunk in archive.columns(("ts", "user", "cost", "value")):
+                if since is not None and (not chunk["ts"] or chunk["ts"][-1] < since):
+                    continue
+                rows.extend((ts, uids[user], cost, value)
+                            for ts, user, cost, value in zip(chunk["ts"], chunk["user"], chunk["cost"], chunk["value"])
+                            if since is None or ts >= since)
+    else:
+        events, _, _, _ = read_day(data_dir, day)
+        rows = [(event["ts"], event["uid"], event["cost"], event["value"])
+                for event in events if since is None or event["ts"] >= since]
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+# ==================== 归档 ====================
+
+def source_files(data_dir: str, day: str) -> List[str]:
+    """某天在 data/ 中的原始文件"""
+    data_file = os.path.join(data_dir, f"blind_box_data_{day}.json")
+    events_file = os.path.join(data_dir, f"blind_box_events_{day}.jsonl")
+    candidates = [data_file, history_file(data_file),
+                  snapshot.snapshot_file(data_file), snapshot.snapshot_file(history_file(data_file)),
+                  events_file, records_file(events_file)]
+    return [path for path in candidates if os.path.exists(path)]
+
+
+def closed_days(data_dir: str, before: Optional[str] = None) -> List[str]:
+    """data/ 中早于before（默认今天）的日期"""
+    before = before or date.today().isoformat()
+    days = set()
+    for name in os.listdir(data_dir):
+        match = _DAY_PATTERN.match(name)
+        if match and match.group(1) < before:
+            days.add(match.group(1))
+    return sorted(days)
+
+
+def read_day(data_dir: str, day: str):
+    """
+    读取某天的原始数据，返回 (记录列表, 用户名表, 分位数估计数据或None, 来源)
+    有事件日志时以事件日志为准（含直播间，分位数估计按记录重算），否则从数据文件的历史记录读取
+    来源为 events（事件日志）、web（web_server/监听程序的数据文件）或 gui（GUI的数据文件）
+    """
+    data_file = os.path.join(data_dir, f"blind_box_data_{day}.json")
+    data = None
+    snap_file = snapshot.snapshot_file(data_file)
+    if os.path.exists(snap_file):
+        try:
+            data = snapshot.read_state(snap_file)
+        except (OSError, ValueError) as e:
+            print(f"[提示] {day} 的二进制快照不可用（{e}），改用JSON数据文件")
+    if data is None and os.path.exists(data_file):
+        with open(data_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    sketches = data.get("sketches") if data else None
+
+    events_file = os.path.join(data_dir, f"blind_box_events_{day}.jsonl")
+    if os.path.exists(events_file):
+        users = UserDirectory()
+        index = EventIndex(events_file, users=users)
+        created = not os.path.exists(records_file(events_file))
+        try:
+            index.load()
+            events = index.replay(0)
+        finally:
+            index.close()
+            if created and os.path.exists(records_file(events_file)):
+                # 加载事件日志时生成的定长记录文件，不留在原目录
+                os.remove(records_file(events_file))
+        # 数据文件是定期快照，其中的分位数估计可能少了最后几条记录
+        return events, users, None, "events"
+
+    if data is None:
+        return [], UserDirectory(), sketches, "web"
+    source = "gui" if "blind_box_count" in data else "web"
+    if data.get("blind_box_history") is not None:
+        events, users = gui_history_events(data["blind_box_history"], day)
+        return events, users, sketches, source
+    # JSON中的uid是字符串，转回整数
+    user_stats = {uid_key(uid): user for uid, user in data.get("user_stats", {}).items()}
+    if data.get("history_rows") is not None:
+        history_snap = snapshot.snapshot_file(history_file(data_file))
+        if os.path.exists(history_snap):
+            store = snapshot.load_history(history_snap, data["history_rows"])
+        else:
+            with open(history_file(data_file), 'r', encoding='utf-8') as f:
+                store = HistoryStore.from_dict(json.load(f), data["history_rows"])
+    elif data.get("history") is not None:
+        store = HistoryStore.from_dict(data["history"])
+    else:
+        store = HistoryStore.from_user_history(user_stats)
+    if data.get("users") is not None:
+        users = UserDirectory.from_dict(data["users"])
+    else:
+        users = UserDirectory.from_user_stats(user_stats)
+    events = [{"ts": store.ts[row], "uid": store.uid_at(row), "blind_name": store.box_at(row),
+               "cost": store.cost[row], "value": store.value[row], "room_id": None}
+              for row in range(len(store))]
+    return events, users, sketches, source
+
+
+def gui_history_events(records: List[Dict], day: str):
+    """
+    GUI旧格式的 blind_box_history：每条记录带用户名、盲盒名称和当天的时分秒，
+    金额为元（cost/value），较新的记录另有毫元整数 blind_price/gift_price
+    """
+    users = UserDirectory()
+    events = []
+    midnight = datetime.strptime(day, "%Y-%m-%d")
+    for record in records:
+        uid = uid_key(record.get("uid", 0))
+        if record.get("uname") is not None:
+            users.update(uid, record["uname"])
+        try:
+            clock = datetime.strptime(record["time"][-8:], "%H:%M:%S").time()
+            ts = datetime.combine(midnight.date(), clock).timestamp()
+        except (KeyError, ValueError):
+            ts = midnight.timestamp()
+        events.append({"ts": ts, "uid": uid, "blind_name": record.get("blind_name", "未知"),
+                       "cost": record.get("blind_price", to_milli(record.get("cost", 0))),
+                       "value": record.get("gift_price", to_milli(record.get("value", 0))),
+                       "room_id": None})
+    return events, users
+
+
+def build_archive(day: str, events: List[Dict], users: UserDirectory,
+                  sketches: Optional[Dict] = None) -> Tuple[bytes, Dict]:
+    """把一天的记录编码为归档文件内容，返回 (文件内容, 汇总)"""
+    uids = NameTable()
+    boxes = NameTable()
+    rooms = NameTable([None])
+    columns = {name: array(TYPECODES[name]) for name in COLUMNS}
+    summary = {"date": day, "count": 0, "cost": 0, "value": 0, "profit": 0,
+               "profit_count": 0, "loss_count": 0, "break_even_count": 0,
+               "users": 0, "first_ts": None, "last_ts": None, "boxes": {}, "rooms": {}}
+    rebuilt = DailySketches() if sketches is None else None
+
+    for event in events:
+        cost, value = event["cost"], event["value"]
+        blind_name = event["blind_name"]
+        room_id = event.get("room_id")
+        columns["ts"].append(int(event["ts"]))
+        columns["user"].append(uids.intern(event["uid"]))
+        columns["box"].append(boxes.intern(blind_name))
+        columns["cost"].append(cost)
+        columns["value"].append(value)
+        columns["room"].append(rooms.intern(room_id))
+
+        summary["count"] += 1
+        summary["cost"] += cost
+        summary["value"] += value
+        profit = value - cost
+        field = "profit_count" if profit > 0 else "loss_count" if profit < 0 else "break_even_count"
+        summary[field] += 1
+        box = summary["boxes"].setdefault(blind_name, [0, 0, 0])
+        box[0] += 1
+        box[1] += cost
+        box[2] += value
+        if room_id is not None:
+            summary["rooms"][str(room_id)] = summary["rooms"].get(str(room_id), 0) + 1
+        if rebuilt is not None:
+            rebuilt.add(event["uid"], blind_name, cost, value, room_id)
+
+    summary["profit"] = summary["value"] - summary["cost"]
+    summary["users"] = len(uids)
+    if columns["ts"]:
+        summary["first_ts"] = min(columns["ts"])
+        summary["last_ts"] = max(columns["ts"])
+    summary["chunks"] = (summary["count"] + CHUNK_ROWS - 1) // CHUNK_ROWS
+
+    sections = {
+        "summary": summary,
+        "uids": uids.names,
+        "boxes": boxes.names,
+        "rooms": rooms.names,
+        "users": users.to_dict(),
+        "sketches": sketches if sketches is not None else rebuilt.to_dict()
+    }
+    for chunk in range(summary["chunks"]):
+        start = chunk * CHUNK_ROWS
+        for name in COLUMNS:
+            sections[f"{name}.{chunk}"] = columns[name][start:start + CHUNK_ROWS]
+    return snapshot.encode(sections, compress=True), summary
+
+
+def write_archive(archive_dir: str, day: str, events: List[Dict], users: UserDirectory,
+                  sketches: Optional[Dict] = None) -> Tuple[Dict, int]:
+    """写入并读回核对一天的归档，返回 (汇总, 文件大小)；核对失败时删除归档并抛出RuntimeError"""
+    payload, summary = build_archive(day, events, users, sketches)
+    path = archive_path(archive_dir, day)
+    atomic_write(path, payload)
+    if not verify_archive(path, summary, events):
+        os.remove(path)
+        raise RuntimeError(f"{day} 的归档校验失败，已保留原文件")
+    return summary, len(payload)
+
+
+def verify_archive(path: str, summary: Dict, events: Optional[List[Dict]] = None) -> bool:
+    """
+    逐块读回归档，核对记录数和金额合计；
+    给出原记录时再逐条核对时间戳（整秒）、uid、盲盒名称、金额和直播间，全部一致才算通过
+    """
+    count = cost = value = 0
+    with DayArchive(path) as archive:
+        for chunk in archive.columns(("cost", "value")):
+            count += len(chunk["cost"])
+            cost += sum(chunk["cost"])
+            value += sum(chunk["value"])
+        if (count, cost, value) != (summary["count"], summary["cost"], summary["value"]):
+            return False
+        if events is None:
+            return True
+        if count != len(events):
+            return False
+        for event, restored in zip(events, archive.events()):
+            if (int(event["ts"]), event["uid"], event["blind_name"], event["cost"], event["value"],
+                    event.get("room_id")) != (restored["ts"], restored["uid"], restored["blind_name"],
+                                              restored["cost"], restored["value"], restored["room_id"]):
+                return False
+    return True
+
+
+def compact_day(data_dir: str, day: str, archive_dir: Optional[str] = None,
+                keep: bool = False) -> Optional[Dict]:
+    """归档一天的数据，成功后（keep为False时）删除原文件，返回汇总；没有记录时返回None"""
+    archive_dir = archive_dir or archive_dir_for(data_dir)
+    sources = source_files(data_dir, day)
+    events, users, sketches, _ = read_day(data_dir, day)
+    if not events:
+        print(f"[提示] {day} 没有盲盒记录，跳过")
+        return None
+
+    summary, size = write_archive(archive_dir, day, events, users, sketches)
+    original = sum(os.path.getsize(source) for source in sources)
+    print(f"[归档] {day}: {summary['count']}条记录，{original / 1e6:.2f}MB -> {size / 1e6:.2f}MB")
+    if not keep:
+        for source in sources:
+            os.remove(source)
+    return summary
+
+
+def compact(data_dir: str, archive_dir: Optional[str] = None, before: Optional[str] = None,
+            keep: bool = False) -> List[str]:
+    """归档 data/ 中今天（或before）之前的全部日期，返回已归档的日期"""
+    done = []
+    for day in closed_days(data_dir, before):
+        try:
+            if compact_day(data_dir, day, archive_dir, keep) is not None:
+                done.append(day)
+        except Exception as e:
+            print(f"[ERROR] 归档 {day} 失败: {e}")
+    return done
+
+
+# ==================== 命令行 ====================
+
+def print_summary(archive_dir: str, since: Optional[str], until: Optional[str], limit: int = 10):
+    """各天汇总，再逐块累计期间每个用户的花费"""
+    totals = {"count": 0, "cost": 0, "value": 0}
+    spend = {}
+    names = {}
+    for archive in iter_archives(archive_dir, since, until):
+        summary = archive.summary
+        print(f"{summary['date']}  {summary['count']:>8}个  花费{summary['cost'] / 1000:>12.2f}元  "
+              f"盈亏{summary['profit'] / 1000:>+12.2f}元  {summary['users']}人")
+        for key in totals:
+            totals[key] += summary[key]
+        for chunk in archive.columns(("user", "cost")):
+            for user, cost in zip(chunk["user"], chunk["cost"]):
+                uid = archive.uids[user]
+                spend[uid] = spend.get(uid, 0) + cost
+        users = archive.users()
+        for uid in archive.uids:
+            names[uid] = users.uname(uid)
+
+    print(f"合计 {totals['count']}个，花费{totals['cost'] / 1000:.2f}元，"
+          f"盈亏{(totals['value'] - totals['cost']) / 1000:+.2f}元")
+    for rank, (uid, cost) in enumerate(sorted(spend.items(), key=lambda item: -item[1])[:limit], 1):
+        print(f"{rank:>3}. {names.get(uid, uid)} ({uid})  花费{cost / 1000:.2f}元")
+
+
+def main():
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    args = sys.argv[1:]
+    if not args or args[0] not in ("compact", "summary"):
+        print(__doc__)
+        return
+    if args[0] == "compact":
+        days = compact(data_dir, keep="--keep" in args)
+        print(f"[归档] 共归档{len(days)}天")
+    else:
+        since = args[1] if len(args) > 1 else None
+        until = args[2] if len(args) > 2 else None
+        print_summary(archive_dir_for(data_dir), since, until)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+盲盒事件编解码
+监听器→Web服务器、Web服务器→浏览器两条链路共用
+优先使用 MessagePack 按字段顺序紧凑编码，未安装或对端不支持时回退到 JSON
+"""
+
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖，缺失时只使用JSON
+    msgpack = None
+
+ENCODING_JSON = 'json'
+ENCODING_MSGPACK = 'msgpack'
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_MSGPACK = 'application/x-msgpack'
+
+# 监听器上报的事件字段（按位置编码，不再重复传输键名；新字段只能追加在末尾）
+EVENT_FIELDS = ('uid', 'uname', 'blind_name', 'blind_price', 'gift_price', 'room_id')
+
+# 推送给浏览器的单条盲盒记录字段
+RECORD_FIELDS = ('time', 'uname', 'blind_name', 'cost', 'value', 'profit')
+
+
+def available_encodings() -> List[str]:
+    """本进程支持的编码，按优先级排列"""
+    if msgpack is not None:
+        return [ENCODING_MSGPACK, ENCODING_JSON]
+    return [ENCODING_JSON]
+
+
+def negotiate(offered: Iterable[str]) -> str:
+    """从对端提供的编码列表中选出双方都支持的最优编码"""
+    offered = set(offered or [])
+    for encoding in available_encodings():
+        if encoding in offered:
+            return encoding
+    return ENCODING_JSON
+
+
+def content_type_for(encoding: str) -> str:
+    """编码对应的HTTP Content-Type"""
+    if encoding == ENCODING_MSGPACK:
+        return CONTENT_TYPE_MSGPACK
+    return CONTENT_TYPE_JSON
+
+
+def pack(payload, fields: Optional[Tuple[str, ...]] = None) -> bytes:
+    """
+    MessagePack编码
+    指定fields时把字典按字段顺序压成数组，接收方按同样的顺序还原
+    """
+    if msgpack is None:
+        raise RuntimeError("未安装msgpack，无法使用二进制编码")
+    if fields is not None:
+        payload = [payload.get(field) for field in fields]
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def pack_records(records: List[Dict], fields: Tuple[str, ...]) -> bytes:
+    """把一组记录编码为二维数组，字段名只在协商时传输一次"""
+    return pack([[record.get(field) for field in fields] for record in records])
+
+
+def unpack(data: bytes, fields: Optional[Tuple[str, ...]] = None):
+    """MessagePack解码，与pack对应"""
+    if msgpack is None:
+        raise RuntimeError("未安装msgpack，无法使用二进制编码")
+    payload = msgpack.unpackb(data, raw=False)
+    if fields is not None and isinstance(payload, list):
+        payload = dict(zip(fields, payload))
+    return payload
+
+
+def encode_event(event: Dict, encoding: str) -> Tuple[bytes, str]:
+    """编码一条监听器事件，返回 (请求体, Content-Type)"""
+    if encoding == ENCODING_MSGPACK and msgpack is not None:
+        return pack(event, EVENT_FIELDS), CONTENT_TYPE_MSGPACK
+    return json.dumps(event, ensure_ascii=False).encode('utf-8'), CONTENT_TYPE_JSON
+
+
+def decode_event(body: bytes, content_type: Optional[str]) -> Dict:
+    """按Content-Type解码监听器事件，未知类型按JSON处理"""
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    if mimetype == CONTENT_TYPE_MSGPACK:
+        return unpack(body, EVENT_FIELDS)
+    return json.loads(body.decode('utf-8')) if body else {}
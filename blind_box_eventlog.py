@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定长事件记录文件
+每条事件占固定字节数，第N条位于 N * RECORD.size，读取时用mmap映射文件：
+按序号翻页、读最新的几条、按时间二分查找都直接从映射区解包，
+不需要偏移表、时间戳列或内存缓冲区，内存占用与当天事件数无关
+
+字符串字段只保存编号（用户编号、盲盒类型编号、直播间编号），名称表由调用方维护
+    时间戳(double) 用户编号(uint32) 花费(uint32) 价值(uint32) 盲盒类型编号(uint16) 直播间编号(uint16)
+金额为毫元整数，小端
+"""
+
+import mmap
+import os
+import struct
+import threading
+from typing import Optional, Tuple
+
+RECORD = struct.Struct("<dIIIHH")
+_TS = struct.Struct("<d")
+
+
+class FixedEventLog:
+    """
+    定长记录的只追加文件（path为None时保存在内存中）
+    记录为元组 (ts, 用户编号, 花费, 价值, 盲盒类型编号, 直播间编号)，时间戳应单调不减
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._memory = bytearray() if path is None else None
+        self._writer = None
+        self._map = None
+        self._mapped = 0       # 映射区包含的记录数
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def open(self) -> int:
+        """按文件大小得到记录数，崩溃留下的半条记录截掉，返回记录数"""
+        with self._lock:
+            self._unmap()
+            if self.path is None or not os.path.exists(self.path):
+                self._count = 0
+                return 0
+            size = os.path.getsize(self.path)
+            self._count = size // RECORD.size
+            if size != self._count * RECORD.size:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self._count * RECORD.size)
+            return self._count
+
+    # ==================== 写入 ====================
+
+    def append(self, ts: float, user: int, cost: int, value: int, box: int, room: int = 0,
+               flush: bool = True) -> int:
+        """追加一条记录，返回序号；flush为False时（批量重建）由调用方最后调用flush"""
+        packed = RECORD.pack(ts, user, cost, value, box, room)
+        with self._lock:
+            if self._memory is not None:
+                self._memory += packed
+            else:
+                writer = self._open_writer()
+                writer.write(packed)
+                if flush:
+                    writer.flush()
+            self._count += 1
+            return self._count - 1
+
+    def flush(self):
+        with self._lock:
+            if self._writer:
+                self._writer.flush()
+
+    def truncate(self, count: int):
+        """只保留前count条记录"""
+        with self._lock:
+            count = max(0, min(count, self._count))
+            if self._memory is not None:
+                del self._memory[count * RECORD.size:]
+            else:
+                # Windows下映射中的文件不能截断，先解除映射
+                self._unmap()
+                self._close_writer()
+                if os.path.exists(self.path):
+                    with open(self.path, 'r+b') as f:
+                        f.truncate(count * RECORD.size)
+            self._count = count
+
+    def close(self):
+        with self._lock:
+            self._unmap()
+            self._close_writer()
+
+    # ==================== 读取 ====================
+
+    def read(self, seq: int) -> Tuple:
+        """第seq条记录"""
+        with self._lock:
+            return RECORD.unpack_from(self._buffer(seq), seq * RECORD.size)
+
+    def ts_at(self, seq: int) -> float:
+        with self._lock:
+            return _TS.unpack_from(self._buffer(seq), seq * RECORD.size)[0]
+
+    def bisect_left(self, ts: float, lo: int = 0, hi: Optional[int] = None) -> int:
+        """第一条时间戳 >= ts 的序号"""
+        return self._bisect(ts, lo, hi, right=False)
+
+    def bisect_right(self, ts: float, lo: int = 0, hi: Optional[int] = None) -> int:
+        """第一条时间戳 > ts 的序号"""
+        return self._bisect(ts, lo, hi, right=True)
+
+    # ==================== 内部实现 ====================
+
+    def _bisect(self, ts: float, lo: int, hi: Optional[int], right: bool) -> int:
+        with self._lock:
+            hi = self._count if hi is None else min(hi, self._count)
+            if lo >= hi:
+                return lo
+            buffer = self._buffer(hi - 1)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                value = _TS.unpack_from(buffer, mid * RECORD.size)[0]
+                if value < ts or (right and value == ts):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+    def _buffer(self, seq: int):
+        """包含第seq条记录的缓冲区；文件追加后映射区不够时重新映射"""
+        if seq < 0 or seq >= self._count:
+            raise IndexError(seq)
+        if self._memory is not None:
+            return self._memory
+        if self._map is None or seq >= self._mapped:
+            self._unmap()
+            if self._writer:
+                self._writer.flush()
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), self._count * RECORD.size, access=mmap.ACCESS_READ)
+            self._mapped = self._count
+        return self._map
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._mapped = 0
+
+    def _open_writer(self):
+        """懒打开记录文件（追加模式）"""
+        if self._writer is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._writer = open(self.path, 'ab')
+        return self._writer
+
+    def _close_writer(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
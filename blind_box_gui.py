@@ -18,6 +18,8 @@ import hashlib
 import urllib.parse
 import re
 import os
+import functools
+import threading
 from pathlib import Path
 from datetime import datetime, date
 from typing import Dict, List, Optional, Tuple
@@ -30,6 +32,12 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
 from PyQt5.QtGui import QColor, QFont, QBrush
 
+from blind_box_lifetime import LIFETIME_FILE, LifetimeIndex, combine
+from blind_box_persist import SnapshotWriter
+from blind_box_store import HistoryStore, UserDirectory, history_file, to_yuan, to_milli, uid_key
+from blind_box_sqlite import SqliteStore
+from blind_box_wal import LogWriter, WriteAheadLog
+
 # ==================== 配置 ====================
 MIXIN_KEY_ENC_TAB = [
     46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
@@ -44,6 +52,14 @@ DEFAULT_COOKIE = ""  # 用户需要填入自己的Cookie
 WEB_SERVER_URL = "http://localhost:5000"
 DATA_DIR = Path("data")  # 数据保存目录
 DATA_FILE = DATA_DIR / f"blind_box_data_{date.today().isoformat()}.json"  # 当日数据文件
+TABLE_ROWS = 100  # 表格显示的最近记录数，随汇总一起保存，启动时不用读取历史记录
+SQLITE_FILE = DATA_DIR / "blind_box_gui.db"  # 可选的SQLite存储（gui_settings.json 中 "sqlite": true 启用）
+LIFETIME_PATH = DATA_DIR / LIFETIME_FILE  # 跨日期的用户累计统计
+WAL_FILE_FORMAT = "blind_box_gui_wal_{}.jsonl"  # 每天的预写日志：入库时追加，写入完整的历史记录后清空
+SNAPSHOT_INTERVAL = 60  # 数据文件快照间隔（秒），期间的记录只追加到预写日志
+SNAPSHOT_EVENTS = 1000  # 距上次快照新增这么多条记录时提前保存快照
+ENCODE_CHUNK = 16384  # 历史记录按块编码的行数
+HISTORY_POLL_MS = 200  # 后台读取历史记录期间，检查是否读完的间隔（毫秒）
 # ==============================================
 
 
@@ -431,6 +447,8 @@ class BlindBoxListenerThread(QThread):
                                                         'gift_name': gift_display,  # 爆出礼物（显示价格）
                                                         'cost': blind_price_yuan,
                                                         'value': gift_price_yuan,
+                                                        'blind_price': blind_price,  # 毫元，用于累计
+                                                        'gift_price': gift_price,
                                                         'profit': profit,
                                                         'time': datetime.now().strftime("%H:%M:%S")
                                                     })
@@ -473,7 +491,8 @@ class BlindBoxListenerThread(QThread):
                     'blind_name': blind_box_name,
                     'blind_price': blind_price,
                     'gift_price': gift_price,
-                    'gift_name': gift_name  # 爆出礼物名称（为未来扩展预留）
+                    'gift_name': gift_name,  # 爆出礼物名称（为未来扩展预留）
+                    'room_id': self.room_id
                 },
                 timeout=1
             )
@@ -487,6 +506,53 @@ class BlindBoxListenerThread(QThread):
             self.loop.call_soon_threadsafe(self.stop_event.set)
 
 
+def encode_header(data: dict) -> bytes:
+    """数据文件（汇总）和设置文件保持缩进格式，便于查看"""
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def encode_history(columns: dict) -> bytes:
+    """
+    历史记录列数组（HistoryStore.to_columns）编码为JSON列格式，在写入线程执行
+    长列按块转换，每块只占用GIL几毫秒，整段编码不会卡住界面线程
+    wal_seq 为写入时预写日志的序号，读取时从这里补齐之后的记录
+    """
+    parts = [f'{{"wal_seq":{columns.get("wal_seq", 0)},"uids":'.encode('ascii'),
+             json.dumps(columns["uids"], ensure_ascii=False).encode('utf-8'),
+             b',"boxes":', json.dumps(columns["boxes"], ensure_ascii=False).encode('utf-8')]
+    for name in ("ts", "uid", "box", "cost", "value"):
+        values = columns[name]
+        parts.append(f',"{name}":['.encode('ascii'))
+        for start in range(0, len(values), ENCODE_CHUNK):
+            if start:
+                parts.append(b",")
+            parts.append(",".join(map(str, values[start:start + ENCODE_CHUNK])).encode('ascii'))
+        parts.append(b"]")
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+def load_history(path: str, rows: int, wal: WriteAheadLog, stop: int) -> HistoryStore:
+    """
+    读取单独保存的历史记录（供 HistoryStore.deferred 使用，在后台线程执行）
+    文件只在换日和退出前写入，之后的记录从当天的预写日志中补齐（文件的 wal_seq 到汇总的 wal_seq）；
+    文件缺失或损坏时从预写日志重建
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        store = HistoryStore.from_dict(data, rows)
+        start = data.get('wal_seq', 0)
+    except (OSError, ValueError) as e:
+        print(f"[提示] 历史记录 {path} 不可用（{e}），从预写日志重建")
+        store, start = HistoryStore(), 0
+    for record in wal.read(start, stop):
+        if len(store) >= rows:
+            break
+        store.append(record['uid'], record['blind_name'], record['cost'], record['value'], ts=record['ts'])
+    return store
+
+
 # ==================== 主窗口 ====================
 
 class BlindBoxStatsWindow(QMainWindow):
@@ -498,9 +564,21 @@ class BlindBoxStatsWindow(QMainWindow):
         self.blind_box_count = 0
         self.profit_count = 0  # 盈利盲盒数量
         self.loss_count = 0  # 亏损盲盒数量
-        self.total_profit = 0.0
-        self.user_stats = {}
-        self.blind_box_history = []  # 盲盒历史记录
+        self.total_profit = 0  # 总盈亏（毫元）
+        self.user_stats = {}  # uid -> 统计，金额均为毫元整数
+        self.user_names = UserDirectory()  # uid -> 当前用户名
+        self.history = HistoryStore()  # 盲盒历史记录（列式存储，盲盒名称按编号保存）
+        self.pending_history = []  # 后台读取历史记录期间入库的记录，读完后再追加
+        self.recent_records = []  # 表格中的最近记录（time/uname/blind_name/profit），最旧的在前
+        self.db_store = None  # SQLite存储，按设置启用，保存全部日期的记录供按范围查询
+        self.lifetime = LifetimeIndex(str(LIFETIME_PATH))  # uid -> 之前各天的累计统计
+
+        # 界面线程不读写文件：快照和预写日志分别由后台线程写入
+        self.snapshot_writer = SnapshotWriter("gui-snapshot-writer")
+        self.log_writer = LogWriter("gui-wal-writer")
+        self.wal = None  # 当天的预写日志
+        self.logged = 0  # 当天已入库的记录数（下一条记录在预写日志中的序号）
+        self.snapshot_seq = 0  # 最近一次快照包含的记录数
 
         # 确保数据目录存在
         DATA_DIR.mkdir(exist_ok=True)
@@ -510,7 +588,15 @@ class BlindBoxStatsWindow(QMainWindow):
 
         self.init_ui()
         self.load_settings()
+        self.recover_logs()  # 之前日期没保存完的记录
+        self.reset_day(date.today())
         self.load_data()  # 加载保存的数据
+        self.start_lifetime_catch_up()
+
+        # 定时保存快照，两次快照之间的记录已在预写日志中
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.timeout.connect(self.save_if_pending)
+        self.snapshot_timer.start(SNAPSHOT_INTERVAL * 1000)
 
         # 定时检查日期变更（每分钟检查一次）
         self.date_check_timer = QTimer(self)
@@ -550,6 +636,16 @@ class BlindBoxStatsWindow(QMainWindow):
         self.start_btn.clicked.connect(self.toggle_monitoring)
         config_layout.addWidget(self.start_btn)
 
+        config_layout.addWidget(QLabel("查询UID:"))
+        self.lookup_input = QLineEdit()
+        self.lookup_input.setFixedWidth(120)
+        self.lookup_input.returnPressed.connect(self.show_lifetime)
+        config_layout.addWidget(self.lookup_input)
+        lookup_btn = QPushButton("累计")
+        lookup_btn.setFixedWidth(80)
+        lookup_btn.clicked.connect(self.show_lifetime)
+        config_layout.addWidget(lookup_btn)
+
         config_group.setLayout(config_layout)
         main_layout.addWidget(config_group)
 
@@ -789,17 +885,19 @@ class BlindBoxStatsWindow(QMainWindow):
                 settings = json.load(f)
                 self.room_input.setText(settings.get('room_id', DEFAULT_ROOM_ID))
                 self.cookie_input.setText(settings.get('cookie', ''))
+                if settings.get('sqlite'):
+                    self.db_store = SqliteStore(str(SQLITE_FILE))
         except:
             pass
 
     def save_settings(self):
-        """保存设置"""
+        """保存设置（由写入线程写入）"""
         try:
-            with open('gui_settings.json', 'w', encoding='utf-8') as f:
-                json.dump({
-                    'room_id': self.room_input.text(),
-                    'cookie': self.cookie_input.text()
-                }, f, ensure_ascii=False, indent=2)
+            self.snapshot_writer.submit('gui_settings.json', {
+                'room_id': self.room_input.text(),
+                'cookie': self.cookie_input.text(),
+                'sqlite': self.db_store is not None
+            }, encode=encode_header)
         except:
             pass
 
@@ -901,46 +999,100 @@ class BlindBoxStatsWindow(QMainWindow):
         self.stop_monitoring()
 
     def on_blind_box(self, data: dict):
-        """新盲盒数据"""
+        """新盲盒数据：累加统计，记录交给后台线程追加到预写日志"""
+        ts = time.time()
+        uid = data['uid']
+        self.apply_event(ts, uid, data['uname'], data['blind_name'], data['blind_price'], data['gift_price'])
+        self.log_writer.append(self.wal, {
+            'ts': ts,
+            'uid': uid,
+            'uname': data['uname'],
+            'blind_name': data['blind_name'],
+            'cost': data['blind_price'],
+            'value': data['gift_price']
+        })
+        self.logged += 1
+
+        if self.db_store is not None:
+            # 只进缓冲区，由写入线程按间隔批量写入
+            self.db_store.add(ts, uid, data['uname'], data['blind_name'],
+                              data['blind_price'], data['gift_price'],
+                              self.listener_thread.room_id if self.listener_thread else None)
+
+        # 更新显示
+        self.update_stats_display()
+        self.add_table_row(data)
+
+        # 新增记录较多时提前保存快照，否则由定时器保存
+        if self.logged - self.snapshot_seq >= SNAPSHOT_EVENTS:
+            self.save_data()
+
+        # 日志
+        profit_str = f"{data['profit']:+.2f}"
+        total = combine(self.lifetime.get(uid), self.user_stats[uid])
+        self.log(f"[盲盒 #{self.blind_box_count}] {data['uname']} - {data['blind_name']}: {profit_str}元"
+                 f"（累计{total['count']}个 {to_yuan(total['value'] - total['cost']):+.2f}元）")
+
+    def apply_event(self, ts: float, uid, uname: str, blind_name: str, blind_price: int, gift_price: int):
+        """把一条记录累加到统计（入库和重放预写日志共用）"""
         self.blind_box_count += 1
 
+        # 累计使用毫元整数，避免浮点误差
+        profit = gift_price - blind_price
+
         # 更新盈利/亏损计数
-        if data['profit'] > 0:
+        if profit > 0:
             self.profit_count += 1
-        elif data['profit'] < 0:
+        elif profit < 0:
             self.loss_count += 1
 
-        self.total_profit += data['profit']
+        self.total_profit += profit
 
         # 更新用户统计
-        uid = data['uid']
+        self.user_names.update(uid, uname)
         if uid not in self.user_stats:
             self.user_stats[uid] = {
-                'uname': data['uname'],
                 'count': 0,
-                'cost': 0.0,
-                'value': 0.0,
-                'profit': 0.0
+                'cost': 0,
+                'value': 0,
+                'profit': 0,
+                'first_ts': ts
             }
 
         self.user_stats[uid]['count'] += 1
-        self.user_stats[uid]['cost'] += data['cost']
-        self.user_stats[uid]['value'] += data['value']
-        self.user_stats[uid]['profit'] += data['profit']
-
-        # 添加到历史记录
-        self.blind_box_history.append(data)
-
-        # 更新显示
-        self.update_stats_display()
-        self.add_table_row(data)
-
-        # 自动保存数据
-        self.save_data()
-
-        # 日志
-        profit_str = f"{data['profit']:+.2f}"
-        self.log(f"[盲盒 #{self.blind_box_count}] {data['uname']} - {data['blind_name']}: {profit_str}元")
+        self.user_stats[uid]['cost'] += blind_price
+        self.user_stats[uid]['value'] += gift_price
+        self.user_stats[uid]['profit'] += profit
+        self.user_stats[uid]['last_ts'] = ts
+
+        # 添加到历史记录；后台还没读完时先排队，界面线程不等待读取
+        if self.history.loaded and not self.pending_history:
+            self.history.append(uid, blind_name, blind_price, gift_price, ts=ts)
+        else:
+            if not self.pending_history:
+                QTimer.singleShot(HISTORY_POLL_MS, self.apply_pending_history)
+            self.pending_history.append((uid, blind_name, blind_price, gift_price, ts))
+        self.recent_records.append({
+            'time': datetime.fromtimestamp(ts).strftime("%H:%M:%S"),
+            'uname': uname,
+            'blind_name': blind_name,
+            'profit': to_yuan(profit)
+        })
+        del self.recent_records[:-TABLE_ROWS]
+
+    def apply_pending_history(self, wait: bool = False):
+        """
+        历史记录读完后追加排队的记录；还没读完时稍后再检查，
+        wait为True时（换日、退出前写入完整的历史记录）等待读取完成
+        """
+        if not self.pending_history:
+            return
+        if not self.history.loaded and not wait:
+            QTimer.singleShot(HISTORY_POLL_MS, self.apply_pending_history)
+            return
+        for uid, blind_name, blind_price, gift_price, ts in self.pending_history:
+            self.history.append(uid, blind_name, blind_price, gift_price, ts=ts)
+        self.pending_history = []
 
     def on_status_update(self, status: str):
         """状态更新"""
@@ -972,7 +1124,7 @@ class BlindBoxStatsWindow(QMainWindow):
         self.profit_count_label.setText(str(self.profit_count))
         self.loss_count_label.setText(str(self.loss_count))
 
-        profit_str = f"{self.total_profit:+.2f}"
+        profit_str = f"{to_yuan(self.total_profit):+.2f}"
         self.profit_label.setText(profit_str)
 
         # 根据盈亏设置颜色 - 蓝色系配色
@@ -1036,6 +1188,43 @@ class BlindBoxStatsWindow(QMainWindow):
         if self.table.rowCount() > 100:
             self.table.removeRow(100)
 
+    def start_lifetime_catch_up(self):
+        """后台读取用户累计统计，并累加今天之前尚未累加的日期（不阻塞界面）"""
+        def catch_up():
+            try:
+                # 换日时刚提交的前一天快照写完后再读取
+                self.snapshot_writer.flush()
+                if not self.lifetime.days:
+                    self.lifetime.load()
+                self.lifetime.catch_up(str(DATA_DIR), before=self.current_data_date.isoformat())
+            except Exception as e:
+                print(f"[错误] 更新用户累计统计失败: {e}")
+
+        threading.Thread(target=catch_up, name="lifetime-catch-up", daemon=True).start()
+
+    def show_lifetime(self):
+        """显示输入的uid有记录以来的累计统计（之前各天 + 今天）"""
+        text = self.lookup_input.text().strip()
+        if not text:
+            return
+        uid = uid_key(text)
+        total = combine(self.lifetime.get(uid), self.user_stats.get(uid))
+        if total is None:
+            QMessageBox.information(self, "累计统计", f"没有UID {text} 的记录")
+            return
+
+        def when(ts):
+            return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M") if ts is not None else "未知"
+
+        uname = self.user_names.uname(uid, total['uname'] or "未知")
+        QMessageBox.information(self, "累计统计", "\n".join([
+            f"{uname}（{uid}）",
+            f"盲盒 {total['count']} 个，活跃 {total['days']} 天",
+            f"花费 {to_yuan(total['cost']):.2f} 元，价值 {to_yuan(total['value']):.2f} 元",
+            f"盈亏 {to_yuan(total['value'] - total['cost']):+.2f} 元",
+            f"首次 {when(total['first_seen'])}，最近 {when(total['last_seen'])}"
+        ]))
+
     def log(self, message: str):
         """输出日志"""
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -1045,91 +1234,226 @@ class BlindBoxStatsWindow(QMainWindow):
         """检查日期是否变更"""
         today = date.today()
         if today != self.current_data_date:
-            # 日期已变更，保存旧数据并初始化新数据
+            # 日期已变更，保存旧数据（写完后删除旧日期的预写日志）并初始化新数据
             self.log(f"日期已变更，保存 {self.current_data_date} 的数据")
-            self.save_data()
+            self.save_data(retire=True)
 
             # 重置统计数据
-            self.current_data_date = today
-            self.blind_box_count = 0
-            self.profit_count = 0
-            self.loss_count = 0
-            self.total_profit = 0.0
-            self.user_stats = {}
-            self.blind_box_history = []
-            self.table.setRowCount(0)
+            self.reset_day(today)
+            self.start_lifetime_catch_up()
 
             self.update_stats_display()
             self.log(f"新的一天开始！数据已重置")
 
-    def save_data(self):
-        """保存数据到文件"""
+    def reset_day(self, day: date):
+        """清空统计，换到某一天的数据文件和预写日志（日志文件在第一次追加时才打开）"""
+        self.current_data_date = day
+        self.blind_box_count = 0
+        self.profit_count = 0
+        self.loss_count = 0
+        self.total_profit = 0
+        self.user_stats = {}
+        self.user_names = UserDirectory()
+        self.history = HistoryStore()
+        self.pending_history = []
+        self.recent_records = []
+        self.table.setRowCount(0)
+        self.wal = WriteAheadLog(str(DATA_DIR / WAL_FILE_FORMAT.format(day.isoformat())))
+        self.logged = 0
+        self.snapshot_seq = 0
+
+    def save_if_pending(self):
+        """定时快照：上次快照之后有新记录才保存"""
+        if self.logged > self.snapshot_seq:
+            self.save_data()
+
+    def save_data(self, final: bool = False, retire: bool = False):
+        """
+        保存快照到数据文件
+        界面线程只取一份副本（各结构的 to_dict 返回新对象），
+        编码和写入（临时文件 + fsync + rename）在后台写入线程完成
+        汇总里只记历史记录的行数、表格显示的最近记录和包含的记录数 wal_seq；
+        定期快照不重写历史记录，也不清空预写日志，启动时文件之后的记录从预写日志补齐
+        final为True时（退出前）另外写入完整的历史记录（先于汇总写入），写完后清空预写日志，
+        retire为True时（换日）同样写入，之后删除该天的预写日志
+        """
         try:
+            data_file = str(DATA_DIR / f"blind_box_data_{self.current_data_date.isoformat()}.json")
+            wal, wal_seq = self.wal, self.logged
+            final = final or retire
+            if final:
+                self.apply_pending_history(wait=True)
+                columns = self.history.to_columns()
+                columns['wal_seq'] = wal_seq
+                self.snapshot_writer.submit(history_file(data_file), columns, encode=encode_history)
+
             data = {
                 'date': self.current_data_date.isoformat(),
+                'money_unit': 'milli',  # 金额单位：毫元整数
+                'wal_seq': wal_seq,
                 'blind_box_count': self.blind_box_count,
                 'profit_count': self.profit_count,
                 'loss_count': self.loss_count,
                 'total_profit': self.total_profit,
-                'user_stats': self.user_stats,
-                'blind_box_history': self.blind_box_history
+                'user_stats': {uid: dict(user) for uid, user in self.user_stats.items()},
+                'users': self.user_names.to_dict(),
+                'history_rows': len(self.history) + len(self.pending_history),
+                'recent': list(self.recent_records)
             }
 
-            # 使用当前日期的数据文件
-            data_file = DATA_DIR / f"blind_box_data_{self.current_data_date.isoformat()}.json"
+            def saved():
+                # 在日志写入线程清空（或删除）日志，排在快照之前入库的记录之后
+                if final:
+                    self.log_writer.call(lambda: wal.remove(wal_seq) if retire else wal.truncate(wal_seq))
+                print(f"[保存] 数据已保存到 {data_file}")
 
-            with open(data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-
-            print(f"[保存] 数据已保存到 {data_file}")
+            self.snapshot_writer.submit(data_file, data, saved, encode=encode_header)
+            self.snapshot_seq = wal_seq
         except Exception as e:
             print(f"[错误] 保存数据失败: {e}")
 
     def load_data(self):
-        """从文件加载数据"""
+        """加载当前日期的快照，再重放预写日志中快照之后的记录，恢复表格显示"""
+        wal_seq = self.load_snapshot()
+
+        replayed = 0
         try:
-            # 使用当日的数据文件
-            data_file = DATA_DIR / f"blind_box_data_{date.today().isoformat()}.json"
+            for record in self.wal.replay(wal_seq):
+                self.apply_event(record['ts'], record['uid'], record['uname'], record['blind_name'],
+                                 record['cost'], record['value'])
+                replayed += 1
+        except Exception as e:
+            print(f"[错误] 重放预写日志失败: {e}")
+        if replayed:
+            print(f"[加载] 已从预写日志重放快照之后的{replayed}条记录")
+        self.snapshot_seq = wal_seq
+        self.logged = self.wal.seq
+
+        # 恢复表格显示
+        self.restore_table_from_history()
+
+        # 更新统计显示
+        self.update_stats_display()
+
+    def load_snapshot(self) -> int:
+        """从数据文件加载快照，返回快照包含的记录数（预写日志从这里开始重放）"""
+        try:
+            # 使用当前日期的数据文件
+            data_file = DATA_DIR / f"blind_box_data_{self.current_data_date.isoformat()}.json"
 
             if not data_file.exists():
-                print(f"[提示] 未找到今日数据文件，从空白开始")
-                return
+                print(f"[提示] 未找到 {self.current_data_date} 的数据文件，从空白开始")
+                return 0
 
             with open(data_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
 
             # 检查日期是否匹配（防止跨天问题）
-            if data.get('date') != date.today().isoformat():
+            if data.get('date') != self.current_data_date.isoformat():
                 print(f"[提示] 数据文件日期不匹配，创建新记录")
-                return
+                return 0
 
             # 加载数据
             self.blind_box_count = data.get('blind_box_count', 0)
             self.profit_count = data.get('profit_count', 0)
             self.loss_count = data.get('loss_count', 0)
-            self.total_profit = data.get('total_profit', 0.0)
-            self.user_stats = data.get('user_stats', {})
-            self.blind_box_history = data.get('blind_box_history', [])
-
-            # 恢复表格显示
-            self.restore_table_from_history()
-
-            # 更新统计显示
-            self.update_stats_display()
+            self.total_profit = data.get('total_profit', 0)
+            # JSON的键总是字符串，uid转回整数，否则同一用户会出现两条统计
+            self.user_stats = {uid_key(uid): user for uid, user in data.get('user_stats', {}).items()}
+
+            # 旧版本按元累加浮点金额，转换为毫元整数
+            if data.get('money_unit') != 'milli':
+                self.total_profit = to_milli(self.total_profit)
+                for user in self.user_stats.values():
+                    user['cost'] = to_milli(user.get('cost', 0))
+                    user['value'] = to_milli(user.get('value', 0))
+                    user['profit'] = user['value'] - user['cost']
+
+            # 历史记录单独保存的新格式在后台读取，表格用汇总里的最近记录恢复
+            self.recent_records = []
+            if 'history_rows' in data:
+                self.user_names = UserDirectory.from_dict(data.get('users', {}))
+                self.history = HistoryStore.deferred(
+                    history_file(data_file), data['history_rows'],
+                    functools.partial(load_history, wal=self.wal, stop=data.get('wal_seq', 0)))
+                self.history.prefetch()
+                self.recent_records = data.get('recent', [])
+            elif 'history' in data:
+                self.user_names = UserDirectory.from_dict(data.get('users', {}))
+                self.history = HistoryStore.from_dict(data['history'])
+            else:
+                self._load_legacy_history(data.get('blind_box_history', []))
+            for user in self.user_stats.values():
+                user.pop('uname', None)
 
             print(f"[加载] 数据已加载，共 {self.blind_box_count} 个盲盒记录")
+            # 旧数据文件没有wal_seq，也没有预写日志
+            return data.get('wal_seq', 0)
         except Exception as e:
             print(f"[错误] 加载数据失败: {e}")
+            return 0
+
+    def recover_logs(self):
+        """
+        启动时处理之前日期留下的预写日志（崩溃，或换日时旧日志还没删除）：
+        加载该天的快照并重放日志，保存后删除日志
+        """
+        prefix, suffix = WAL_FILE_FORMAT.split("{}")
+        for path in sorted(DATA_DIR.glob(WAL_FILE_FORMAT.format("*"))):
+            try:
+                day = date.fromisoformat(path.name[len(prefix):-len(suffix)])
+            except ValueError:
+                continue
+            if day >= date.today():
+                continue
+            print(f"[加载] 恢复 {day} 预写日志中的记录")
+            self.reset_day(day)
+            self.load_data()
+            self.save_data(retire=True)
+        # 之前日期的数据写完后再加载今天（启动时窗口还没显示）
+        self.snapshot_writer.flush()
+        self.log_writer.flush()
+
+    def _load_legacy_history(self, records: list):
+        """旧格式：每条历史记录都带用户名和盲盒名称，转换为用户名表和列式存储"""
+        self.user_names = UserDirectory.from_user_stats(self.user_stats)
+        self.history = HistoryStore()
+        for record in records:
+            uid = record.get('uid', 0)
+            self.user_names.update(uid, record.get('uname', '未知'))
+            try:
+                ts = datetime.combine(self.current_data_date,
+                                      datetime.strptime(record['time'], "%H:%M:%S").time()).timestamp()
+            except (KeyError, ValueError):
+                ts = None
+            self.history.append(uid, record.get('blind_name', '未知'),
+                                record.get('blind_price', to_milli(record.get('cost', 0))),
+                                record.get('gift_price', to_milli(record.get('value', 0))),
+                                ts=ts)
+
+    def history_record(self, row: int) -> dict:
+        """列式历史记录中的一行还原为表格显示用的记录"""
+        record = self.history.row(row)
+        record['time'] = record['time'][-8:]
+        record['uname'] = self.user_names.uname(self.history.uid_at(row))
+        return record
+
+    @staticmethod
+    def recent_record(record: dict) -> dict:
+        """表格显示需要的字段，随汇总保存"""
+        return {key: record[key] for key in ('time', 'uname', 'blind_name', 'profit')}
 
     def restore_table_from_history(self):
-        """从历史记录恢复表格"""
+        """从最近记录恢复表格（旧格式从历史记录取最近的记录）"""
         # 清空表格
         self.table.setRowCount(0)
 
-        # 恢复最近100条记录
-        recent_records = self.blind_box_history[-100:] if len(self.blind_box_history) > 100 else self.blind_box_history
+        if not self.recent_records and self.history.loaded:
+            self.recent_records = [self.recent_record(self.history_record(row)) for row in
+                                   range(max(0, len(self.history) - TABLE_ROWS), len(self.history))]
 
-        for record in reversed(recent_records):  # 倒序插入，最新的在最上面
+        # 按时间顺序插入，最新的在最上面
+        for record in self.recent_records:
             self.add_table_row(record)
 
     def closeEvent(self, event):
@@ -1137,8 +1461,12 @@ class BlindBoxStatsWindow(QMainWindow):
         if self.listener_thread:
             self.listener_thread.stop()
 
-        # 保存数据
-        self.save_data()
+        # 保存数据（包括完整的历史记录），等待写入线程写完
+        self.save_data(final=True)
+        self.snapshot_writer.close(10)
+        self.log_writer.close(10)
+        if self.db_store is not None:
+            self.db_store.close()
 
         event.accept()
 
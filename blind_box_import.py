@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史数据批量导入
+把积累的每日数据文件（web_server/监听程序的 user_stats + total_stats 格式，
+GUI 的 blind_box_history 格式，以及之后的列式历史记录、二进制快照、事件日志）
+统一转换为每日归档（blind_box_archive），之后可用 iter_events / iter_summaries 跨天查询
+
+每一天交给进程池中的一个进程处理（解析JSON、转换、压缩、写入并读回核对），
+完成一天就记入进度文件 import_progress.json：中断后再次运行会跳过已完成且原文件未变化的日期。
+原文件保留不动（data/ 中当天之前的文件可用 blind_box_archive.py compact 归档并删除）
+
+用法：
+    python blind_box_import.py [目录...] [--archive 归档目录] [--workers 进程数]
+    不指定目录时导入 data/；同一天出现在多个目录时只导入第一个
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import blind_box_archive as archive
+from blind_box_persist import atomic_write
+
+PROGRESS_FILE = "import_progress.json"
+
+
+def fingerprint(data_dir: str, day: str) -> List:
+    """某天原文件的名称、大小和修改时间，用于判断导入之后原文件是否变化"""
+    return [[os.path.basename(path), os.path.getsize(path), int(os.path.getmtime(path))]
+            for path in archive.source_files(data_dir, day)]
+
+
+def import_day(task: Tuple[str, str, str]) -> Dict:
+    """在工作进程中导入一天，返回记录数、来源格式、原文件大小、耗时"""
+    data_dir, day, archive_dir = task
+    started = time.perf_counter()
+    size = sum(os.path.getsize(path) for path in archive.source_files(data_dir, day))
+    events, users, sketches, source = archive.read_day(data_dir, day)
+    result = {"dir": data_dir, "day": day, "source": source, "events": len(events),
+              "bytes": size, "archive_bytes": 0}
+    if events:
+        _, result["archive_bytes"] = archive.write_archive(archive_dir, day, events, users, sketches)
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+class Importer:
+    """扫描目录、分派任务、记录进度和吞吐量"""
+
+    def __init__(self, dirs: List[str], archive_dir: str, workers: Optional[int] = None):
+        self.dirs = [os.path.abspath(path) for path in dirs]
+        self.archive_dir = archive_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.progress_file = os.path.join(archive_dir, PROGRESS_FILE)
+        self.progress = self._load_progress()
+
+    def tasks(self) -> List[Tuple[str, str, str]]:
+        """需要导入的 (目录, 日期)：跳过已完成且原文件未变化的日期和其他目录已导入的日期"""
+        tasks = []
+        claimed = {}
+        for data_dir in self.dirs:
+            for day in archive.closed_days(data_dir):
+                if day in claimed:
+                    print(f"[提示] {day} 已从 {claimed[day]} 导入，跳过 {data_dir} 中的同一天")
+                    continue
+                claimed[day] = data_dir
+                done = self.progress.get(day)
+                if (done and done["dir"] == data_dir and done["files"] == fingerprint(data_dir, day)
+                        and (done["events"] == 0 or os.path.exists(archive.archive_path(self.archive_dir, day)))):
+                    continue
+                tasks.append((data_dir, day, self.archive_dir))
+        return tasks
+
+    def run(self) -> Dict:
+        tasks = self.tasks()
+        total_bytes = sum(sum(size for _, size, _ in fingerprint(data_dir, day)) for data_dir, day, _ in tasks)
+        print(f"[导入] 待导入{len(tasks)}天，共{total_bytes / 1e6:.1f}MB，{self.workers}个进程"
+              f"（已完成{len(self.progress)}天）")
+        stats = {"days": 0, "events": 0, "bytes": 0, "archive_bytes": 0, "failed": 0}
+        if not tasks:
+            return stats
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(import_day, task): task for task in tasks}
+            for future in as_completed(futures):
+                data_dir, day, _ = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"[ERROR] 导入 {data_dir} 中的 {day} 失败: {e}")
+                    continue
+
+                self.progress[day] = {"dir": data_dir, "files": fingerprint(data_dir, day),
+                                      "events": result["events"], "source": result["source"]}
+                self._save_progress()
+                for key in ("events", "bytes", "archive_bytes"):
+                    stats[key] += result[key]
+                stats["days"] += 1
+
+                elapsed = time.perf_counter() - started
+                remaining = (total_bytes - stats["bytes"]) / (stats["bytes"] / elapsed) if stats["bytes"] else 0
+                print(f"[{stats['days'] + stats['failed']}/{len(tasks)}] {day} {result['source']:<6}"
+                      f"{result['events']:>9}条 {result['seconds']:>6.1f}s | "
+                      f"累计 {stats['events'] / elapsed:,.0f}条/s {stats['bytes'] / 1e6 / elapsed:.1f}MB/s "
+                      f"剩余约{remaining:.0f}s")
+
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = elapsed
+        print(f"[导入] 完成{stats['days']}天（失败{stats['failed']}天），{stats['events']}条记录，"
+              f"用时{elapsed:.1f}s，{stats['events'] / elapsed:,.0f}条/s，"
+              f"{stats['bytes'] / 1e6:.1f}MB -> {stats['archive_bytes'] / 1e6:.1f}MB")
+        return stats
+
+    def _load_progress(self) -> Dict:
+        if not os.path.exists(self.progress_file):
+            return {}
+        try:
+            with open(self.progress_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[提示] 进度文件无法读取（{e}），全部重新导入")
+            return {}
+
+    def _save_progress(self):
+        atomic_write(self.progress_file,
+                     json.dumps(self.progress, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+def main():
+    args = sys.argv[1:]
+    options = {}
+    dirs = []
+    while args:
+        arg = args.pop(0)
+        if arg in ("--archive", "--workers") and args:
+            options[arg] = args.pop(0)
+        elif arg in ("-h", "--help"):
+            print(__doc__)
+            return
+        else:
+            dirs.append(arg)
+
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    dirs = dirs or [data_dir]
+    archive_dir = options.get("--archive") or archive.archive_dir_for(data_dir)
+    workers = int(options["--workers"]) if "--workers" in options else None
+    Importer(dirs, archive_dir, workers).run()
+
+
+if __name__ == "__main__":
+    main()
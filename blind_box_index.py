@@ -0,0 +1,667 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+盲盒事件索引
+全局按时间排序的只追加事件索引：全部事件追加写入当日日志文件，
+同时写入定长记录文件（blind_box_eventlog），翻页、读最新事件、按时间二分都从mmap读取，
+内存中只保留倒排表
+
+事件只保存uid和盲盒类型编号，用户名和盲盒名称在日志中以定义行出现一次：
+    {"def": "box", "id": 0, "name": "心动盲盒"}
+    {"def": "user", "uid": 123, "uname": "某观众", "ts": ...}   # 新用户或改名时写入
+    {"ts": ..., "uid": 123, "box": 0, "cost": 15000, "value": 36000, "room": 456}   # room可选
+读取时再按字典表还原为完整记录
+日志在每条事件入库时写入，同时作为数据文件的预写日志：启动时重放快照之后的事件（replay）
+定长记录文件由日志派生：用户、盲盒类型、直播间按日志中首次出现的顺序编号，
+加载日志时逐条核对，缺失或不一致的部分按日志重写
+"""
+
+import base64
+import json
+import math
+import os
+import random
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from blind_box_eventlog import FixedEventLog
+from blind_box_store import NameTable, UserDirectory
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 盈亏方向，与 profit_distribution 的键一致
+SIGNS = ("profit", "loss", "break_even")
+
+
+def profit_sign(profit) -> str:
+    """单次盈亏的方向"""
+    if profit > 0:
+        return "profit"
+    elif profit < 0:
+        return "loss"
+    return "break_even"
+
+
+def normalize_event(event: Dict) -> Dict:
+    """
+    统一事件金额为毫元整数
+    早期日志按元记录 cost/value/profit，读取时换算并去掉冗余的 profit
+    """
+    if "profit" in event:
+        event["cost"] = round(event.get("cost", 0) * 1000)
+        event["value"] = round(event.get("value", 0) * 1000)
+        del event["profit"]
+    return event
+
+
+def records_file(path: str) -> str:
+    """事件日志对应的定长记录文件：X.jsonl -> X.bin"""
+    root, _ = os.path.splitext(path)
+    return root + ".bin"
+
+
+def encode_cursor(value) -> str:
+    """把翻页位置编码为不透明的游标字符串"""
+    raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]):
+    """解析游标，无效时返回None"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+
+
+def decode_key_cursor(cursor: Optional[str], length: int = 3) -> Optional[tuple]:
+    """
+    解析排序键游标（length个数字组成的列表：排行榜的排序键、SQLite记录的 (ts, id)），没有游标时返回None
+    游标来自客户端，格式不对时抛出ValueError，不交给跳表比较
+    """
+    if not cursor:
+        return None
+    value = decode_cursor(cursor)
+    if (not isinstance(value, list) or len(value) != length
+            or not all(isinstance(item, (int, float)) and not isinstance(item, bool)
+                       and math.isfinite(item) for item in value)):
+        raise ValueError("无效的游标")
+    return tuple(value)
+
+
+class EventIndex:
+    """
+    按时间排序的全局事件索引，事件金额（cost/value）为毫元整数
+    事件本身在定长记录文件中（path为None时在内存中），另维护按用户、盲盒类型、
+    盈亏方向的倒排表（事件序号升序），过滤查询只访问命中的序号
+    users可传入调用方共用的用户名表，加载日志时按定义行重建
+    """
+
+    def __init__(self, path: Optional[str] = None, users: Optional[UserDirectory] = None):
+        self.path = path
+        self.users = users if users is not None else UserDirectory()
+        self.boxes = NameTable()     # 盲盒名称 <-> 编号，与日志中的定义行一致
+        self.uids = NameTable()      # uid <-> 定长记录中的用户编号
+        self.rooms = NameTable([None])  # 直播间 <-> 定长记录中的编号，0为未知
+        self._lock = threading.Lock()
+        self._records = FixedEventLog(records_file(path) if path else None)
+        self._last_ts = 0.0          # 记录的时间戳单调不减，系统时间回拨时沿用上一条的时间
+        self._by_uid = {}            # uid -> array(序号)
+        self._by_box = []            # 盲盒编号 -> array(序号)
+        self._by_sign = {sign: array('I') for sign in SIGNS}
+        self._box_users = []         # 盲盒编号 -> (按首次开出顺序的uid列表, uid集合)
+        self._logged_names = {}      # uid -> 日志中最近一次定义的用户名
+        self._writer = None
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ==================== 写入 ====================
+
+    def append(self, event: Dict) -> Dict:
+        """
+        追加一条事件（uid, uname, blind_name, cost, value, 可选ts、room_id），
+        自动补充序号和时间戳，返回还原后的完整记录
+        """
+        with self._lock:
+            ts = event.get("ts")
+            if ts is None:
+                ts = datetime.now().timestamp()
+            uid = event.get("uid")
+            uname = event.get("uname")
+            blind_name = event.get("blind_name", "未知")
+
+            lines = []
+            box = self.boxes.id_of(blind_name)
+            if box is None:
+                box = self.boxes.intern(blind_name)
+                lines.append({"def": "box", "id": box, "name": blind_name})
+            if uname is not None:
+                self.users.update(uid, uname, ts)
+                if self._logged_names.get(uid) != uname:
+                    self._logged_names[uid] = uname
+                    lines.append({"def": "user", "uid": uid, "uname": uname, "ts": ts})
+
+            row = {"ts": max(ts, self._last_ts), "uid": uid, "box": box,
+                   "cost": event.get("cost", 0), "value": event.get("value", 0)}
+            room_id = event.get("room_id")
+            if self.path:
+                writer = self._open_writer()
+                for line in lines:
+                    writer.write(self._dump(line))
+                writer.write(self._dump(row if room_id is None else dict(row, room=room_id)))
+                writer.flush()
+
+            self._records.append(*self._record(row, room_id))
+            seq = self._count
+            self._index(seq, row)
+            return self._expand(seq)
+
+    def rebuild(self, events: Iterable[Dict]):
+        """
+        用已有的历史记录重建索引（启动时没有事件日志的旧数据），按时间排序一次
+        先把用户名表（含改名记录）整体写入日志，之后加载日志即可还原
+        """
+        ordered = sorted(events, key=lambda e: e.get("ts", 0))
+        if self.path:
+            with self._lock:
+                writer = self._open_writer()
+                for uid, uname, ts in self.users.timeline():
+                    writer.write(self._dump({"def": "user", "uid": uid, "uname": uname, "ts": ts}))
+                    self._logged_names[uid] = uname
+        for event in ordered:
+            self.append(event)
+
+    def load(self) -> int:
+        """从事件日志恢复倒排表，核对定长记录文件，返回事件数"""
+        if not self.path:
+            return 0
+
+        with self._lock:
+            self._reset()
+            recorded = self._records.open()
+            if not os.path.exists(self.path):
+                # 没有日志时记录文件也作废（之后按日志重建）
+                self._records.truncate(0)
+                return 0
+
+            self.users.clear()
+            with open(self.path, 'rb') as f:
+                valid_size = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # 崩溃留下的半行，截掉后继续追加
+                        break
+                    data = json.loads(line)
+                    kind = data.get("def")
+                    if kind == "box":
+                        self.boxes.intern(data["name"])
+                    elif kind == "user":
+                        self.users.update(data["uid"], data["uname"], data.get("ts"))
+                        self._logged_names[data["uid"]] = data["uname"]
+                    else:
+                        row = self._compact(data, learn=True)
+                        record = self._record(row, data.get("room"))
+                        seq = self._count
+                        if seq < recorded and self._records.read(seq) != record:
+                            # 记录文件与日志不一致（旧版本没有记录文件或异常退出），从这里起按日志重写
+                            self._records.truncate(seq)
+                            recorded = seq
+                        if seq >= recorded:
+                            self._records.append(*record, flush=False)
+                        self._index(seq, row)
+                    valid_size += len(line)
+
+            self._records.flush()
+            if recorded > self._count:
+                self._records.truncate(self._count)
+            if os.path.getsize(self.path) != valid_size:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(valid_size)
+            return self._count
+
+    def replay(self, start: int = 0, stop: Optional[int] = None) -> Iterable[Dict]:
+        """
+        按顺序读出序号在 [start, stop) 的完整事件（含room_id），用于启动时重放快照之后的记录
+        需在load之后调用，用户名为当前名
+        """
+        with self._lock:
+            events = []
+            end = self._count if stop is None else min(stop, self._count)
+            for seq in range(max(0, start), end):
+                event = self._expand(seq)
+                event["room_id"] = self.rooms[self._records.read(seq)[5]]
+                events.append(event)
+            return events
+
+    def close(self):
+        """关闭日志文件和记录文件"""
+        with self._lock:
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            self._records.close()
+
+    # ==================== 查询 ====================
+
+    def newest(self, limit: int) -> List[Dict]:
+        """最新的limit条事件，最新的在前"""
+        return self.page(0, limit)
+
+    def page(self, offset: int, limit: int) -> List[Dict]:
+        """
+        按时间倒序分页：跳过最新的offset条，返回之后的limit条
+        按序号直接读定长记录，与翻到第几页无关
+        """
+        with self._lock:
+            end = self._count - max(0, offset)          # 不含
+            start = max(0, end - max(0, limit))
+            return self._fetch(list(range(end - 1, start - 1, -1)))
+
+    def get(self, seq: int) -> Optional[Dict]:
+        """按序号读取单条事件"""
+        with self._lock:
+            events = self._fetch([seq])
+            return events[0] if events else None
+
+    def query(self, uid=None, blind_name: Optional[str] = None, sign: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              before: Optional[int] = None, limit: int = 50) -> Dict:
+        """
+        过滤查询，按时间倒序
+        before为上一页返回的游标位置（不含），时间范围在定长记录文件上二分定位；
+        多个条件时遍历最短的倒排表，其余条件在各自的倒排表中二分判断
+        返回 {'events', 'next': 下一页位置或None, 'matched': 命中总数（单一条件时可得，否则None）}
+        """
+        with self._lock:
+            lo = 0 if since is None else self._records.bisect_left(since)
+            hi_all = self._count if until is None else self._records.bisect_right(until)
+            hi = hi_all if before is None else min(hi_all, max(0, before))
+
+            postings = []
+            if uid is not None:
+                postings.append(self._by_uid.get(uid, array('I')))
+            if blind_name is not None:
+                box = self.boxes.id_of(blind_name)
+                postings.append(self._by_box[box] if box is not None else array('I'))
+            if sign is not None:
+                postings.append(self._by_sign.get(sign, array('I')))
+
+            if not postings:
+                candidates, first, last = None, lo, hi
+            else:
+                postings.sort(key=len)
+                candidates = postings[0]
+                first, last = bisect_left(candidates, lo), bisect_left(candidates, hi)
+            others = postings[1:]
+
+            matched = None
+            if not others:
+                if candidates is None:
+                    matched = max(0, hi_all - lo)
+                else:
+                    matched = max(0, bisect_left(candidates, hi_all) - first)
+
+            seqs = []
+            position = last - 1
+            while position >= first and len(seqs) <= limit:
+                seq = position if candidates is None else candidates[position]
+                if all(self._contains(other, seq) for other in others):
+                    seqs.append(seq)
+                position -= 1
+
+            next_before = None
+            if len(seqs) > limit:
+                seqs = seqs[:limit]
+                next_before = seqs[-1]
+
+            return {'events': self._fetch(seqs), 'next': next_before, 'matched': matched}
+
+    def box_users(self, blind_name: str) -> List:
+        """开过某种盲盒的用户，按首次开出顺序"""
+        box = self.boxes.id_of(blind_name)
+        if box is None:
+            return []
+        return self._box_users[box][0]
+
+    # ==================== 内部实现 ====================
+
+    def _reset(self):
+        self._last_ts = 0.0
+        self._by_uid = {}
+        self._by_box = []
+        self._by_sign = {sign: array('I') for sign in SIGNS}
+        self._box_users = []
+        self._logged_names = {}
+        self.boxes = NameTable()
+        self.uids = NameTable()
+        self.rooms = NameTable([None])
+        self._count = 0
+
+    def _record(self, row: Dict, room_id) -> tuple:
+        """
+        紧凑格式转为定长记录，登记用户和直播间编号
+        时间戳不早于上一条（row中的ts同时被修正），二分查找依赖时间戳单调
+        """
+        row["ts"] = max(row["ts"], self._last_ts)
+        self._last_ts = row["ts"]
+        return (row["ts"], self.uids.intern(row["uid"]), row["cost"], row["value"],
+                row["box"], self.rooms.intern(room_id))
+
+    def _index(self, seq: int, event: Dict):
+        """登记一条事件到各倒排表"""
+        uid = event["uid"]
+        box = event["box"]
+        self._by_uid.setdefault(uid, array('I')).append(seq)
+        while len(self._by_box) <= box:
+            self._by_box.append(array('I'))
+            self._box_users.append(([], set()))
+        self._by_box[box].append(seq)
+        ordered, seen = self._box_users[box]
+        if uid not in seen:
+            seen.add(uid)
+            ordered.append(uid)
+        self._by_sign[profit_sign(event.get("value", 0) - event.get("cost", 0))].append(seq)
+        self._count += 1
+
+    def _compact(self, data: Dict, learn: bool = False) -> Dict:
+        """
+        日志中的事件行转为内存中的紧凑格式
+        兼容早期每行都带 uname/blind_name 的日志；learn为True时（顺序加载）顺带登记用户名
+        """
+        data = normalize_event(data)
+        box = data.get("box")
+        if box is None:
+            box = self.boxes.intern(data.get("blind_name", "未知"))
+        if learn and "uname" in data:
+            self.users.update(data.get("uid"), data["uname"], data.get("ts"))
+        return {"ts": data.get("ts", 0), "uid": data.get("uid"), "box": box,
+                "cost": data.get("cost", 0), "value": data.get("value", 0)}
+
+    def _expand(self, seq: int) -> Dict:
+        """第seq条定长记录按字典表还原为完整记录（用户名取当前名）"""
+        ts, user, cost, value, box, _ = self._records.read(seq)
+        uid = self.uids[user]
+        return {
+            "seq": seq,
+            "ts": ts,
+            "time": datetime.fromtimestamp(ts).strftime(TIME_FORMAT),
+            "uid": uid,
+            "uname": self.users.uname(uid),
+            "blind_name": self.boxes[box],
+            "cost": cost,
+            "value": value
+        }
+
+    @staticmethod
+    def _dump(data: Dict) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n"
+
+    @staticmethod
+    def _contains(postings, seq: int) -> bool:
+        i = bisect_left(postings, seq)
+        return i < len(postings) and postings[i] == seq
+
+    def _fetch(self, seqs: List[int]) -> List[Dict]:
+        """按序号读取事件（定长记录，直接按位置读取）"""
+        return [self._expand(seq) for seq in seqs if 0 <= seq < self._count]
+
+    def _open_writer(self):
+        """懒打开日志文件（追加模式）"""
+        if self._writer is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._writer = open(self.path, 'ab')
+        return self._writer
+
+
+class _SkipNode:
+    """跳表节点"""
+    __slots__ = ('key', 'uid', 'next', 'width')
+
+    def __init__(self, key, uid, levels: int):
+        self.key = key
+        self.uid = uid
+        self.next = [None] * levels
+        self.width = [0] * levels
+
+
+class RankingIndex:
+    """
+    运气排行榜索引（可索引跳表，顺序统计）
+    按 (盈亏率, 盲盒数) 降序排列，同分时先出现的用户在前；
+    更新、名次查询、取第N名均为 O(log n)，前N名为 O(log n + N)
+    """
+
+    MAX_LEVELS = 24
+
+    def __init__(self, min_count: int = 1):
+        self.min_count = min_count
+        self._lock = threading.Lock()
+        self._tail = _SkipNode(None, None, 0)
+        self._head = _SkipNode(None, None, self.MAX_LEVELS)
+        self._head.next = [self._tail] * self.MAX_LEVELS
+        self._head.width = [1] * self.MAX_LEVELS
+        self._keys = {}     # uid -> 当前排序键
+        self._order = {}    # uid -> 首次出现顺序，用作最后的排序依据
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, uid) -> bool:
+        return uid in self._keys
+
+    @staticmethod
+    def profit_rate(cost: int, value: int) -> float:
+        """盈亏率（百分比）"""
+        if cost > 0:
+            return (value - cost) / cost * 100
+        return 0
+
+    # ==================== 更新 ====================
+
+    def update(self, uid, cost: int, value: int, count: int):
+        """用户统计变化后更新其位置"""
+        with self._lock:
+            old_key = self._keys.pop(uid, None)
+            if old_key is not None:
+                self._remove(old_key)
+            if count < self.min_count:
+                return
+            order = self._order.setdefault(uid, len(self._order))
+            key = (-self.profit_rate(cost, value), -count, order)
+            self._insert(key, uid)
+            self._keys[uid] = key
+
+    def discard(self, uid):
+        """移除用户"""
+        with self._lock:
+            key = self._keys.pop(uid, None)
+            if key is not None:
+                self._remove(key)
+
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self._head.next = [self._tail] * self.MAX_LEVELS
+            self._head.width = [1] * self.MAX_LEVELS
+            self._keys.clear()
+            self._order.clear()
+            self._size = 0
+
+    # ==================== 查询 ====================
+
+    def rank(self, uid) -> Optional[int]:
+        """用户名次（从0开始），不在榜上返回None"""
+        with self._lock:
+            key = self._keys.get(uid)
+            if key is None:
+                return None
+            return self._count_before(key)
+
+    def top(self, limit: Optional[int] = None, offset: int = 0) -> List:
+        """从第offset名开始的limit个用户uid"""
+        with self._lock:
+            offset = max(0, offset)
+            if offset >= self._size:
+                return []
+            count = self._size - offset if limit is None else min(max(0, limit), self._size - offset)
+            node = self._select(offset)
+            result = []
+            while count > 0 and node is not self._tail:
+                result.append(node.uid)
+                node = node.next[0]
+                count -= 1
+            return result
+
+    def key_of(self, uid):
+        """用户当前的排序键，可用作翻页游标"""
+        return self._keys.get(uid)
+
+    def page(self, after=None, limit: int = 100, sign: Optional[str] = None):
+        """
+        游标翻页：返回排在after之后的最多limit个uid及下一页游标
+        after为排序键（decode_key_cursor校验过的元组）；sign按盈亏方向过滤；盈亏率有序，各方向在榜上是连续区间，直接定位区间起点
+        """
+        with self._lock:
+            start, stop = self._sign_range(sign)
+            node = self._head.next[0]
+            if start is not None:
+                node = self._seek(start, strict=False)
+            if after is not None and (start is None or tuple(after) >= start):
+                node = self._seek(tuple(after), strict=True)
+
+            uids = []
+            last_key = None
+            while node is not self._tail and len(uids) < limit:
+                if stop is not None and stop(node.key):
+                    break
+                uids.append(node.uid)
+                last_key = node.key
+                node = node.next[0]
+
+            has_more = node is not self._tail and not (stop is not None and stop(node.key))
+            return uids, (list(last_key) if has_more and last_key is not None else None)
+
+    def count(self, sign: Optional[str] = None) -> int:
+        """榜上人数，可按盈亏方向统计（O(log n)）"""
+        with self._lock:
+            if sign is None:
+                return self._size
+            gains = self._count_before((0.0,))                       # 盈亏率>0
+            non_losses = self._count_upto((0.0, float('inf')))       # 盈亏率>=0
+            if sign == "profit":
+                return gains
+            if sign == "break_even":
+                return non_losses - gains
+            return self._size - non_losses
+
+    # ==================== 跳表实现 ====================
+
+    @staticmethod
+    def _sign_range(sign: Optional[str]):
+        """
+        盈亏方向对应的键区间 (起点键, 终止判断)
+        键的第一项是负的盈亏率：盈利<0，持平==0，亏损>0
+        """
+        if sign == "profit":
+            return None, lambda key: key[0] >= 0
+        if sign == "break_even":
+            return (0.0,), lambda key: key[0] > 0
+        if sign == "loss":
+            return (0.0, float('inf')), None
+        return None, None
+
+    def _seek(self, key, strict: bool) -> _SkipNode:
+        """第一个大于（strict）或大于等于key的节点"""
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and (
+                    node.next[level].key <= key if strict else node.next[level].key < key):
+                node = node.next[level]
+        return node.next[0]
+
+    def _count_upto(self, key) -> int:
+        """小于等于key的元素个数"""
+        node = self._head
+        position = 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key <= key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def _random_levels(self) -> int:
+        """随机层数，每层概率减半"""
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def _find_chain(self, key):
+        """找到每一层中最后一个小于key的节点，及其位置"""
+        chain = [None] * self.MAX_LEVELS
+        positions = [0] * self.MAX_LEVELS
+        node = self._head
+        position = 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def _insert(self, key, uid):
+        chain, positions = self._find_chain(key)
+        levels = self._random_levels()
+        new_node = _SkipNode(key, uid, levels)
+        insert_at = positions[0] + 1
+        for level in range(self.MAX_LEVELS):
+            prev = chain[level]
+            if level < levels:
+                new_node.next[level] = prev.next[level]
+                prev.next[level] = new_node
+                new_node.width[level] = positions[level] + prev.width[level] - insert_at + 1
+                prev.width[level] = insert_at - positions[level]
+            else:
+                prev.width[level] += 1
+        self._size += 1
+
+    def _remove(self, key):
+        chain, _ = self._find_chain(key)
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            return
+        for level in range(self.MAX_LEVELS):
+            prev = chain[level]
+            if level < len(target.next) and prev.next[level] is target:
+                prev.width[level] += target.width[level] - 1
+                prev.next[level] = target.next[level]
+            else:
+                prev.width[level] -= 1
+        self._size -= 1
+
+    def _count_before(self, key) -> int:
+        """排在key之前的元素个数"""
+        _, positions = self._find_chain(key)
+        return positions[0]
+
+    def _select(self, index: int) -> _SkipNode:
+        """第index个节点（从0开始）"""
+        node = self._head
+        remaining = index + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨日期的用户累计统计
+每位用户从有记录以来的盲盒数、花费、价值、首次和最近出现时间、活跃天数，
+保存在 data/lifetime_users.json，按uid直接查询，不需要逐天打开数据文件
+
+每天结束后（今天之前的日期）累加一次：web_server换日时直接累加当天的用户统计，
+启动时补上数据文件、事件日志或归档中尚未累加的日期（按用户汇总后加到累计统计），
+已累加的日期记在同一个文件里，重复运行或中断后再运行不会重复累加。
+今天的部分由调用方用当天的用户统计合并（combine）
+"""
+
+import json
+import os
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import blind_box_archive as archive
+from blind_box_persist import atomic_write, dump_json
+from blind_box_store import UserDirectory, uid_key
+
+LIFETIME_FILE = "lifetime_users.json"
+
+
+def new_lifetime() -> Dict:
+    """空的用户累计统计，金额为毫元整数，时间为时间戳"""
+    return {"uname": None, "count": 0, "cost": 0, "value": 0,
+            "first_seen": None, "last_seen": None, "days": 0}
+
+
+def combine(lifetime: Optional[Dict], today: Optional[Dict]) -> Optional[Dict]:
+    """
+    累计统计加上今天的用户统计（count/cost/value，可选 first_ts/last_ts），返回新字典
+    两者都没有时返回None
+    """
+    if lifetime is None and today is None:
+        return None
+    merged = dict(lifetime) if lifetime is not None else new_lifetime()
+    if today is not None:
+        merged["count"] += today.get("count", 0)
+        merged["cost"] += today.get("cost", 0)
+        merged["value"] += today.get("value", 0)
+        merged["days"] += 1
+        first = today.get("first_ts", today.get("last_ts"))
+        if first is not None and (merged["first_seen"] is None or first < merged["first_seen"]):
+            merged["first_seen"] = first
+        if today.get("last_ts") is not None:
+            merged["last_seen"] = max(merged["last_seen"] or 0, today["last_ts"])
+    return merged
+
+
+class LifetimeIndex:
+    """uid -> 累计统计，已累加的日期集合；查询和逐天累加可以在不同线程进行"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.users = {}
+        self.days = set()
+        self._lock = threading.Lock()
+        # 读取文件之前（或读取期间）累加的日期：load 合并时文件中没有的日期再加一遍，已有的跳过
+        self._before_load = {}
+        self._loaded = False
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self.users
+
+    def load(self) -> int:
+        """
+        读取累计统计文件，返回已累加的天数；文件不存在或损坏时从空白开始
+        先读到局部变量，再在锁内与读取之前（或期间，例如换日）已累加的日期合并，不会丢失或重复累加
+        """
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[ERROR] 读取用户累计统计失败: {e}，将重新累加")
+        users = {uid_key(uid): user for uid, user in data.get("users", {}).items()}
+        days = set(data.get("days", []))
+        with self._lock:
+            for day, totals in self._before_load.items():
+                if day not in days:
+                    self._fold(users, totals)
+                    days.add(day)
+            self.users = users
+            self.days = days
+            self._before_load = {}
+            self._loaded = True
+            return len(self.days)
+
+    def save(self):
+        with self._lock:
+            payload = dump_json({"days": sorted(self.days), "users": self.users})
+        atomic_write(self.path, payload)
+
+    def get(self, uid) -> Optional[Dict]:
+        """某位用户截至上一个已累加日期的统计（副本），没有记录时返回None"""
+        with self._lock:
+            user = self.users.get(uid)
+            return dict(user) if user is not None else None
+
+    def add_day(self, day: str, rows: Iterable[Tuple[float, object, int, int]],
+                users: UserDirectory) -> int:
+        """
+        累加一天的记录 (时间戳, uid, 花费, 价值)，返回当天的用户数；该日期已累加过时不做任何事
+        先在局部按用户汇总，只在合并时持有锁，期间的查询不用等待读取文件
+        """
+        if day in self.days:
+            return 0
+        daily = {}
+        for ts, uid, cost, value in rows:
+            user = daily.get(uid)
+            if user is None:
+                daily[uid] = [1, cost, value, ts, ts]
+            else:
+                user[0] += 1
+                user[1] += cost
+                user[2] += value
+                user[3] = min(user[3], ts)
+                user[4] = max(user[4], ts)
+        return self._merge(day, daily, users)
+
+    def add_summary(self, day: str, stats: Dict, users: UserDirectory) -> int:
+        """
+        累加一天已按用户汇总的统计（uid -> count/cost/value/first_ts/last_ts，
+        即web_server当天的用户统计），换日时使用，不需要再读一遍当天的记录；已累加过的日期不做任何事
+        """
+        if day in self.days:
+            return 0
+        daily = {uid: [user.get("count", 0), user.get("cost", 0), user.get("value", 0),
+                       user.get("first_ts", user.get("last_ts")), user.get("last_ts")]
+                 for uid, user in stats.items()}
+        return self._merge(day, daily, users)
+
+    def _merge(self, day: str, daily: Dict, users: UserDirectory) -> int:
+        """把 uid -> [盲盒数, 花费, 价值, 首次, 最近] 合并进累计统计并记下日期"""
+        # 旧数据文件转换来的uid可能是字符串
+        totals = [(uid_key(uid), count, cost, value, first, last, users.uname(uid, None))
+                  for uid, (count, cost, value, first, last) in daily.items()]
+        with self._lock:
+            if day in self.days:
+                return 0
+            self._fold(self.users, totals)
+            self.days.add(day)
+            if not self._loaded:
+                self._before_load[day] = totals
+        return len(daily)
+
+    @staticmethod
+    def _fold(users: Dict, totals: List[Tuple]):
+        """一天的 (uid, 盲盒数, 花费, 价值, 首次, 最近, 用户名) 累加到 uid -> 累计统计"""
+        for uid, count, cost, value, first, last, name in totals:
+            user = users.get(uid)
+            if user is None:
+                user = users[uid] = new_lifetime()
+            user["count"] += count
+            user["cost"] += cost
+            user["value"] += value
+            user["days"] += 1
+            if first is not None and (user["first_seen"] is None or first < user["first_seen"]):
+                user["first_seen"] = first
+            if last is not None and (user["last_seen"] is None or last >= user["last_seen"]):
+                user["last_seen"] = last
+                user["uname"] = name or user["uname"]
+
+    def catch_up(self, data_dir: str, archive_dir: Optional[str] = None,
+                 before: Optional[str] = None) -> List[str]:
+        """
+        累加 data/ 和归档中早于before（默认今天）且尚未累加的日期，有新日期时保存一次，返回累加的日期
+        同一天既有归档又有原文件时读取归档
+        """
+        before = before or date.today().isoformat()
+        archive_dir = archive_dir or archive.archive_dir_for(data_dir)
+        archived = set(archive.archived_days(archive_dir))
+        pending = set(archive.closed_days(data_dir, before)) if os.path.isdir(data_dir) else set()
+        pending.update(day for day in archived if day < before)
+        done = []
+        for day in sorted(pending - self.days):
+            try:
+                if day in archived:
+                    with archive.DayArchive(archive.archive_path(archive_dir, day)) as day_archive:
+                        users = self.add_day(day, archive_rows(day_archive), day_archive.users())
+                else:
+                    events, names, _, _ = archive.read_day(data_dir, day)
+                    users = self.add_day(day, ((event["ts"], event["uid"], event["cost"], event["value"])
+                                               for event in events), names)
+            except Exception as e:
+                print(f"[ERROR] 累加 {day} 的用户统计失败: {e}")
+                continue
+            print(f"[累计] 已累加 {day}，{users}位用户")
+            done.append(day)
+        if done:
+            self.save()
+        return done
+
+
+def archive_rows(day_archive) -> Iterable[Tuple[int, object, int, int]]:
+    """归档中逐块解压 时间戳、用户、花费、价值 四列"""
+    uids = day_archive.uids
+    for chunk in day_archive.columns(("ts", "user", "cost", "value")):
+        for ts, user, cost, value in zip(chunk["ts"], chunk["user"], chunk["cost"], chunk["value"]):
+            yield ts, uids[user], cost, value
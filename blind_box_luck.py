@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运气评分
+按盲盒类型的平均返还率算出每个用户“应得”的价值，实际价值减去应得价值为超额收益，
+除以花费得到超额收益率；再按抽样方差做收缩（经验贝叶斯），开得少的用户向0收缩，
+只开过一个幸运盲盒的用户不会排到榜首。同时给出置信区间
+
+计算在列式历史记录上批量完成（NumPy）：
+    每个用户按盲盒类型累计 花费、花费平方，另累计总花费、价值和盲盒数，只处理上次计算之后新增的记录；
+    盲盒类型的返还率和方差变化不大时只重算新增记录涉及用户的超额收益率，否则全部重算（一次矩阵乘法）
+收缩系数取决于按全体用户估计的先验方差，任何新记录都可能改变它，
+所以收缩和排序每次刷新都对全部用户进行：向量化的 O(U)，加一次 O(U log U) 的排序（U为当天用户数）
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖，缺失时不提供运气评分
+    np = None
+
+CONFIDENCE_Z = 1.96          # 95% 置信区间
+PRIOR_VARIANCE_MIN = 0.01    # 真实超额收益率方差的下限（10%的平方），避免全部收缩为0
+PRIOR_TOLERANCE = 1e-3       # 盲盒类型返还率/方差的变化超过该值时重算全部用户
+
+
+def available() -> bool:
+    return np is not None
+
+
+class LuckScorer:
+    """基于列式历史记录（HistoryStore）的运气评分"""
+
+    def __init__(self, store):
+        if np is None:
+            raise RuntimeError("未安装numpy，无法计算运气评分")
+        self._lock = threading.Lock()
+        self.reset(store)
+
+    def reset(self, store):
+        """换用新的历史记录（加载数据、换日后调用）"""
+        with self._lock:
+            self.store = store
+            self._row = 0                                   # 已处理的记录数
+            self._cost = np.zeros((0, 0))                   # [用户, 盲盒类型] 花费
+            self._cost_sq = np.zeros((0, 0))                # [用户, 盲盒类型] 花费平方
+            self._spent = np.zeros(0)                       # [用户] 花费
+            self._value = np.zeros(0)                       # [用户] 价值
+            self._count = np.zeros(0, dtype=np.int64)       # [用户] 盲盒数
+            self._box_cost = np.zeros(0)                    # [盲盒类型] 花费
+            self._box_value = np.zeros(0)                   # [盲盒类型] 价值
+            self._box_n = np.zeros(0)                       # [盲盒类型] 盲盒数
+            self._box_ratio = np.zeros(0)                   # [盲盒类型] 价值/花费之和
+            self._box_ratio_sq = np.zeros(0)                # [盲盒类型] (价值/花费)^2之和
+            self._rate = np.zeros(0)                        # 上次使用的返还率
+            self._var = np.zeros(0)                         # 上次使用的返还率方差
+            self._excess = np.zeros(0)                      # [用户] 超额收益率
+            self._sampling_var = np.zeros(0)                # [用户] 超额收益率的抽样方差
+            self._score = np.zeros(0)                       # [用户] 收缩后的运气评分
+            self._order = np.zeros(0, dtype=np.int64)       # 按评分降序的用户编号
+            self.prior_variance = PRIOR_VARIANCE_MIN
+            self.last_touched = 0
+
+    def refresh(self) -> int:
+        """
+        处理新增记录并更新评分，返回本次重算超额收益率的用户数
+        历史记录的各列逐列追加，调用方需持有写入历史记录时的锁（web_server 的 state_lock），
+        保证读到的行数、用户数和盲盒类型数一致
+        """
+        with self._lock:
+            store = self.store
+            start, end = self._row, len(store)
+            if start == end:
+                return 0
+            self._grow(len(store.uids), len(store.boxes))
+
+            # 先切片复制再转换，不持有列数组的缓冲区（否则写入线程无法追加）
+            uid = np.frombuffer(store.uid_idx[start:end], dtype=np.uint32).astype(np.int64)
+            box = np.frombuffer(store.box_idx[start:end], dtype=np.uint16).astype(np.int64)
+            cost = np.frombuffer(store.cost[start:end], dtype=np.uint32).astype(np.float64)
+            value = np.frombuffer(store.value[start:end], dtype=np.uint32).astype(np.float64)
+
+            np.add.at(self._cost, (uid, box), cost)
+            np.add.at(self._cost_sq, (uid, box), cost * cost)
+            np.add.at(self._spent, uid, cost)
+            np.add.at(self._value, uid, value)
+            np.add.at(self._count, uid, 1)
+
+            priced = cost > 0
+            ratio = np.divide(value, cost, out=np.zeros_like(value), where=priced)
+            np.add.at(self._box_cost, box, cost)
+            np.add.at(self._box_value, box, value)
+            np.add.at(self._box_n, box, priced)
+            np.add.at(self._box_ratio, box, ratio)
+            np.add.at(self._box_ratio_sq, box, ratio * ratio)
+            self._row = end
+
+            rate, var = self._box_priors()
+            if (len(rate) != len(self._rate)
+                    or np.any(np.abs(rate - self._rate) > PRIOR_TOLERANCE)
+                    or np.any(np.abs(var - self._var) > PRIOR_TOLERANCE)):
+                users = np.arange(len(self._value))
+                self._rate, self._var = rate, var
+            else:
+                users = np.unique(uid)
+            self._score_users(users)
+            self.last_touched = len(users)
+            return len(users)
+
+    # ==================== 查询 ====================
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._count))
+
+    def page(self, offset: int = 0, limit: int = 100) -> List[int]:
+        """按评分降序的用户编号（HistoryStore中的用户编号）"""
+        with self._lock:
+            ranked = self._order[self._count[self._order] > 0]
+            return ranked[offset:offset + limit].tolist()
+
+    def entry(self, user_id: int) -> Dict:
+        """某个用户编号的评分明细，金额为毫元"""
+        with self._lock:
+            return self._entry(user_id)
+
+    def entry_for(self, uid) -> Optional[Dict]:
+        user_id = self.store._uid_ids.get(uid)
+        if user_id is None or user_id >= len(self._count) or self._count[user_id] == 0:
+            return None
+        return self.entry(user_id)
+
+    # ==================== 内部实现 ====================
+
+    def _grow(self, users: int, boxes: int):
+        """按新的用户数、盲盒类型数扩展数组"""
+        old_users, old_boxes = self._cost.shape
+        if users == old_users and boxes == old_boxes:
+            return
+
+        def pad2(matrix):
+            grown = np.zeros((users, boxes))
+            grown[:old_users, :old_boxes] = matrix
+            return grown
+
+        def pad1(vector, size, dtype=np.float64):
+            grown = np.zeros(size, dtype=dtype)
+            grown[:len(vector)] = vector
+            return grown
+
+        self._cost = pad2(self._cost)
+        self._cost_sq = pad2(self._cost_sq)
+        self._spent = pad1(self._spent, users)
+        self._value = pad1(self._value, users)
+        self._count = pad1(self._count, users, np.int64)
+        self._excess = pad1(self._excess, users)
+        self._sampling_var = pad1(self._sampling_var, users)
+        self._score = pad1(self._score, users)
+        for name in ('_box_cost', '_box_value', '_box_n', '_box_ratio', '_box_ratio_sq'):
+            setattr(self, name, pad1(getattr(self, name), boxes))
+
+    def _box_priors(self):
+        """各盲盒类型的平均返还率和单个盲盒返还率的方差"""
+        n = np.maximum(self._box_n, 1)
+        rate = np.divide(self._box_value, self._box_cost,
+                         out=np.zeros_like(self._box_value), where=self._box_cost > 0)
+        mean_ratio = self._box_ratio / n
+        var = np.maximum(self._box_ratio_sq / n - mean_ratio * mean_ratio, 0)
+        return rate, var
+
+    def _score_users(self, users):
+        """
+        重算指定用户的超额收益率和抽样方差，再对全部用户做收缩和排序
+        后一步与用户数成正比，排序为 O(U log U)，不随本次新增的记录数减少
+        """
+        cost = self._cost[users]
+        spent = cost.sum(axis=1)
+        expected = cost @ self._rate
+        variance = self._cost_sq[users] @ self._var
+        safe = np.where(spent > 0, spent, 1)
+        self._excess[users] = np.where(spent > 0, (self._value[users] - expected) / safe, 0)
+        self._sampling_var[users] = np.where(spent > 0, variance / (safe * safe), 0)
+
+        # 真实超额收益率的方差：用户间的离散程度减去抽样误差（按花费加权的矩估计，
+        # 开得少的用户权重小，个别幸运用户不会把方差撑大）
+        total = self._spent.sum()
+        if total > 0:
+            estimate = float((self._spent @ (self._excess ** 2) - self._spent @ self._sampling_var) / total)
+            self.prior_variance = max(PRIOR_VARIANCE_MIN, estimate)
+        weight = self.prior_variance / (self.prior_variance + self._sampling_var)
+        self._score = weight * self._excess
+        # 评分降序，同分时盲盒数多的在前
+        self._order = np.lexsort((-self._count, -self._score))
+
+    def _entry(self, user_id: int) -> Dict:
+        weight = self.prior_variance / (self.prior_variance + self._sampling_var[user_id])
+        score = float(self._score[user_id])
+        margin = CONFIDENCE_Z * float(np.sqrt(weight * self._sampling_var[user_id]))
+        return {
+            "count": int(self._count[user_id]),
+            "cost": float(self._spent[user_id]),
+            "value": float(self._value[user_id]),
+            "expected": float(self._cost[user_id] @ self._rate),
+            "excess_rate": float(self._excess[user_id]),
+            "luck": score,
+            "lower": score - margin,
+            "upper": score + margin,
+            "shrinkage": float(1 - weight)
+        }
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台原子保存
+调用方在持有自己的锁时取一份数据副本（各结构的 to_dict 返回新对象），交给写入线程，
+序列化和磁盘写入都在写入线程完成，不阻塞事件循环和请求线程
+
+写入先写临时文件并 fsync，再用 os.replace 替换目标文件，
+崩溃时数据文件要么是旧的完整版本，要么是新的完整版本，不会出现写了一半的文件
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+
+def dump_json(data) -> bytes:
+    """紧凑JSON"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def atomic_write(path: str, payload: bytes):
+    """临时文件 + fsync + rename 写入"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+    # 目录项也落盘，否则断电后可能还是旧文件（Windows不支持打开目录，跳过）
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SnapshotWriter:
+    """
+    后台写入线程
+    每个文件只保留最新一份待写数据：写入跟不上时，旧的快照直接被新的取代
+    """
+
+    def __init__(self, name: str = "snapshot-writer"):
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # 路径 -> (数据, 写完后的回调, 编码函数)
+        self._busy = False
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, path: str, data: Dict, on_done: Optional[Callable[[], None]] = None,
+               encode: Callable[[Dict], bytes] = dump_json):
+        """
+        提交一份数据（之后不能再修改），写完后在写入线程调用on_done
+        encode 在写入线程把数据编码为文件内容，默认为紧凑JSON
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("写入线程已关闭")
+            self._pending.pop(path, None)
+            self._pending[path] = (data, on_done, encode)
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的数据全部写完，超时返回False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """写完剩余数据后停止线程（程序退出前调用）"""
+        done = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return done
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                path, (data, on_done, encode) = self._pending.popitem(last=False)
+                self._busy = True
+
+            try:
+                atomic_write(path, encode(data))
+                self.written += 1
+                if on_done:
+                    on_done()
+            except Exception as e:
+                self.failed += 1
+                print(f"[ERROR] 保存 {path} 失败: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
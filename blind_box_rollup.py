@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+盲盒时间桶汇总
+每条记录入库时同时累加到所在的分钟桶和小时桶：盲盒数、花费、价值、独立用户和各盲盒类型的分项，
+趋势图只需读取时间范围内的桶，开销与桶数成正比，与记录数无关
+金额为毫元整数
+"""
+
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# 支持的粒度：名称 -> 桶长度（秒）
+RESOLUTIONS = {"minute": 60, "hour": 3600}
+
+
+class _Bucket:
+    """单个时间桶"""
+    __slots__ = ('count', 'cost', 'value', 'users', 'boxes')
+
+    def __init__(self):
+        self.count = 0
+        self.cost = 0
+        self.value = 0
+        self.users = set()
+        self.boxes = {}     # 盲盒名称 -> [盲盒数, 花费, 价值]
+
+    def add(self, uid, blind_name: str, cost: int, value: int):
+        self.count += 1
+        self.cost += cost
+        self.value += value
+        self.users.add(uid)
+        box = self.boxes.get(blind_name)
+        if box is None:
+            box = self.boxes[blind_name] = [0, 0, 0]
+        box[0] += 1
+        box[1] += cost
+        box[2] += value
+
+    def to_list(self) -> list:
+        return [self.count, self.cost, self.value, list(self.users),
+                {name: list(box) for name, box in self.boxes.items()}]
+
+    @classmethod
+    def from_list(cls, data: list) -> '_Bucket':
+        bucket = cls()
+        bucket.count, bucket.cost, bucket.value = data[0], data[1], data[2]
+        bucket.users = set(data[3])
+        bucket.boxes = {name: list(box) for name, box in data[4].items()}
+        return bucket
+
+
+class TimeRollup:
+    """单一粒度的时间桶序列，桶起点有序，按时间范围二分定位"""
+
+    def __init__(self, bucket_seconds: int):
+        self.bucket_seconds = bucket_seconds
+        self._starts = array('q')   # 桶起点（秒），升序
+        self._buckets = {}          # 桶起点 -> _Bucket
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def bucket_start(self, ts: float) -> int:
+        """时间戳所在桶的起点"""
+        return int(ts) // self.bucket_seconds * self.bucket_seconds
+
+    def add(self, ts: float, uid, blind_name: str, cost: int, value: int):
+        start = self.bucket_start(ts)
+        bucket = self._buckets.get(start)
+        if bucket is None:
+            bucket = self._buckets[start] = _Bucket()
+            if not self._starts or start > self._starts[-1]:
+                self._starts.append(start)
+            else:
+                # 系统时间回拨等情况下的乱序记录
+                insort(self._starts, start)
+        bucket.add(uid, blind_name, cost, value)
+
+    def points(self, since: Optional[float] = None, until: Optional[float] = None,
+               blind_name: Optional[str] = None) -> List[Dict]:
+        """
+        时间范围内的桶（含since/until所在的桶），没有记录的桶不返回
+        指定blind_name时只取该盲盒类型的分项，此时没有独立用户数
+        """
+        lo = 0 if since is None else bisect_left(self._starts, self.bucket_start(since))
+        hi = len(self._starts) if until is None else bisect_right(self._starts, until)
+        points = []
+        for start in self._starts[lo:hi]:
+            bucket = self._buckets[start]
+            if blind_name is None:
+                point = self._point(start, bucket.count, bucket.cost, bucket.value)
+                point["users"] = len(bucket.users)
+                point["boxes"] = {name: {"count": box[0], "cost": box[1], "value": box[2]}
+                                  for name, box in bucket.boxes.items()}
+            else:
+                box = bucket.boxes.get(blind_name)
+                if box is None:
+                    continue
+                point = self._point(start, box[0], box[1], box[2])
+            points.append(point)
+        return points
+
+    @staticmethod
+    def _point(start: int, count: int, cost: int, value: int) -> Dict:
+        return {
+            "ts": start,
+            "time": datetime.fromtimestamp(start).strftime("%Y-%m-%d %H:%M"),
+            "count": count,
+            "cost": cost,
+            "value": value,
+            "profit": value - cost
+        }
+
+    def to_dict(self) -> Dict:
+        return {str(start): self._buckets[start].to_list() for start in self._starts}
+
+    @classmethod
+    def from_dict(cls, bucket_seconds: int, data: Dict) -> 'TimeRollup':
+        rollup = cls(bucket_seconds)
+        for start in sorted(int(key) for key in data):
+            rollup._starts.append(start)
+            rollup._buckets[start] = _Bucket.from_list(data[str(start)])
+        return rollup
+
+
+class Rollups:
+    """分钟、小时两级汇总，入库时增量更新"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.series = {name: TimeRollup(seconds) for name, seconds in RESOLUTIONS.items()}
+
+    def add(self, ts: float, uid, blind_name: str, cost: int, value: int):
+        """累加一条记录到各粒度的桶"""
+        with self._lock:
+            for rollup in self.series.values():
+                rollup.add(ts, uid, blind_name, cost, value)
+
+    def query(self, resolution: str, since: Optional[float] = None,
+              until: Optional[float] = None, blind_name: Optional[str] = None) -> List[Dict]:
+        """读取某一粒度的桶，粒度不存在时抛出ValueError"""
+        rollup = self.series.get(resolution)
+        if rollup is None:
+            raise ValueError(f"resolution只能是 {', '.join(RESOLUTIONS)}")
+        with self._lock:
+            return rollup.points(since, until, blind_name)
+
+    def clear(self):
+        with self._lock:
+            self.series = {name: TimeRollup(seconds) for name, seconds in RESOLUTIONS.items()}
+
+    def to_dict(self) -> Dict:
+        """可JSON序列化的格式，随每日数据文件保存"""
+        with self._lock:
+            return {name: rollup.to_dict() for name, rollup in self.series.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Rollups':
+        rollups = cls()
+        for name, seconds in RESOLUTIONS.items():
+            if name in data:
+                rollups.series[name] = TimeRollup.from_dict(seconds, data[name])
+        return rollups
+
+    @classmethod
+    def from_history(cls, store) -> 'Rollups':
+        """从列式历史记录重建（旧数据文件没有汇总时使用）"""
+        rollups = cls()
+        for row in range(len(store)):
+            rollups.add(store.ts[row], store.uid_at(row), store.box_at(row),
+                        store.cost[row], store.value[row])
+        return rollups
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式分位数估计
+QuantileSketch 按对数分桶计数（DDSketch 方法）：每个值落入 gamma^(i-1) < |v| <= gamma^i 的桶，
+任意分位数的相对误差不超过 alpha。桶计数可以直接相加，因此不同天、不同直播间的结果可以合并；
+计数也可以减去，用户当日累计花费变化时先移除旧值再加入新值
+
+DailySketches 是一天内的全部分布：
+    profit：单个盲盒的盈亏，按 全部 / 直播间 / 盲盒类型 分别维护
+    spend：每个用户的当日累计花费，按 全部 / 直播间 分别维护
+金额为毫元整数
+"""
+
+import math
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from blind_box_store import uid_key
+
+RELATIVE_ACCURACY = 0.01           # 分位数的相对误差
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+SCOPE_ALL = "all"
+
+
+def room_scope(room_id) -> str:
+    return f"room:{room_id}"
+
+
+def box_scope(blind_name: str) -> str:
+    return f"box:{blind_name}"
+
+
+class QuantileSketch:
+    """可合并、可删除的分位数估计"""
+
+    def __init__(self, alpha: float = RELATIVE_ACCURACY):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.zero = 0
+        self.positive = {}   # 桶编号 -> 计数
+        self.negative = {}   # |v| 的桶编号 -> 计数
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _key(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        """桶的代表值，与桶内任意值的相对误差不超过alpha"""
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count: int = 1):
+        if value > 0:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif value < 0:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zero += count
+        self.count += count
+
+    def remove(self, value, count: int = 1):
+        """移除之前加入的值"""
+        if value > 0:
+            store, key = self.positive, self._key(value)
+        elif value < 0:
+            store, key = self.negative, self._key(-value)
+        else:
+            self.zero -= count
+            self.count -= count
+            return
+        left = store.get(key, 0) - count
+        if left > 0:
+            store[key] = left
+        else:
+            store.pop(key, None)
+        self.count -= count
+
+    def merge(self, other: 'QuantileSketch'):
+        """合并另一个相同精度的估计"""
+        if other.alpha != self.alpha:
+            raise ValueError("只能合并相同精度的分位数估计")
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """第q分位数（0~1），没有数据时返回None"""
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero
+        if seen > rank:
+            return 0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0
+
+    def quantiles(self, qs: Iterable[float] = DEFAULT_QUANTILES) -> Dict[float, Optional[float]]:
+        return {q: self.quantile(q) for q in qs}
+
+    def to_dict(self) -> Dict:
+        return {
+            "alpha": self.alpha,
+            "zero": self.zero,
+            "positive": [[key, count] for key, count in self.positive.items()],
+            "negative": [[key, count] for key, count in self.negative.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        sketch = cls(data.get("alpha", RELATIVE_ACCURACY))
+        sketch.zero = data.get("zero", 0)
+        sketch.positive = {key: count for key, count in data.get("positive", [])}
+        sketch.negative = {key: count for key, count in data.get("negative", [])}
+        sketch.count = sketch.zero + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+    @classmethod
+    def merged(cls, sketches: Iterable['QuantileSketch']) -> 'QuantileSketch':
+        """合并多个估计，得到新的估计（不修改原对象）"""
+        result = cls()
+        for sketch in sketches:
+            if sketch is not None:
+                result.merge(sketch)
+        return result
+
+
+class DailySketches:
+    """一天内按直播间、盲盒类型维护的盈亏和花费分布"""
+
+    METRICS = ("profit", "spend")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profit = {}        # 范围 -> QuantileSketch
+        self.spend = {}         # 范围 -> QuantileSketch
+        self._user_spend = {}   # 范围 -> {uid: 当日累计花费}
+
+    def add(self, uid, blind_name: str, cost: int, value: int, room_id=None):
+        """累加一条盲盒记录"""
+        with self._lock:
+            scopes = [SCOPE_ALL] if room_id is None else [SCOPE_ALL, room_scope(room_id)]
+
+            for scope in scopes + [box_scope(blind_name)]:
+                self._sketch(self.profit, scope).add(value - cost)
+
+            for scope in scopes:
+                spends = self._user_spend.setdefault(scope, {})
+                sketch = self._sketch(self.spend, scope)
+                old = spends.get(uid)
+                if old is not None:
+                    sketch.remove(old)
+                spends[uid] = (old or 0) + cost
+                sketch.add(spends[uid])
+
+    def get(self, metric: str, scope: str = SCOPE_ALL) -> Optional[QuantileSketch]:
+        """某个指标在某个范围内的估计"""
+        if metric not in self.METRICS:
+            raise ValueError(f"metric只能是 {', '.join(self.METRICS)}")
+        return getattr(self, metric).get(scope)
+
+    def scopes(self, metric: str) -> List[str]:
+        return list(getattr(self, metric))
+
+    @staticmethod
+    def _sketch(sketches: Dict, scope: str) -> QuantileSketch:
+        sketch = sketches.get(scope)
+        if sketch is None:
+            sketch = sketches[scope] = QuantileSketch()
+        return sketch
+
+    def to_dict(self) -> Dict:
+        """可JSON序列化的格式，随每日数据文件保存"""
+        with self._lock:
+            return {
+                "profit": {scope: sketch.to_dict() for scope, sketch in self.profit.items()},
+                "spend": {scope: sketch.to_dict() for scope, sketch in self.spend.items()},
+                "user_spend": {scope: dict(spends) for scope, spends in self._user_spend.items()}
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'DailySketches':
+        sketches = cls()
+        sketches.profit = {scope: QuantileSketch.from_dict(item)
+                           for scope, item in data.get("profit", {}).items()}
+        sketches.spend = {scope: QuantileSketch.from_dict(item)
+                          for scope, item in data.get("spend", {}).items()}
+        sketches._user_spend = {scope: {uid_key(uid): spend for uid, spend in spends.items()}
+                                for scope, spends in data.get("user_spend", {}).items()}
+        return sketches
+
+    @classmethod
+    def from_history(cls, store) -> 'DailySketches':
+        """从列式历史记录重建（旧数据文件没有分布时使用，历史记录不含直播间）"""
+        sketches = cls()
+        for row in range(len(store)):
+            sketches.add(store.uid_at(row), store.box_at(row), store.cost[row], store.value[row])
+        return sketches
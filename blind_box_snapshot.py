@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+二进制快照
+重启时解析格式化的JSON数据文件最慢，二进制快照把同样的数据分成若干段保存：
+列数组（历史记录的时间戳、用户编号、金额等）按原始字节保存，读取时用mmap映射文件，
+直接从映射区复制（或零拷贝取 memoryview）；其余结构（用户统计、用户名表、汇总、分位数估计）
+用 MessagePack 编码，未安装msgpack时用JSON编码
+
+文件格式（小端）：
+    文件头   魔数(8) 版本(2) 段数(2) 段表CRC32(4)
+    段表     每段：名称(16) 类型(1) 数组类型码(1) 元素字节数(1) 填充(1) 偏移(8) 长度(8) CRC32(4)
+    段数据   每段按8字节对齐，类型带 FLAG_ZLIB 时为zlib压缩后的数据（归档使用，不能直接映射）
+读取时校验魔数、版本和段表CRC，每段数据在第一次读取时校验CRC；
+任何一项不符都抛出 SnapshotError，调用方回退到JSON数据文件
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict
+
+from blind_box_store import HistoryStore
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖，缺失时元数据段用JSON编码
+    msgpack = None
+
+MAGIC = b"BBSNAP\r\n"
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)     # 版本2增加压缩段
+
+_HEADER = struct.Struct("<8sHHI")
+_SECTION = struct.Struct("<16sBcBxQQI")
+_ALIGN = 8
+
+KIND_ARRAY = 0      # 列数组，原始字节
+KIND_MSGPACK = 1    # MessagePack 编码的对象
+KIND_JSON = 2       # JSON 编码的对象
+FLAG_ZLIB = 0x10    # 段数据经过zlib压缩
+
+
+class SnapshotError(ValueError):
+    """快照文件缺失段、版本不符或校验失败"""
+
+
+def snapshot_file(data_file: str) -> str:
+    """JSON数据文件对应的二进制快照：X.json -> X.snap"""
+    root, _ = os.path.splitext(str(data_file))
+    return root + ".snap"
+
+
+def encode(sections: Dict[str, object], compress: bool = False) -> bytes:
+    """
+    把 名称 -> 数组/对象 编码为快照文件内容（数组需为 array.array）
+    compress为True时每段单独用zlib压缩（CRC32按压缩后的数据计算）
+    """
+    entries = []
+    blobs = []
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    for name, value in sections.items():
+        offset += -offset % _ALIGN
+        if isinstance(value, array):
+            kind, typecode, itemsize = KIND_ARRAY, value.typecode, value.itemsize
+            if sys.byteorder != 'little':
+                value = array(value.typecode, value)
+                value.byteswap()
+            blob = value.tobytes()
+        elif msgpack is not None:
+            kind, typecode, itemsize = KIND_MSGPACK, ' ', 0
+            blob = msgpack.packb(value, use_bin_type=True)
+        else:
+            kind, typecode, itemsize = KIND_JSON, ' ', 0
+            blob = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if compress:
+            kind |= FLAG_ZLIB
+            blob = zlib.compress(blob, 6)
+        entries.append(_SECTION.pack(name.encode('ascii'), kind, typecode.encode('ascii'), itemsize,
+                                     offset, len(blob), zlib.crc32(blob)))
+        blobs.append((offset, blob))
+        offset += len(blob)
+
+    table = b"".join(entries)
+    parts = [_HEADER.pack(MAGIC, VERSION, len(entries), zlib.crc32(table)), table]
+    position = _HEADER.size + len(table)
+    for offset, blob in blobs:
+        parts.append(b"\0" * (offset - position))
+        parts.append(blob)
+        position = offset + len(blob)
+    return b"".join(parts)
+
+
+class SnapshotReader:
+    """
+    快照读取：打开时只校验文件头和段表，各段按需读取
+    view() 返回的 memoryview 直接指向映射区，关闭前必须先释放
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError("快照文件为空")
+        try:
+            self._sections = self._read_table()
+        except Exception:
+            self._map.close()
+            raise
+        self._verified = set()
+
+    def __enter__(self) -> 'SnapshotReader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def close(self):
+        self._map.close()
+
+    def get(self, name: str):
+        """读取一段：数组段返回 array 副本，其余返回解码后的对象"""
+        kind, typecode, offset, length = self._section(name)
+        if kind & FLAG_ZLIB:
+            kind &= ~FLAG_ZLIB
+            try:
+                blob = zlib.decompress(self._map[offset:offset + length])
+            except zlib.error as e:
+                raise SnapshotError(f"段 {name} 解压失败: {e}")
+        elif kind == KIND_ARRAY:
+            column = array(typecode)
+            with memoryview(self._map) as mapped:
+                column.frombytes(mapped[offset:offset + length])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            return column
+        else:
+            blob = self._map[offset:offset + length]
+
+        if kind == KIND_ARRAY:
+            column = array(typecode)
+            column.frombytes(blob)
+            if sys.byteorder != 'little':
+                column.byteswap()
+            return column
+        if kind == KIND_MSGPACK:
+            if msgpack is None:
+                raise SnapshotError(f"段 {name} 为MessagePack编码，未安装msgpack")
+            return msgpack.unpackb(blob, raw=False, strict_map_key=False)
+        return json.loads(blob.decode('utf-8'))
+
+    def view(self, name: str) -> memoryview:
+        """数组段的零拷贝只读视图（仅小端机器）"""
+        kind, typecode, offset, length = self._section(name)
+        if kind != KIND_ARRAY or sys.byteorder != 'little':
+            raise SnapshotError(f"段 {name} 不能直接映射")
+        return memoryview(self._map)[offset:offset + length].cast(typecode)
+
+    # ==================== 内部实现 ====================
+
+    def _read_table(self) -> Dict:
+        if len(self._map) < _HEADER.size:
+            raise SnapshotError("快照文件不完整")
+        magic, version, count, table_crc = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise SnapshotError("不是快照文件")
+        if version not in SUPPORTED_VERSIONS:
+            raise SnapshotError(f"快照版本 {version} 不受支持（当前为 {VERSION}）")
+        table_end = _HEADER.size + _SECTION.size * count
+        if len(self._map) < table_end or zlib.crc32(self._map[_HEADER.size:table_end]) != table_crc:
+            raise SnapshotError("段表校验失败")
+
+        sections = {}
+        for i in range(count):
+            raw_name, kind, typecode, itemsize, offset, length, crc = \
+                _SECTION.unpack_from(self._map, _HEADER.size + i * _SECTION.size)
+            name = raw_name.rstrip(b"\0").decode('ascii')
+            typecode = typecode.decode('ascii')
+            if offset + length > len(self._map):
+                raise SnapshotError(f"段 {name} 超出文件长度")
+            if (kind & ~FLAG_ZLIB) == KIND_ARRAY and array(typecode).itemsize != itemsize:
+                raise SnapshotError(f"段 {name} 的元素字节数与本机不一致")
+            sections[name] = (kind, typecode, offset, length, crc)
+        return sections
+
+    def _section(self, name: str):
+        section = self._sections.get(name)
+        if section is None:
+            raise SnapshotError(f"快照缺少段 {name}")
+        kind, typecode, offset, length, crc = section
+        if name not in self._verified:
+            if zlib.crc32(self._map[offset:offset + length]) != crc:
+                raise SnapshotError(f"段 {name} 校验失败")
+            self._verified.add(name)
+        return kind, typecode, offset, length
+
+
+def read_state(path: str) -> Dict:
+    """读取汇总快照（state段）"""
+    with SnapshotReader(path) as reader:
+        return reader.get("state")
+
+
+def load_history(path: str, rows=None):
+    """读取历史记录快照，供 HistoryStore.deferred 使用"""
+    with SnapshotReader(path) as reader:
+        columns = {name: reader.get(name) for name in HistoryStore.COLUMNS if name in reader}
+    return HistoryStore.from_columns(columns, rows)
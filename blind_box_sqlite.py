@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite存储后端（可选）
+全部日期的盲盒记录保存在一个SQLite数据库（WAL模式）中，按时间、用户、盲盒类型建索引：
+    events(id, day, seq, ts, uid, uname, blind_name, cost, value, room_id)
+        索引 (ts)、(uid, ts)、(blind_name)、(day, seq)
+    user_daily(day, uid, uname, count, cost, value, profit_count, loss_count, break_even_count)
+    box_daily(day, blind_name, count, cost, value)
+入库的记录先放在内存缓冲区，写入线程按刷新间隔（缓冲区满时提前唤醒）在一个事务里批量插入，
+并累加到两张汇总表；
+查询只读取所需的范围，不需要把整天的数据加载到内存
+金额为毫元整数，day为本地日期 YYYY-MM-DD，seq为当日事件日志中的序号（没有时为NULL）
+"""
+
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+FLUSH_INTERVAL = 1.0     # 批量写入间隔（秒）
+MAX_BATCH = 5000         # 缓冲区达到这么多条时唤醒写入线程
+BUSY_TIMEOUT = 5000      # 等待其他连接释放写锁的时间（毫秒）
+RANK_ORDERS = {
+    "cost": "cost DESC, count DESC, uid",
+    "value": "value DESC, count DESC, uid",
+    "profit": "value - cost DESC, count DESC, uid",
+    "count": "count DESC, cost DESC, uid",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    day TEXT NOT NULL,
+    seq INTEGER,
+    ts REAL NOT NULL,
+    uid INTEGER NOT NULL,
+    uname TEXT,
+    blind_name TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    room_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS idx_events_uid_ts ON events (uid, ts);
+CREATE INDEX IF NOT EXISTS idx_events_blind_name ON events (blind_name);
+CREATE INDEX IF NOT EXISTS idx_events_day_seq ON events (day, seq);
+
+CREATE TABLE IF NOT EXISTS user_daily (
+    day TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    uname TEXT,
+    count INTEGER NOT NULL DEFAULT 0,
+    cost INTEGER NOT NULL DEFAULT 0,
+    value INTEGER NOT NULL DEFAULT 0,
+    profit_count INTEGER NOT NULL DEFAULT 0,
+    loss_count INTEGER NOT NULL DEFAULT 0,
+    break_even_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, uid)
+);
+CREATE INDEX IF NOT EXISTS idx_user_daily_uid ON user_daily (uid, day);
+
+CREATE TABLE IF NOT EXISTS box_daily (
+    day TEXT NOT NULL,
+    blind_name TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    cost INTEGER NOT NULL DEFAULT 0,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, blind_name)
+);
+"""
+
+EVENT_COLUMNS = ("id", "day", "seq", "ts", "uid", "uname", "blind_name", "cost", "value", "room_id")
+
+
+def day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts).date().isoformat()
+
+
+class SqliteStore:
+    """SQLite存储：批量写入 + 按索引查询"""
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()         # 保护缓冲区
+        self._write_lock = threading.Lock()   # 同一时间只有一个批量写入
+        self._pending = []
+        self._local = threading.local()       # 每个线程一个只读连接
+        self._closed = threading.Event()
+        self._due = threading.Event()         # 缓冲区满时提前唤醒写入线程
+
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._writer.commit()
+
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=BUSY_TIMEOUT / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT}")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    # ==================== 写入 ====================
+
+    def add(self, ts: float, uid, uname: Optional[str], blind_name: str,
+            cost: int, value: int, room_id=None, seq: Optional[int] = None):
+        """缓冲一条记录，由写入线程批量写入；缓冲区满时只唤醒写入线程，调用方不等待写入"""
+        with self._lock:
+            self._pending.append((day_of(ts), seq, ts, uid, uname, blind_name,
+                                  int(cost), int(value), room_id))
+            full = len(self._pending) >= MAX_BATCH
+        if full:
+            self._due.set()
+
+    def flush(self) -> int:
+        """把缓冲区写入数据库（一个事务），返回写入条数"""
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            users, boxes = {}, {}
+            for day, _, _, uid, uname, blind_name, cost, value, _ in batch:
+                user = users.setdefault((day, uid), [uname, 0, 0, 0, 0, 0, 0])
+                if uname is not None:
+                    user[0] = uname
+                user[1] += 1
+                user[2] += cost
+                user[3] += value
+                user[4 if value > cost else 5 if value < cost else 6] += 1
+                box = boxes.setdefault((day, blind_name), [0, 0, 0])
+                box[0] += 1
+                box[1] += cost
+                box[2] += value
+
+            try:
+                with self._writer:
+                    self._writer.executemany(
+                        "INSERT INTO events (day, seq, ts, uid, uname, blind_name, cost, value, room_id) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                    self._writer.executemany(
+                        "INSERT INTO user_daily (day, uid, uname, count, cost, value, "
+                        "profit_count, loss_count, break_even_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (day, uid) DO UPDATE SET "
+                        "uname = COALESCE(excluded.uname, uname), "
+                        "count = count + excluded.count, cost = cost + excluded.cost, "
+                        "value = value + excluded.value, "
+                        "profit_count = profit_count + excluded.profit_count, "
+                        "loss_count = loss_count + excluded.loss_count, "
+                        "break_even_count = break_even_count + excluded.break_even_count",
+                        [(day, uid, *stats) for (day, uid), stats in users.items()])
+                    self._writer.executemany(
+                        "INSERT INTO box_daily (day, blind_name, count, cost, value) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT (day, blind_name) DO UPDATE SET "
+                        "count = count + excluded.count, cost = cost + excluded.cost, "
+                        "value = value + excluded.value",
+                        [(day, name, *stats) for (day, name), stats in boxes.items()])
+            except sqlite3.Error:
+                # 写入失败时放回缓冲区，下次重试
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+            return len(batch)
+
+    def next_seq(self, day: str) -> int:
+        """某天已写入的事件日志序号之后的位置（启动时从事件日志补写缺少的部分）"""
+        row = self._reader().execute(
+            "SELECT MAX(seq) FROM events WHERE day = ?", (day,)).fetchone()
+        return row[0] + 1 if row[0] is not None else 0
+
+    def close(self):
+        """写入剩余记录并停止写入线程"""
+        self._closed.set()
+        self._due.set()
+        self._thread.join(self.flush_interval * 2 + 1)
+        self.flush()
+        self._writer.close()
+
+    def _run(self):
+        while True:
+            self._due.wait(self.flush_interval)
+            self._due.clear()
+            if self._closed.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[ERROR] 写入SQLite失败: {e}")
+
+    # ==================== 查询 ====================
+
+    def events(self, since: Optional[float] = None, until: Optional[float] = None,
+               uid=None, blind_name: Optional[str] = None,
+               before: Optional[Tuple[float, int]] = None, limit: int = 100) -> Dict:
+        """
+        按时间倒序查询记录（同一时间按id倒序），before为上一页返回的游标 (ts, id)，不含
+        补写的记录id不一定随时间递增，游标同时比较时间和id
+        返回 {'events', 'next': 下一页游标 [ts, id] 或None}
+        """
+        where, params = [], []
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts <= ?")
+            params.append(until)
+        if uid is not None:
+            where.append("uid = ?")
+            params.append(uid)
+        if blind_name is not None:
+            where.append("blind_name = ?")
+            params.append(blind_name)
+        if before is not None:
+            # (ts, id) < (游标ts, 游标id)；单独的 ts <= ? 让查询使用时间索引
+            before_ts, before_id = before
+            where.append("ts <= ? AND (ts < ? OR id < ?)")
+            params.extend([before_ts, before_ts, before_id])
+
+        sql = f"SELECT {', '.join(EVENT_COLUMNS)} FROM events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        rows = self._reader().execute(sql, params + [limit + 1]).fetchall()
+
+        events = [dict(row) for row in rows[:limit]]
+        next_before = [events[-1]["ts"], events[-1]["id"]] if len(rows) > limit else None
+        return {"events": events, "next": next_before}
+
+    def user_days(self, uid, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """某个用户每天的汇总，按日期升序"""
+        where, params = self._day_range(since, until)
+        rows = self._reader().execute(
+            "SELECT * FROM user_daily WHERE uid = ?" + "".join(f" AND {w}" for w in where) +
+            " ORDER BY day", [uid] + params).fetchall()
+        return [dict(row) for row in rows]
+
+    def ranking(self, since: Optional[str] = None, until: Optional[str] = None,
+                order: str = "cost", limit: int = 100, offset: int = 0) -> List[Dict]:
+        """
+        日期范围内按用户合计的排行
+        用户名取范围内最后一天记录的名字（只对当前页的用户查询）
+        """
+        if order not in RANK_ORDERS:
+            raise ValueError(f"order只能是 {', '.join(RANK_ORDERS)}")
+        where, params = self._day_range(since, until)
+        condition = "".join(f" AND {w}" for w in where)
+        sql = ("SELECT uid, (SELECT uname FROM user_daily d WHERE d.uid = ranked.uid "
+               f"AND d.uname IS NOT NULL{condition} ORDER BY d.day DESC LIMIT 1) AS uname, "
+               "count, cost, value FROM ("
+               "SELECT uid, SUM(count) AS count, SUM(cost) AS cost, SUM(value) AS value "
+               f"FROM user_daily WHERE 1{condition} "
+               f"GROUP BY uid ORDER BY {RANK_ORDERS[order]} LIMIT ? OFFSET ?) AS ranked "
+               f"ORDER BY {RANK_ORDERS[order]}")
+        rows = self._reader().execute(sql, params + params + [limit, offset]).fetchall()
+        return [dict(row) for row in rows]
+
+    def user_count(self, since: Optional[str] = None, until: Optional[str] = None) -> int:
+        """日期范围内的用户数"""
+        where, params = self._day_range(since, until)
+        sql = "SELECT COUNT(DISTINCT uid) FROM user_daily"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._reader().execute(sql, params).fetchone()[0]
+
+    def boxes(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """日期范围内按盲盒类型合计，盲盒数降序"""
+        where, params = self._day_range(since, until)
+        sql = "SELECT blind_name, SUM(count) AS count, SUM(cost) AS cost, SUM(value) AS value FROM box_daily"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY blind_name ORDER BY count DESC"
+        return [dict(row) for row in self._reader().execute(sql, params).fetchall()]
+
+    def days(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """每天的总计，按日期升序"""
+        where, params = self._day_range(since, until)
+        sql = ("SELECT day, SUM(count) AS count, SUM(cost) AS cost, SUM(value) AS value, "
+               "COUNT(*) AS user_count FROM user_daily")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " GROUP BY day ORDER BY day"
+        return [dict(row) for row in self._reader().execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _day_range(since: Optional[str], until: Optional[str]):
+        where, params = [], []
+        if since:
+            where.append("day >= ?")
+            params.append(since)
+        if until:
+            where.append("day <= ?")
+            params.append(until)
+        return where, params
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+盲盒历史记录列式存储
+每条记录拆成几列定长数组：时间戳、用户编号、盲盒类型编号、花费、价值（毫元），
+用户和盲盒名称各存一份，按用户的记录只保存行号。
+每条记录约二十几字节，聚合时可以直接把列交给 array/NumPy 处理
+
+另有两张字典表供各处共用：
+NameTable 把盲盒名称映射为小整数编号，UserDirectory 记录 uid 对应的当前用户名和改名历史
+
+历史记录与汇总分开保存（history_file），启动时只读取汇总，
+历史记录用 HistoryStore.deferred 在第一次访问时才读取
+"""
+
+import json
+import os
+import threading
+from array import array
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def history_file(data_file) -> str:
+    """数据文件对应的历史记录文件：blind_box_data_X.json -> blind_box_data_X.history.json"""
+    root, _ = os.path.splitext(str(data_file))
+    return root + ".history.json"
+
+
+def to_yuan(milli: int) -> float:
+    """毫元整数转为元，只在输出时使用"""
+    return milli / 1000
+
+
+def to_milli(yuan) -> int:
+    """元转为毫元整数（读取旧格式数据时使用）"""
+    return round(yuan * 1000)
+
+
+def uid_key(key):
+    """JSON对象的键总是字符串，把数字uid转回整数"""
+    try:
+        return int(key)
+    except (TypeError, ValueError):
+        return key
+
+
+class NameTable:
+    """名称驻留表：名称 <-> 从0开始的小整数编号，编号一经分配不再变化"""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names = []
+        self._ids = {}
+        for name in names:
+            self.intern(name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, name_id: int) -> str:
+        return self.names[name_id]
+
+    def intern(self, name: str) -> int:
+        """名称对应的编号，第一次出现时分配新编号"""
+        name_id = self._ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self._ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+    def id_of(self, name: str) -> Optional[int]:
+        """只查询不分配，未出现过的名称返回None"""
+        return self._ids.get(name)
+
+
+class UserDirectory:
+    """uid -> 当前用户名，观众改名时保留旧名和改名时间"""
+
+    def __init__(self):
+        self._names = {}     # uid -> 当前用户名
+        self._renames = {}   # uid -> [[改名时间戳, 旧用户名], ...]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self._names
+
+    def update(self, uid, uname: str, ts: Optional[float] = None) -> bool:
+        """登记用户名，新用户或改名时返回True"""
+        current = self._names.get(uid)
+        if current == uname:
+            return False
+        if current is not None:
+            when = ts if ts is not None else datetime.now().timestamp()
+            self._renames.setdefault(uid, []).append([when, current])
+        self._names[uid] = uname
+        return True
+
+    def uname(self, uid, default: str = "未知") -> str:
+        """当前用户名"""
+        return self._names.get(uid, default)
+
+    def renames(self, uid) -> List[Dict]:
+        """改名记录，按时间先后"""
+        return [{"time": datetime.fromtimestamp(ts).strftime(TIME_FORMAT), "uname": old}
+                for ts, old in self._renames.get(uid, [])]
+
+    def timeline(self) -> Iterator:
+        """按先后列出 (uid, 用户名, 启用时间戳)，依次 update 即可重建整张表和改名记录"""
+        for uid, current in self._names.items():
+            since = None
+            for ts, old in self._renames.get(uid, []):
+                yield uid, old, since
+                since = ts
+            yield uid, current, since
+
+    def clear(self):
+        self._names.clear()
+        self._renames.clear()
+
+    def replace(self, other: 'UserDirectory'):
+        """用另一张表的内容替换，对象本身不变（事件索引等共用方继续持有引用）"""
+        self._names = other._names
+        self._renames = other._renames
+
+    def to_dict(self) -> Dict:
+        """可JSON序列化的格式（副本，可以交给后台线程写入）"""
+        return {"names": dict(self._names),
+                "renames": {uid: list(items) for uid, items in self._renames.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'UserDirectory':
+        directory = cls()
+        directory._names = {uid_key(uid): name for uid, name in data.get("names", {}).items()}
+        directory._renames = {uid_key(uid): list(items)
+                              for uid, items in data.get("renames", {}).items()}
+        return directory
+
+    @classmethod
+    def from_user_stats(cls, user_stats: Dict) -> 'UserDirectory':
+        """旧格式每个用户统计里带 uname，取出来建表"""
+        directory = cls()
+        for uid, user in user_stats.items():
+            if "uname" in user:
+                directory._names[uid] = user["uname"]
+        return directory
+
+
+class UserRows:
+    """某个用户的历史记录视图，按行号读取，不复制数据"""
+
+    def __init__(self, store: 'HistoryStore', rows: array):
+        self._store = store
+        self._rows = rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._store.row(i) for i in self._rows[index]]
+        return self._store.row(self._rows[index])
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in self._rows:
+            yield self._store.row(i)
+
+    @property
+    def rows(self) -> array:
+        """行号数组"""
+        return self._rows
+
+
+class HistoryStore:
+    """列式历史记录存储"""
+
+    # to_columns 的各项：名称表和列数组，按用户的行号拼成一列，另记每个用户的行数
+    COLUMNS = ("uids", "boxes", "ts", "uid", "box", "cost", "value", "user_rows", "user_row_counts")
+
+    def __init__(self):
+        self.ts = array('I')         # 时间戳（秒）
+        self.uid_idx = array('I')    # 用户编号 -> self.uids
+        self.box_idx = array('H')    # 盲盒类型编号 -> self.boxes
+        self.cost = array('I')       # 盲盒价格（毫元）
+        self.value = array('I')      # 爆出礼物价值（毫元）
+
+        self.uids = []               # 用户编号 -> uid
+        self.boxes = NameTable()     # 盲盒类型编号 <-> 名称
+        self._uid_ids = {}
+        self._user_rows = []         # 用户编号 -> array(行号)
+
+    def __len__(self) -> int:
+        pending = self.__dict__.get('_pending_load')
+        if pending is not None:
+            return pending[1]
+        return len(self.ts)
+
+    # ==================== 延迟加载 ====================
+
+    @classmethod
+    def deferred(cls, path: str, rows: int,
+                 loader: Optional[Callable[[str, int], 'HistoryStore']] = None) -> 'HistoryStore':
+        """
+        延迟加载：只记下历史记录文件和汇总中的行数，列数据第一次被访问时才读取
+        文件中多于rows的行（汇总保存之前写入的新记录）被丢弃，由预写日志重放
+        loader(path, rows) 读取文件，默认为JSON列格式；文件少于rows行时由loader从日志补齐
+        """
+        store = cls.__new__(cls)
+        store.__dict__['_pending_load'] = (path, rows, loader or cls._load_json, threading.Lock())
+        return store
+
+    @property
+    def loaded(self) -> bool:
+        return '_pending_load' not in self.__dict__
+
+    def prefetch(self):
+        """在后台线程读取列数据，之后的访问不用再等待"""
+        if not self.loaded:
+            threading.Thread(target=self._materialize, name="history-prefetch", daemon=True).start()
+
+    def __getattr__(self, name):
+        # 只有延迟加载且尚未读取时，访问列数据才会走到这里
+        if name.startswith('__') or '_pending_load' not in self.__dict__:
+            raise AttributeError(name)
+        self._materialize()
+        return getattr(self, name)
+
+    def _materialize(self):
+        pending = self.__dict__.get('_pending_load')
+        if pending is None:
+            return
+        path, rows, loader, lock = pending
+        with lock:
+            if '_pending_load' not in self.__dict__:
+                return
+            try:
+                loaded = loader(path, rows)
+            except (OSError, ValueError) as e:
+                print(f"[ERROR] 读取历史记录 {path} 失败: {e}")
+                loaded = HistoryStore()
+            if len(loaded) < rows:
+                # 能从日志补齐的调用方在loader中补齐，走到这里说明缺少的记录已无法恢复
+                print(f"[ERROR] 历史记录 {path} 只有{len(loaded)}条，汇总中为{rows}条，缺少的记录无法恢复")
+            self.__dict__.update(loaded.__dict__)
+            del self.__dict__['_pending_load']
+
+    @classmethod
+    def _load_json(cls, path: str, rows: int) -> 'HistoryStore':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f), rows)
+
+    # ==================== 写入 ====================
+
+    def append(self, uid, blind_name: str, cost: int, value: int,
+               ts: Optional[float] = None) -> int:
+        """追加一条记录，cost/value为毫元整数，返回行号"""
+        row = len(self.ts)
+        uid_id = self._uid_id(uid)
+        self.ts.append(int(ts if ts is not None else datetime.now().timestamp()))
+        self.uid_idx.append(uid_id)
+        self.box_idx.append(self.boxes.intern(blind_name))
+        self.cost.append(int(cost))
+        self.value.append(int(value))
+        self._user_rows[uid_id].append(row)
+        return row
+
+    def clear(self):
+        """清空（换日时使用）"""
+        self.__dict__.pop('_pending_load', None)
+        self.__init__()
+
+    # ==================== 读取 ====================
+
+    def row(self, i: int) -> Dict:
+        """单行记录，格式与旧版 history 条目一致（金额为元）"""
+        cost = self.cost[i]
+        value = self.value[i]
+        return {
+            "time": datetime.fromtimestamp(self.ts[i]).strftime(TIME_FORMAT),
+            "blind_name": self.boxes[self.box_idx[i]],
+            "cost": to_yuan(cost),
+            "value": to_yuan(value),
+            "profit": to_yuan(value - cost)
+        }
+
+    def user_history(self, uid) -> UserRows:
+        """用户的历史记录视图"""
+        uid_id = self._uid_ids.get(uid)
+        if uid_id is None:
+            return UserRows(self, array('I'))
+        return UserRows(self, self._user_rows[uid_id])
+
+    def uid_at(self, i: int):
+        """第i行的uid"""
+        return self.uids[self.uid_idx[i]]
+
+    def box_at(self, i: int) -> str:
+        """第i行的盲盒名称"""
+        return self.boxes[self.box_idx[i]]
+
+    # ==================== 序列化 ====================
+
+    def to_dict(self) -> Dict:
+        """转换为可JSON序列化的列格式（副本）"""
+        return {
+            "uids": list(self.uids),
+            "boxes": list(self.boxes.names),
+            "ts": self.ts.tolist(),
+            "uid": self.uid_idx.tolist(),
+            "box": self.box_idx.tolist(),
+            "cost": self.cost.tolist(),
+            "value": self.value.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, rows: Optional[int] = None) -> 'HistoryStore':
+        """从列格式恢复，rows不为None时只取前rows行"""
+        store = cls()
+        store.uids = list(data.get("uids", []))
+        store.boxes = NameTable(data.get("boxes", []))
+        store._uid_ids = {uid: i for i, uid in enumerate(store.uids)}
+        store.ts = array('I', data.get("ts", [])[:rows])
+        store.uid_idx = array('I', data.get("uid", [])[:rows])
+        store.box_idx = array('H', data.get("box", [])[:rows])
+        store.cost = array('I', data.get("cost", [])[:rows])
+        store.value = array('I', data.get("value", [])[:rows])
+
+        store._user_rows = [array('I') for _ in store.uids]
+        for row, uid_id in enumerate(store.uid_idx):
+            store._user_rows[uid_id].append(row)
+        return store
+
+    def to_columns(self) -> Dict:
+        """列数组格式（副本），供二进制快照按原始字节保存"""
+        user_rows = array('I')
+        counts = array('I')
+        for rows in self._user_rows:
+            user_rows.extend(rows)
+            counts.append(len(rows))
+        return {
+            "uids": list(self.uids),
+            "boxes": list(self.boxes.names),
+            "ts": self.ts[:],
+            "uid": self.uid_idx[:],
+            "box": self.box_idx[:],
+            "cost": self.cost[:],
+            "value": self.value[:],
+            "user_rows": user_rows,
+            "user_row_counts": counts
+        }
+
+    @classmethod
+    def from_columns(cls, columns: Dict, rows: Optional[int] = None) -> 'HistoryStore':
+        """从列数组格式恢复，rows不为None时只取前rows行；按用户的行号不用逐行重建"""
+        store = cls()
+        store.uids = list(columns["uids"])
+        store.boxes = NameTable(columns["boxes"])
+        store._uid_ids = {uid: i for i, uid in enumerate(store.uids)}
+        store.ts = columns["ts"][:rows]
+        store.uid_idx = columns["uid"][:rows]
+        store.box_idx = columns["box"][:rows]
+        store.cost = columns["cost"][:rows]
+        store.value = columns["value"][:rows]
+
+        if "user_rows" in columns and len(store.ts) == len(columns["ts"]):
+            user_rows = columns["user_rows"]
+            start = 0
+            for count in columns["user_row_counts"]:
+                store._user_rows.append(user_rows[start:start + count])
+                start += count
+        else:
+            store._user_rows = [array('I') for _ in store.uids]
+            for row, uid_id in enumerate(store.uid_idx):
+                store._user_rows[uid_id].append(row)
+        return store
+
+    @classmethod
+    def from_user_history(cls, user_stats: Dict) -> 'HistoryStore':
+        """把旧版每个用户的 history 列表转换为列式存储，按时间排序一次"""
+        records = []
+        for uid, user in user_stats.items():
+            for record in user.get("history", []):
+                try:
+                    ts = datetime.strptime(record["time"], TIME_FORMAT).timestamp()
+                except (KeyError, ValueError):
+                    ts = 0
+                records.append((ts, uid, record))
+
+        records.sort(key=lambda item: item[0])
+        store = cls()
+        for ts, uid, record in records:
+            store.append(uid, record.get("blind_name", "未知"),
+                         to_milli(record.get("cost", 0)),
+                         to_milli(record.get("value", 0)),
+                         ts=ts)
+        return store
+
+    # ==================== 内部实现 ====================
+
+    def _uid_id(self, uid) -> int:
+        uid_id = self._uid_ids.get(uid)
+        if uid_id is None:
+            uid_id = len(self.uids)
+            self._uid_ids[uid] = uid_id
+            self.uids.append(uid)
+            self._user_rows.append(array('I'))
+        return uid_id
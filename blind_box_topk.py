@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+长周期的高频用户统计（Space-Saving 算法）
+固定保留 capacity 个计数器，新用户在表满时顶替计数最小的那个并继承其计数作为误差上界，
+任何累计值超过 总量/capacity 的用户一定在表中；内存与观众总数无关
+"""
+
+import heapq
+from typing import Dict, List, Optional
+
+TOPK_CAPACITY = 1000   # 计数器个数
+
+
+class SpaceSaving:
+    """带权重的 Space-Saving 计数表"""
+
+    def __init__(self, capacity: int = TOPK_CAPACITY):
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}    # key -> [估计值, 误差上界]
+        self._labels = {}    # key -> 显示名称（只保留表中的key）
+        self._heap = []      # (估计值, key)，惰性删除，取最小值时跳过过期条目
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def __contains__(self, key) -> bool:
+        return key in self._counts
+
+    def add(self, key, weight: int, label: Optional[str] = None):
+        """累加key的权重（非负）"""
+        if weight <= 0:
+            return
+        self.total += weight
+        entry = self._counts.get(key)
+        if entry is None:
+            if len(self._counts) < self.capacity:
+                entry = self._counts[key] = [0, 0]
+            else:
+                # 顶替当前最小的计数器，继承其计数作为误差
+                floor, evicted = self._pop_min()
+                del self._counts[evicted]
+                self._labels.pop(evicted, None)
+                entry = self._counts[key] = [floor, floor]
+        entry[0] += weight
+        if label is not None:
+            self._labels[key] = label
+        heapq.heappush(self._heap, (entry[0], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._compact()
+
+    def counts(self) -> Dict:
+        """表中全部key的估计值"""
+        return {key: entry[0] for key, entry in self._counts.items()}
+
+    def label(self, key) -> Optional[str]:
+        return self._labels.get(key)
+
+    def estimate(self, key) -> int:
+        """估计值（不小于真实值），不在表中时返回0"""
+        entry = self._counts.get(key)
+        return entry[0] if entry else 0
+
+    def top(self, limit: int = 10) -> List[Dict]:
+        """估计值最大的limit个，guaranteed表示估计值减去误差后仍能确定排在这个位置"""
+        items = heapq.nlargest(limit + 1, self._counts.items(), key=lambda item: item[1][0])
+        result = []
+        for i, (key, (count, error)) in enumerate(items[:limit]):
+            next_count = items[i + 1][1][0] if i + 1 < len(items) else 0
+            result.append({
+                "key": key,
+                "label": self._labels.get(key),
+                "count": count,
+                "error": error,
+                "guaranteed": count - error >= next_count
+            })
+        return result
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+            entry = self._counts.get(key)
+            if entry is not None and entry[0] == count:
+                return count, key
+
+    def _compact(self):
+        """丢弃堆中的过期条目"""
+        self._heap = [(entry[0], key) for key, entry in self._counts.items()]
+        heapq.heapify(self._heap)
+
+    def to_dict(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "items": [[key, entry[0], entry[1], self._labels.get(key)]
+                      for key, entry in self._counts.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SpaceSaving':
+        sketch = cls(data.get("capacity", TOPK_CAPACITY))
+        sketch.total = data.get("total", 0)
+        for key, count, error, label in data.get("items", []):
+            sketch._counts[key] = [count, error]
+            if label is not None:
+                sketch._labels[key] = label
+        sketch._compact()
+        return sketch
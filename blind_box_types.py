@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按盲盒类型的统计
+每种盲盒（original_gift_name）维护盲盒数、花费、价值、各档盲盒价格，
+以及按爆出礼物价格的精确分布（礼物价格是有限的几个离散值，直接计数）
+入库时增量更新，按名称查询为一次字典查找
+金额为毫元整数
+"""
+
+import csv
+import io
+import threading
+from typing import Dict, List, Optional
+
+EXPORT_FIELDS = ('blind_name', 'gift_price', 'count', 'probability')
+
+
+def to_csv(rows: List[Dict]) -> str:
+    """把导出行写成CSV文本"""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS, lineterminator='\n',
+                            extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+class BoxTypeStats:
+    """单种盲盒的统计"""
+    __slots__ = ('name', 'count', 'cost', 'value', 'prices', 'payouts', 'max_value', 'max_count')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.cost = 0
+        self.value = 0
+        self.prices = {}      # 盲盒价格 -> 次数
+        self.payouts = {}     # 爆出礼物价格 -> 次数
+        self.max_value = 0    # 开出过的最大礼物价格
+        self.max_count = 0    # 最大礼物开出的次数
+
+    def add(self, cost: int, value: int):
+        self.count += 1
+        self.cost += cost
+        self.value += value
+        self.prices[cost] = self.prices.get(cost, 0) + 1
+        self.payouts[value] = self.payouts.get(value, 0) + 1
+        if value > self.max_value:
+            self.max_value = value
+            self.max_count = 1
+        elif value == self.max_value:
+            self.max_count += 1
+
+    @property
+    def return_rate(self) -> float:
+        """返还率（价值/花费，百分比）"""
+        return self.value / self.cost * 100 if self.cost > 0 else 0
+
+    def summary(self) -> Dict:
+        """汇总数值（不含分布）"""
+        return {
+            "blind_name": self.name,
+            "count": self.count,
+            "cost": self.cost,
+            "value": self.value,
+            "profit": self.value - self.cost,
+            "return_rate": self.return_rate,
+            "prices": sorted(self.prices),
+            "max_value": self.max_value,
+            "max_count": self.max_count,
+            "max_rate": self.max_count / self.count if self.count else 0
+        }
+
+    def histogram(self) -> List[Dict]:
+        """礼物价格分布，按价格升序"""
+        return [{"gift_price": price, "count": count,
+                 "probability": count / self.count}
+                for price, count in sorted(self.payouts.items())]
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "cost": self.cost,
+            "value": self.value,
+            "prices": [[price, count] for price, count in self.prices.items()],
+            "payouts": [[price, count] for price, count in self.payouts.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, name: str, data: Dict) -> 'BoxTypeStats':
+        stats = cls(name)
+        stats.count = data.get("count", 0)
+        stats.cost = data.get("cost", 0)
+        stats.value = data.get("value", 0)
+        stats.prices = {price: count for price, count in data.get("prices", [])}
+        stats.payouts = {price: count for price, count in data.get("payouts", [])}
+        if stats.payouts:
+            stats.max_value = max(stats.payouts)
+            stats.max_count = stats.payouts[stats.max_value]
+        return stats
+
+
+class BoxTypeTable:
+    """全部盲盒类型的统计表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}    # 盲盒名称 -> BoxTypeStats，按首次出现顺序
+
+    def __len__(self) -> int:
+        return len(self._types)
+
+    def __contains__(self, blind_name: str) -> bool:
+        return blind_name in self._types
+
+    def add(self, blind_name: str, cost: int, value: int) -> BoxTypeStats:
+        """累加一条记录，返回该盲盒类型的统计"""
+        with self._lock:
+            stats = self._types.get(blind_name)
+            if stats is None:
+                stats = self._types[blind_name] = BoxTypeStats(blind_name)
+            stats.add(cost, value)
+            return stats
+
+    def get(self, blind_name: str) -> Optional[BoxTypeStats]:
+        return self._types.get(blind_name)
+
+    def names(self) -> List[str]:
+        return list(self._types)
+
+    def clear(self):
+        with self._lock:
+            self._types = {}
+
+    # ==================== 导出 ====================
+
+    def export_rows(self) -> List[Dict]:
+        """全部盲盒类型的分布，每个(盲盒, 礼物价格)一行，金额为毫元"""
+        with self._lock:
+            rows = []
+            for stats in self._types.values():
+                for item in stats.histogram():
+                    rows.append(dict(item, blind_name=stats.name))
+            return rows
+
+    # ==================== 序列化 ====================
+
+    def to_dict(self) -> Dict:
+        """可JSON序列化的格式，随每日数据文件保存"""
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self._types.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BoxTypeTable':
+        table = cls()
+        for name, item in data.items():
+            table._types[name] = BoxTypeStats.from_dict(name, item)
+        return table
+
+    @classmethod
+    def from_history(cls, store) -> 'BoxTypeTable':
+        """从列式历史记录重建（旧数据文件没有盲盒类型统计时使用）"""
+        table = cls()
+        for row in range(len(store)):
+            table.add(store.box_at(row), store.cost[row], store.value[row])
+        return table
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预写日志（WAL）
+每条盲盒记录入库时追加一行JSON并立即刷新，快照只需定期保存；
+启动时加载快照，再重放日志中快照之后的记录，崩溃时最多丢失未刷新的最后一行
+
+每行带有全局递增的序号 seq，快照记录保存时已包含的序号（wal_seq），
+重放时跳过 seq < wal_seq 的记录；快照写完后可以删除已包含的记录，
+即使删除前崩溃，重复的记录也会按序号跳过
+    {"seq": 0, "ts": ..., "uid": 123, "uname": "某观众", "blind_name": "心动盲盒", "cost": 15000, "value": 36000}
+
+GUI线程不能做文件读写时用 LogWriter：入库时只把记录放进队列，由后台线程追加
+"""
+
+import json
+import os
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class WriteAheadLog:
+    """只追加的JSON行日志"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.seq = 0            # 下一条记录的序号
+        self.pending = 0        # 上次快照之后追加的记录数
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def append(self, record: Dict) -> int:
+        """追加一条记录并刷新到系统缓冲区，返回序号"""
+        with self._lock:
+            seq = self.seq
+            line = json.dumps(dict(record, seq=seq), ensure_ascii=False, separators=(',', ':'))
+            writer = self._open_writer()
+            writer.write(line.encode('utf-8') + b"\n")
+            writer.flush()
+            self.seq += 1
+            self.pending += 1
+            return seq
+
+    def append_many(self, records: List[Dict]) -> int:
+        """按顺序追加多条记录，最后刷新一次，返回下一条记录的序号"""
+        with self._lock:
+            lines = []
+            for record in records:
+                lines.append(json.dumps(dict(record, seq=self.seq + len(lines)),
+                                        ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n")
+            writer = self._open_writer()
+            writer.write(b"".join(lines))
+            writer.flush()
+            self.seq += len(lines)
+            self.pending += len(lines)
+            return self.seq
+
+    def replay(self, after: int = 0) -> Iterator[Dict]:
+        """
+        按顺序读出 seq >= after 的记录（启动时调用）
+        崩溃留下的半行被截掉，之后的追加从截断处继续
+        """
+        self.seq = max(self.seq, after)
+        if not os.path.exists(self.path):
+            return
+
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                seq = record.pop("seq", None)
+                if seq is None:
+                    continue
+                self.seq = max(self.seq, seq + 1)
+                if seq >= after:
+                    self.pending += 1
+                    yield record
+
+        if os.path.getsize(self.path) != valid_size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def read(self, after: int = 0, before: Optional[int] = None) -> Iterator[Dict]:
+        """
+        只读：按顺序读出 after <= seq < before 的完整记录，不改变序号和计数
+        可以在其他线程调用（例如后台读取历史记录时补齐快照之后的部分）
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                seq = record.pop("seq", None)
+                if seq is None or seq < after:
+                    continue
+                if before is not None and seq >= before:
+                    break
+                yield record
+
+    def checkpoint(self) -> int:
+        """开始保存快照：返回快照应包含到的序号（不含），并把待保存计数清零"""
+        with self._lock:
+            self.pending = 0
+            return self.seq
+
+    def truncate(self, upto: int):
+        """
+        快照（包含 seq < upto 的记录）写完后删除日志中的这些记录；
+        之后没有追加时直接清空，否则只保留 seq >= upto 的行（写临时文件后替换）
+        """
+        with self._lock:
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            if not os.path.exists(self.path):
+                return
+            if self.seq == upto:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(0)
+                return
+            temp_path = f"{self.path}.tmp"
+            with open(self.path, 'rb') as source, open(temp_path, 'wb') as target:
+                for line in source:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        seq = json.loads(line).get("seq")
+                    except ValueError:
+                        break
+                    if seq is not None and seq >= upto:
+                        target.write(line)
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(temp_path, self.path)
+
+    def remove(self, upto: int) -> bool:
+        """快照已包含全部记录（seq < upto）时删除日志文件（换日后不再追加的旧日志），返回是否删除"""
+        with self._lock:
+            if self.seq != upto:
+                return False
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+
+    def _open_writer(self):
+        """懒打开日志文件（追加模式）"""
+        if self._writer is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._writer = open(self.path, 'ab')
+        return self._writer
+
+
+class LogWriter:
+    """
+    后台追加线程：调用方只把记录放进队列，不做文件读写
+    积压的多条记录一次写入、刷新一次；call() 提交的函数在它之前提交的记录全部写完后执行
+    """
+
+    def __init__(self, name: str = "wal-writer"):
+        self._cond = threading.Condition()
+        self._queue = deque()           # (日志, 记录) 或 (None, 函数)
+        self._busy = False
+        self._closed = False
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def append(self, wal: WriteAheadLog, record: Dict):
+        """把一条记录排进队列（之后不能再修改）"""
+        self._put(wal, record)
+
+    def call(self, func: Callable[[], None]):
+        """排进一个函数，在写入线程执行（例如快照写完后清空日志）"""
+        self._put(None, func)
+
+    def flush(self, timeout=None) -> bool:
+        """等待队列全部处理完，超时返回False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout=None) -> bool:
+        """处理完队列后停止线程（程序退出前调用）"""
+        done = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return done
+
+    def _put(self, wal, item):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("写入线程已关闭")
+            self._queue.append((wal, item))
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                items = list(self._queue)
+                self._queue.clear()
+                self._busy = True
+
+            try:
+                self._process(items)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _process(self, items: List):
+        """相邻的同一日志的记录合并为一次追加，函数按顺序执行"""
+        batch_wal, batch = None, []
+        for wal, item in items + [(None, None)]:
+            if batch and wal is not batch_wal:
+                try:
+                    batch_wal.append_many(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"[ERROR] 追加 {batch_wal.path} 失败: {e}")
+                batch = []
+            if wal is not None:
+                batch_wal = wal
+                batch.append(item)
+            elif item is not None:
+                try:
+                    item()
+                except Exception as e:
+                    print(f"[ERROR] 日志写入线程执行失败: {e}")
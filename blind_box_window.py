@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+滑动窗口排行榜（最近10分钟 / 1小时 / 24小时）
+窗口按固定长度的时间桶划分，每个桶记录桶内各用户的盲盒数、花费、价值，
+另维护整个窗口内各用户的累计值：入库时累加到最新的桶，桶滑出窗口时整桶减去，
+不需要重新扫描记录。窗口边界的精度为一个桶长
+金额为毫元整数
+"""
+
+import heapq
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 窗口名称 -> (窗口长度, 桶长度)，单位秒
+WINDOWS = {
+    "10m": (600, 10),
+    "1h": (3600, 60),
+    "24h": (86400, 900),
+}
+
+# 排序依据
+ORDERS = ("spend", "profit", "count")
+
+
+class WindowLeaderboard:
+    """单个滑动窗口的排行榜"""
+
+    def __init__(self, window_seconds: int, bucket_seconds: int):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self._lock = threading.Lock()
+        self._buckets = deque()   # (桶起点, {uid: [盲盒数, 花费, 价值]})，按时间先后
+        self._totals = {}         # uid -> [盲盒数, 花费, 价值]，窗口内累计
+        self.version = 0          # 榜单内容变化时递增，推送时用来判断是否需要重发
+
+    def __len__(self) -> int:
+        return len(self._totals)
+
+    def add(self, ts: float, uid, cost: int, value: int):
+        """累加一条记录"""
+        with self._lock:
+            self._expire(ts)
+            start = int(ts) // self.bucket_seconds * self.bucket_seconds
+            if self._buckets and self._buckets[-1][0] >= start:
+                # 同一个桶（时间回拨的记录也计入最新的桶）
+                users = self._buckets[-1][1]
+            else:
+                users = {}
+                self._buckets.append((start, users))
+
+            for stats in (users.setdefault(uid, [0, 0, 0]), self._totals.setdefault(uid, [0, 0, 0])):
+                stats[0] += 1
+                stats[1] += cost
+                stats[2] += value
+            self.version += 1
+
+    def expire(self, now: Optional[float] = None) -> bool:
+        """移除滑出窗口的桶，有变化时返回True"""
+        with self._lock:
+            return self._expire(now if now is not None else time.time())
+
+    def top(self, limit: int = 10, order: str = "spend",
+            now: Optional[float] = None) -> List[Dict]:
+        """窗口内前limit名，order为 spend（花费）/ profit（盈亏）/ count（盲盒数）"""
+        if order not in ORDERS:
+            raise ValueError(f"order只能是 {', '.join(ORDERS)}")
+        with self._lock:
+            self._expire(now if now is not None else time.time())
+            if order == "spend":
+                key = lambda item: (item[1][1], item[1][0])
+            elif order == "profit":
+                key = lambda item: (item[1][2] - item[1][1], item[1][0])
+            else:
+                key = lambda item: (item[1][0], item[1][1])
+            ranked = heapq.nlargest(max(0, limit), self._totals.items(), key=key)
+            return [{"uid": uid, "count": stats[0], "cost": stats[1], "value": stats[2],
+                     "profit": stats[2] - stats[1]}
+                    for uid, stats in ranked]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._totals.clear()
+            self.version += 1
+
+    def _expire(self, now: float) -> bool:
+        cutoff = now - self.window_seconds
+        changed = False
+        while self._buckets and self._buckets[0][0] + self.bucket_seconds <= cutoff:
+            _, users = self._buckets.popleft()
+            for uid, stats in users.items():
+                total = self._totals[uid]
+                total[0] -= stats[0]
+                total[1] -= stats[1]
+                total[2] -= stats[2]
+                if total[0] <= 0:
+                    del self._totals[uid]
+            changed = changed or bool(users)
+        if changed:
+            self.version += 1
+        return changed
+
+
+class WindowBoards:
+    """全部滑动窗口排行榜"""
+
+    def __init__(self):
+        self.boards = {name: WindowLeaderboard(window, bucket)
+                       for name, (window, bucket) in WINDOWS.items()}
+
+    def add(self, ts: float, uid, cost: int, value: int):
+        for board in self.boards.values():
+            board.add(ts, uid, cost, value)
+
+    def get(self, name: str) -> Optional[WindowLeaderboard]:
+        return self.boards.get(name)
+
+    def clear(self):
+        for board in self.boards.values():
+            board.clear()
+
+    @classmethod
+    def from_history(cls, store, now: Optional[float] = None,
+                     earlier: Iterable[Tuple[float, object, int, int]] = ()) -> 'WindowBoards':
+        """
+        用历史记录中仍在最长窗口内的部分重建（启动时使用）
+        earlier为当天之前的记录 (时间戳, uid, 花费, 价值)，按时间排序，
+        24小时窗口跨过零点时用前一天的记录补上零点之前的部分
+        """
+        boards = cls()
+        now = now if now is not None else time.time()
+        cutoff = now - max(window for window, _ in WINDOWS.values())
+        for ts, uid, cost, value in earlier:
+            if ts >= cutoff:
+                boards.add(ts, uid, cost, value)
+        rows = [row for row in range(len(store)) if store.ts[row] >= cutoff]
+        rows.sort(key=lambda row: store.ts[row])
+        for row in rows:
+            boards.add(store.ts[row], store.uid_at(row), store.cost[row], store.value[row])
+        return boards
@@ -5,6 +5,7 @@ B站直播间盲盒盈亏统计工具 - 持久化版本
 """
 
 import asyncio
+import functools
 import json
 import struct
 import zlib
@@ -16,10 +17,17 @@ import hashlib
 import urllib.parse
 import re
 import sys
-from datetime import datetime
+from datetime import datetime, date
 from collections import defaultdict
+import heapq
 import os
 
+from blind_box_store import HistoryStore, UserDirectory, history_file, to_yuan, uid_key
+from blind_box_topk import SpaceSaving
+from blind_box_wal import WriteAheadLog
+from blind_box_persist import SnapshotWriter
+from blind_box_window import WindowBoards
+
 # 确保输出不被缓冲
 sys.stdout.reconfigure(line_buffering=True)
 
@@ -29,9 +37,15 @@ COOKIE = "buvid3=C3AE6C7D-7D68-60A7-B11F-33B2E1CAB44C88526infoc; b_nut=175803028
 
 # 数据保存文件
 DATA_FILE = "blind_box_data.json"
+# 每天结束时，当天的逐用户统计写入归档文件，内存中只保留当天
+ARCHIVE_FILE_FORMAT = "blind_box_archive_{}.json"
+# 预写日志：每条记录入库时追加，数据文件只需定期保存快照，启动时重放快照之后的部分
+WAL_FILE = "blind_box_wal.jsonl"
 
-# 自动保存间隔（秒）
+# 自动保存（快照）间隔（秒）
 AUTO_SAVE_INTERVAL = 60
+# 距上次快照新增这么多条记录时提前保存
+SNAPSHOT_EVENTS = 1000
 # 显示排行榜间隔（秒）
 RANKING_DISPLAY_INTERVAL = 300
 # =================================================
@@ -44,8 +58,46 @@ MIXIN_KEY_ENC_TAB = [
 ]
 
 # 全局统计数据
-user_stats = {}  # {uid: {uname, count, cost, value, profit, history}}
-total_stats = {"count": 0, "cost": 0, "value": 0, "profit": 0}
+current_day = date.today()  # user_stats/history_store 所属的日期
+user_stats = {}  # 当天 {uid: {count, cost, value, profit}}，金额均为毫元整数
+total_stats = {"count": 0, "cost": 0, "value": 0, "profit": 0}  # 全部时间
+user_names = UserDirectory()  # 当天 uid -> 当前用户名（含改名记录）
+history_store = HistoryStore()  # 当天全部盲盒记录（列式存储）
+
+# 长期榜：每天结束时把当天的逐用户统计折叠进固定大小的计数表，内存不随观众数增长
+top_spenders = SpaceSaving()  # 累计花费
+# 盈利日累计：每天净盈利为正时累加当天盈利，亏损的日子不扣减（计数表只接受非负权重），
+# 因此是"赢钱那些天的盈利之和"，不是累计净盈亏
+top_winning_days = SpaceSaving()
+horizon_start = None          # 长期榜的起始日期
+window_boards = WindowBoards()  # 最近10分钟/1小时/24小时排行榜（不保存，重启后重新累计）
+wal = WriteAheadLog(WAL_FILE)  # 上次写入完整历史记录之后的记录
+snapshot_writer = SnapshotWriter()  # 数据文件和归档文件的后台写入线程，不阻塞消息接收
+
+
+def load_history(path: str, rows: int, day: date, stop: int) -> HistoryStore:
+    """
+    读取单独保存的历史记录（供 HistoryStore.deferred 使用）
+    文件只在换日和退出前写入，之后的记录从预写日志中补齐：文件记录了写入时的日志序号，
+    读取该序号到汇总的序号（stop）之间属于当天的记录；文件缺失、损坏或不是当天的文件时从日志重建
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("date", day.isoformat()) != day.isoformat():
+            raise ValueError(f"文件属于{data['date']}")
+        store = HistoryStore.from_dict(data, rows)
+        start = data.get("wal_seq", 0)
+    except (OSError, ValueError) as e:
+        print(f"[提示] 历史记录 {path} 不可用（{e}），从预写日志重建")
+        store, start = HistoryStore(), 0
+    for record in wal.read(start, stop):
+        if len(store) >= rows:
+            break
+        if date.fromtimestamp(record["ts"]) == day:
+            store.append(record["uid"], record["blind_name"], record["cost"], record["value"],
+                         ts=record["ts"])
+    return store
 
 
 class BlindBoxTracker:
@@ -57,36 +109,53 @@ class BlindBoxTracker:
 
     def add_blind_box(self, uid: int, uname: str, gift_name: str,
                      blind_price: int, gift_price: int):
-        """添加盲盒记录"""
+        """添加盲盒记录：先追加到预写日志，再累加统计"""
+        ts = time.time()
+        wal.append({"ts": ts, "uid": uid, "uname": uname, "blind_name": gift_name,
+                    "cost": blind_price, "value": gift_price})
+        rolled_over = date.fromtimestamp(ts) != current_day
+        self.apply_event(ts, uid, uname, gift_name, blind_price, gift_price)
+        if rolled_over:
+            # 换日：新一天的第一次快照写入完整的历史记录，之后可以删除预写日志中前一天的记录
+            self.save_to_file(final=True)
+
+        # 显示单次盲盒结果
+        self.display_single_record(uname, gift_name, to_yuan(blind_price),
+                                   to_yuan(gift_price), to_yuan(gift_price - blind_price))
+
+        # 显示用户累计统计
+        self.display_user_stats(uid)
+
+    def apply_event(self, ts: float, uid: int, uname: str, gift_name: str,
+                    blind_price: int, gift_price: int):
+        """把一条记录累加到统计（入库和重放预写日志共用）"""
         global user_stats, total_stats
 
-        profit = (gift_price - blind_price) / 1000
-        blind_price_yuan = blind_price / 1000
-        gift_price_yuan = gift_price / 1000
+        # 跨天时先结束前一天
+        day = date.fromtimestamp(ts)
+        if day != current_day:
+            self.close_day(next_day=day)
+
+        # 金额全程使用毫元整数，只在显示时换算为元
+        profit = gift_price - blind_price
+        user_names.update(uid, uname, ts)
 
         # 更新用户统计
         if uid not in user_stats:
             user_stats[uid] = {
                 "uid": uid,
-                "uname": uname,
                 "count": 0,
                 "cost": 0,
                 "value": 0,
-                "profit": 0,
-                "history": []
+                "profit": 0
             }
 
         user_stats[uid]["count"] += 1
         user_stats[uid]["cost"] += blind_price
         user_stats[uid]["value"] += gift_price
         user_stats[uid]["profit"] += profit
-        user_stats[uid]["history"].append({
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "blind_name": gift_name,
-            "cost": blind_price_yuan,
-            "value": gift_price_yuan,
-            "profit": profit
-        })
+        history_store.append(uid, gift_name, blind_price, gift_price, ts=ts)
+        window_boards.add(ts, uid, blind_price, gift_price)
 
         # 更新总体统计
         total_stats["count"] += 1
@@ -94,12 +163,6 @@ class BlindBoxTracker:
         total_stats["value"] += gift_price
         total_stats["profit"] += profit
 
-        # 显示单次盲盒结果
-        self.display_single_record(uname, gift_name, blind_price_yuan, gift_price_yuan, profit)
-
-        # 显示用户累计统计
-        self.display_user_stats(uid)
-
     def display_single_record(self, uname: str, blind_name: str,
                              cost: float, value: float, profit: float):
         """显示单次盲盒记录"""
@@ -119,9 +182,9 @@ class BlindBoxTracker:
             return
 
         stats = user_stats[uid]
-        print(f"[累计统计] {stats['uname']}: 已送{stats['count']}个盲盒, "
+        print(f"[累计统计] {user_names.uname(uid)}: 已送{stats['count']}个盲盒, "
               f"总花费{stats['cost']/1000:.2f}元, 总价值{stats['value']/1000:.2f}元, "
-              f"总盈亏{stats['profit']:+.2f}元\n")
+              f"总盈亏{to_yuan(stats['profit']):+.2f}元\n")
 
     def display_ranking(self, top_n: int = 10):
         """显示排行榜"""
@@ -135,50 +198,208 @@ class BlindBoxTracker:
                             reverse=True)[:top_n]
 
         for i, user in enumerate(sorted_users, 1):
-            print(f"{i}. {user['uname']}")
+            print(f"{i}. {user_names.uname(user['uid'])}")
             print(f"   盲盒数: {user['count']}个")
             print(f"   总花费: {user['cost']/1000:.2f}元")
             print(f"   总价值: {user['value']/1000:.2f}元")
-            print(f"   总盈亏: {user['profit']:+.2f}元")
+            print(f"   总盈亏: {to_yuan(user['profit']):+.2f}元")
+            print()
+
+        # 滑动窗口：最近一段时间花费最多的用户
+        for name in ("10m", "1h"):
+            items = window_boards.get(name).top(top_n)
+            if not items:
+                continue
+            print(f"[最近{name}花费榜 TOP {top_n}]")
+            for i, item in enumerate(items, 1):
+                print(f"{i}. {user_names.uname(item['uid'])}: {item['count']}个, "
+                      f"花费{to_yuan(item['cost']):.2f}元, 盈亏{to_yuan(item['profit']):+.2f}元")
             print()
 
+        # 长期榜：已结束的日子取估计值，加上今天的精确值
+        since = horizon_start.isoformat() if horizon_start else current_day.isoformat()
+        print(f"[长期花费榜 TOP {top_n}]（自 {since}）")
+        for i, (uid, label, score) in enumerate(
+                self.long_term_top(top_spenders, lambda user: user["cost"], top_n), 1):
+            print(f"{i}. {label}: {to_yuan(score):.2f}元")
+        print()
+        print(f"[长期盈利日累计榜 TOP {top_n}]（自 {since}，只累加每天净盈利为正的部分）")
+        for i, (uid, label, score) in enumerate(
+                self.long_term_top(top_winning_days, lambda user: user["value"] - user["cost"], top_n), 1):
+            print(f"{i}. {label}: {to_yuan(score):+.2f}元")
+        print()
+
         # 显示总体统计
         print(f"[总体统计]")
         print(f"总盲盒数: {total_stats['count']}个")
         print(f"总花费: {total_stats['cost']/1000:.2f}元")
         print(f"总价值: {total_stats['value']/1000:.2f}元")
-        print(f"总盈亏: {total_stats['profit']:+.2f}元")
+        print(f"总盈亏: {to_yuan(total_stats['profit']):+.2f}元")
         print(f"{'='*60}\n")
 
-    def save_to_file(self):
-        """保存数据到文件"""
-        data = {
+    def long_term_top(self, sketch: SpaceSaving, today_value, top_n: int) -> List[Tuple]:
+        """长期榜前top_n名 (uid, 用户名, 累计值)：计数表中的估计值加上今天的精确值"""
+        scores = sketch.counts()
+        for uid, user in user_stats.items():
+            value = today_value(user)
+            if value > 0:
+                scores[uid] = scores.get(uid, 0) + value
+        ranked = heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])
+        return [(uid, user_names.uname(uid, sketch.label(uid) or "未知"), score)
+                for uid, score in ranked]
+
+    def close_day(self, day: Optional[str] = None, next_day: Optional[date] = None):
+        """
+        结束一天：当天的逐用户统计写入归档文件，折叠进长期榜，然后清空
+        day为None时表示当前内存中的这一天，next_day为接下来的日期（默认今天）
+        """
+        global user_stats, user_names, history_store, current_day, horizon_start
+        day = day or current_day.isoformat()
+
+        if user_stats:
+            # 当天的统计之后会被替换为新对象，不再修改，可以直接交给写入线程
+            archive_file = ARCHIVE_FILE_FORMAT.format(day)
+            snapshot_writer.submit(archive_file, self.day_snapshot(day),
+                                   lambda: print(f"[INFO] {day} 的逐用户统计已归档到 {archive_file}"))
+
+        for uid, user in user_stats.items():
+            label = user_names.uname(uid)
+            top_spenders.add(uid, user.get("cost", 0), label)
+            top_winning_days.add(uid, user.get("value", 0) - user.get("cost", 0), label)  # 亏损的日子不计入
+        if horizon_start is None and user_stats:
+            try:
+                horizon_start = date.fromisoformat(day)
+            except ValueError:
+                horizon_start = current_day
+
+        user_stats = {}
+        user_names = UserDirectory()
+        history_store = HistoryStore()
+        current_day = next_day or date.today()
+
+    def day_snapshot(self, day: str) -> Dict:
+        """当天的精确数据"""
+        return {
+            "date": day,
             "user_stats": user_stats,
-            "total_stats": total_stats,
+            "users": user_names.to_dict(),
+            "history": history_store.to_dict()
+        }
+
+    def save_to_file(self, final: bool = False):
+        """
+        保存快照到数据文件
+        在事件循环中取一份副本，序列化和写入（临时文件 + fsync + rename）由后台写入线程完成
+        汇总文件只记录历史记录的行数：定期快照不重写历史记录，也不删除预写日志，
+        启动时文件之后的部分从预写日志补齐；final为True时（换日、退出前）另外写入完整的历史记录
+        （先于汇总写入，带有对应的日志序号），写完后删除预写日志中已包含的记录
+        """
+        wal_seq = wal.checkpoint()
+        on_done = None
+        if final and history_store.loaded:
+            snapshot_writer.submit(history_file(DATA_FILE),
+                                   dict(history_store.to_dict(), date=current_day.isoformat(), wal_seq=wal_seq))
+            on_done = lambda: wal.truncate(wal_seq)
+        data = {
+            "date": current_day.isoformat(),
+            "user_stats": {uid: dict(user) for uid, user in user_stats.items()},
+            "users": user_names.to_dict(),
+            "history_rows": len(history_store),
+            "wal_seq": wal_seq,
+            "total_stats": dict(total_stats),
+            "horizon_start": horizon_start.isoformat() if horizon_start else None,
+            "top_spenders": top_spenders.to_dict(),
+            "top_winning_days": top_winning_days.to_dict(),
             "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
+        snapshot_writer.submit(DATA_FILE, data, on_done)
+
+    def load_from_file(self):
+        """从文件加载快照，再重放预写日志中快照之后的记录"""
+        data = self.load_snapshot()
+
+        replayed = 0
         try:
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            for record in wal.replay(data.get("wal_seq", 0)):
+                self.apply_event(record["ts"], record["uid"], record["uname"], record["blind_name"],
+                                 record["cost"], record["value"])
+                replayed += 1
         except Exception as e:
-            print(f"[ERROR] 保存数据失败: {e}")
+            print(f"[ERROR] 重放预写日志失败: {e}")
+        if replayed:
+            print(f"[INFO] 已从预写日志重放{replayed}条记录\n")
+
+        # 不是今天的数据（包括旧版本跨越多天的文件）：归档后折叠进长期榜
+        if data and not data.get("date"):
+            self.close_day("legacy")
+        elif current_day != date.today():
+            self.close_day()
+        elif not replayed or data.get("date") == current_day.isoformat():
+            return
+        # 日期变了（重放中跨过零点也算）：写入完整的历史记录，删除预写日志中已包含的记录
+        self.save_to_file(final=True)
 
-    def load_from_file(self):
-        """从文件加载数据"""
-        global user_stats, total_stats
+    def load_snapshot(self) -> Dict:
+        """加载数据文件，返回读取到的原始数据（没有文件或读取失败时为空）"""
+        global user_stats, total_stats, history_store, user_names
+        global top_spenders, top_winning_days, horizon_start, current_day
         if not os.path.exists(DATA_FILE):
-            return
+            return {}
 
         try:
             with open(DATA_FILE, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                user_stats = data.get("user_stats", {})
+                # JSON中的uid会被转为字符串，转回整数
+                user_stats = {uid_key(uid): user_data
+                              for uid, user_data in data.get("user_stats", {}).items()}
                 total_stats = data.get("total_stats",
                     {"count": 0, "cost": 0, "value": 0, "profit": 0})
+
+                # 新格式单独保存，后台读取，第一次访问时若未读完则等待；
+                # 上一版本与汇总保存在一起；旧格式从每个用户的 history 列表转换
+                if "history_rows" in data:
+                    history_store = HistoryStore.deferred(
+                        history_file(DATA_FILE), data["history_rows"],
+                        functools.partial(load_history, day=date.fromisoformat(data["date"]),
+                                          stop=data.get("wal_seq", 0)))
+                    history_store.prefetch()
+                elif "history" in data:
+                    history_store = HistoryStore.from_dict(data["history"])
+                else:
+                    history_store = HistoryStore.from_user_history(user_stats)
+                for user in user_stats.values():
+                    user.pop("history", None)
+
+                # 用户名表，旧格式的用户名保存在每个用户统计里
+                if "users" in data:
+                    user_names = UserDirectory.from_dict(data["users"])
+                else:
+                    user_names = UserDirectory.from_user_stats(user_stats)
+                for uid, user in user_stats.items():
+                    user.pop("uname", None)
+                    user.setdefault("uid", uid)
+
+                # 长期榜
+                if "top_spenders" in data:
+                    top_spenders = SpaceSaving.from_dict(data["top_spenders"])
+                    # 旧数据文件中同样的计数表保存为 top_winners
+                    top_winning_days = SpaceSaving.from_dict(
+                        data.get("top_winning_days", data.get("top_winners", {})))
+                if data.get("horizon_start"):
+                    horizon_start = date.fromisoformat(data["horizon_start"])
+
+                # 盈亏由毫元整数重新得出（旧版本按元累加的浮点盈亏会有误差）
+                for user in user_stats.values():
+                    user["profit"] = user.get("value", 0) - user.get("cost", 0)
+                total_stats["profit"] = total_stats.get("value", 0) - total_stats.get("cost", 0)
+                if data.get("date"):
+                    current_day = date.fromisoformat(data["date"])
             print(f"[INFO] 已加载历史数据，共{len(user_stats)}位用户，"
                   f"{total_stats['count']}个盲盒记录\n")
+            return data
         except Exception as e:
             print(f"[ERROR] 加载数据失败: {e}")
+            return {}
 
 
 def generate_wbi_sign(params: dict, img_key: str, sub_key: str) -> dict:
@@ -414,7 +635,9 @@ async def main():
     except Exception as e:
         print(f"[ERROR] {e}")
     finally:
-        tracker.save_to_file()
+        # 退出前写入完整的历史记录，下次启动不用从预写日志补齐
+        tracker.save_to_file(final=True)
+        snapshot_writer.close()
         print("\n[INFO] 数据已保存，程序退出")
 
 
@@ -495,12 +718,13 @@ async def message_listener(ws, tracker: BlindBoxTracker):
                                                     blind_price, gift_price
                                                 )
 
-                                                # 定期保存
+                                                # 定期保存快照（两次快照之间的记录已在预写日志中）
                                                 current_time = time.time()
-                                                if current_time - tracker.last_save >= AUTO_SAVE_INTERVAL:
+                                                if (current_time - tracker.last_save >= AUTO_SAVE_INTERVAL
+                                                        or wal.pending >= SNAPSHOT_EVENTS):
                                                     tracker.save_to_file()
                                                     tracker.last_save = current_time
-                                                    print("[INFO] 数据已自动保存\n")
+                                                    print("[INFO] 数据快照已交给后台保存\n")
 
                                                 # 定期显示排行榜
                                                 if current_time - tracker.last_ranking_display >= RANKING_DISPLAY_INTERVAL:
@@ -21,6 +21,8 @@ import urllib.parse
 import re
 import sys
 
+import blind_box_codec as codec
+
 #
 sys.stdout.reconfigure(line_buffering=True)
 
@@ -49,6 +51,8 @@ if CONFIG_FILE.exists():
 else:
     print("[提示] 未找到配置文件，使用默认配置")
 
+# 上报编码，启动时与Web服务器协商，旧服务器保持JSON
+WIRE_ENCODING = codec.ENCODING_JSON
 # =================================================
 
 MIXIN_KEY_ENC_TAB = [
@@ -213,21 +217,50 @@ def extract_uid_from_cookie(cookie: str) -> int:
     return 0
 
 
+def negotiate_encoding() -> str:
+    """向Web服务器查询支持的编码，失败时使用JSON"""
+    global WIRE_ENCODING
+    try:
+        response = requests.get(f"{WEB_SERVER_URL}/api/codec", timeout=2)
+        if response.status_code == 200:
+            WIRE_ENCODING = codec.negotiate(response.json().get('encodings', []))
+        else:
+            WIRE_ENCODING = codec.ENCODING_JSON
+    except Exception:
+        WIRE_ENCODING = codec.ENCODING_JSON
+    return WIRE_ENCODING
+
+
 def send_to_web_server(uid: int, uname: str, gift_name: str,
                       blind_price: int, gift_price: int):
     """发送盲盒数据到Web服务器 - 修复字段映射"""
+    global WIRE_ENCODING
+    event = {
+        'uid': uid,
+        'uname': uname,
+        'blind_name': gift_name,  # 修正：gift_name实际是盲盒名称
+        'blind_price': blind_price,
+        'gift_price': gift_price,
+        'room_id': ROOM_ID
+    }
     try:
-        requests.post(
+        body, content_type = codec.encode_event(event, WIRE_ENCODING)
+        response = requests.post(
             f"{WEB_SERVER_URL}/api/blind_box",
-            json={
-                'uid': uid,
-                'uname': uname,
-                'blind_name': gift_name,  # 修正：gift_name实际是盲盒名称
-                'blind_price': blind_price,
-                'gift_price': gift_price
-            },
+            data=body,
+            headers={'Content-Type': content_type},
             timeout=1
         )
+        # 服务器不接受二进制编码时回退到JSON并重发
+        if response.status_code in (400, 415) and WIRE_ENCODING != codec.ENCODING_JSON:
+            WIRE_ENCODING = codec.ENCODING_JSON
+            body, content_type = codec.encode_event(event, WIRE_ENCODING)
+            requests.post(
+                f"{WEB_SERVER_URL}/api/blind_box",
+                data=body,
+                headers={'Content-Type': content_type},
+                timeout=1
+            )
     except:
         pass  # 静默失败，不影响监听
 
@@ -252,7 +285,7 @@ async def main():
     try:
         response = requests.get(f"{WEB_SERVER_URL}/api/stats", timeout=2)
         if response.status_code == 200:
-            print(f"[OK] Web服务器连接成功\n")
+            print(f"[OK] Web服务器连接成功，上报编码: {negotiate_encoding()}\n")
         else:
             print(f"[WARNING] Web服务器响应异常\n")
     except:
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监听器子进程管理
+持续读取子进程输出到有界环形缓冲区，避免管道写满导致监听器阻塞；
+检测子进程异常退出并按指数退避自动重启；
+子进程以退出码0结束视为主动停止，不再重启（restart_on_clean_exit=True 时同样重启）
+"""
+
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+LOG_RING_SIZE = 2000          # 内存中保留的日志行数
+RESTART_BACKOFF_BASE = 1      # 首次重启等待（秒）
+RESTART_BACKOFF_MAX = 60      # 最长重启等待（秒）
+STABLE_RUN_SECONDS = 60       # 运行超过该时长视为稳定，退避重新计数
+MAX_RESTARTS = 10             # 连续异常退出超过该次数后放弃重启
+
+
+class MonitorWorker:
+    """监听器进程管理器"""
+
+    def __init__(self, command: List[str], cwd: Optional[str] = None,
+                 on_status: Optional[Callable[[bool], None]] = None,
+                 log_size: int = LOG_RING_SIZE, restart_on_clean_exit: bool = False):
+        self.command = command
+        self.cwd = cwd
+        self.on_status = on_status
+        self.restart_on_clean_exit = restart_on_clean_exit
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._process = None
+        self._supervisor = None
+
+        self._log = deque(maxlen=log_size)
+        self._log_seq = 0
+
+        self.running = False
+        self.restarts = 0
+        self.last_exit_code = None
+        self.next_restart_at = None
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        """启动子进程和守护线程"""
+        with self._lock:
+            if self.running:
+                return
+            self._stop_event.clear()
+            self.restarts = 0
+            self.last_exit_code = None
+            self.next_restart_at = None
+            self.running = True
+
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+        self._notify(True)
+
+    def stop(self, timeout: float = 5):
+        """停止子进程，不再重启"""
+        self._stop_event.set()
+        with self._lock:
+            process = self._process
+
+        if process:
+            self._terminate(process, timeout)
+
+        if self._supervisor and self._supervisor is not threading.current_thread():
+            self._supervisor.join(timeout=timeout)
+        self._set_stopped()
+
+    def status(self) -> Dict:
+        """当前运行状态"""
+        with self._lock:
+            process = self._process
+            next_restart_in = None
+            if self.next_restart_at is not None:
+                next_restart_in = max(0.0, round(self.next_restart_at - time.time(), 1))
+            return {
+                'running': self.running,
+                'pid': process.pid if process and process.poll() is None else None,
+                'restarts': self.restarts,
+                'last_exit_code': self.last_exit_code,
+                'next_restart_in': next_restart_in
+            }
+
+    # ==================== 日志 ====================
+
+    def logs(self, after: int = 0, limit: int = 200) -> Dict:
+        """读取序号大于after的日志行，最多limit行"""
+        with self._lock:
+            lines = [line for line in self._log if line['seq'] > after]
+            last_seq = self._log_seq
+        if limit and len(lines) > limit:
+            lines = lines[-limit:]
+        return {'lines': lines, 'last_seq': last_seq}
+
+    def _append_log(self, text: str):
+        """追加一行日志，超出容量时自动丢弃最旧的行"""
+        with self._lock:
+            self._log_seq += 1
+            self._log.append({
+                'seq': self._log_seq,
+                'time': datetime.now().strftime("%H:%M:%S"),
+                'text': text
+            })
+
+    # ==================== 内部实现 ====================
+
+    def _spawn(self) -> subprocess.Popen:
+        """启动子进程，stderr合并到stdout统一读取"""
+        env = os.environ.copy()
+        env['PYTHONUNBUFFERED'] = '1'
+        env['PYTHONIOENCODING'] = 'utf-8'
+        return subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            cwd=self.cwd,
+            env=env,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1
+        )
+
+    @staticmethod
+    def _terminate(process: subprocess.Popen, timeout: float):
+        """结束子进程，超时后强制结束"""
+        if process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _drain(self, process: subprocess.Popen):
+        """持续读取子进程输出，直到管道关闭"""
+        try:
+            for line in process.stdout:
+                self._append_log(line.rstrip('\r\n'))
+        except (OSError, ValueError):
+            pass
+        finally:
+            process.stdout.close()
+
+    def _supervise(self):
+        """守护循环：启动、等待退出、按退避策略重启"""
+        failures = 0
+
+        while not self._stop_event.is_set():
+            try:
+                process = self._spawn()
+            except Exception as e:
+                self._append_log(f"[管理] 启动失败: {e}")
+                break
+
+            # stop() 可能在启动子进程期间执行，当时还看不到这个进程：发布后再检查一次
+            with self._lock:
+                stopping = self._stop_event.is_set()
+                if not stopping:
+                    self._process = process
+                    self.next_restart_at = None
+            if stopping:
+                self._terminate(process, 5)
+                process.stdout.close()
+                break
+            self._append_log(f"[管理] 监听器已启动 (pid={process.pid})")
+
+            started_at = time.time()
+            reader = threading.Thread(target=self._drain, args=(process,), daemon=True)
+            reader.start()
+            exit_code = process.wait()
+            reader.join(timeout=5)
+
+            with self._lock:
+                self.last_exit_code = exit_code
+                self._process = None
+
+            if self._stop_event.is_set():
+                break
+            if exit_code == 0 and not self.restart_on_clean_exit:
+                self._append_log("[管理] 监听器正常退出 (code=0)，不再重启")
+                break
+
+            # 稳定运行过一段时间后，退避从头计算
+            if time.time() - started_at >= STABLE_RUN_SECONDS:
+                failures = 0
+            failures += 1
+
+            if failures > MAX_RESTARTS:
+                self._append_log(f"[管理] 监听器连续退出{MAX_RESTARTS}次，停止重启")
+                break
+
+            delay = min(RESTART_BACKOFF_BASE * 2 ** (failures - 1), RESTART_BACKOFF_MAX)
+            with self._lock:
+                self.restarts += 1
+                self.next_restart_at = time.time() + delay
+            self._append_log(f"[管理] 监听器退出 (code={exit_code})，{delay}秒后重启")
+
+            if self._stop_event.wait(delay):
+                break
+
+        self._set_stopped()
+
+    def _set_stopped(self):
+        """标记为已停止，状态变化时通知"""
+        with self._lock:
+            changed = self.running
+            self.running = False
+            self.next_restart_at = None
+        if changed:
+            self._notify(False)
+
+    def _notify(self, running: bool):
+        """状态变化回调"""
+        if self.on_status:
+            try:
+                self.on_status(running)
+            except Exception as e:
+                print(f"[ERROR] 监听器状态回调失败: {e}")
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""测试公共设置：模块都在仓库根目录，直接导入；web_server 每个测试加载一份独立副本"""
+
+import importlib.util
+import itertools
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_web_modules = itertools.count()
+
+
+def load_web_server(directory, env=None):
+    """
+    在directory中加载一份独立的web_server（数据目录为 directory/data），
+    模块级状态互不影响；env为加载前设置的环境变量
+    """
+    target = os.path.join(str(directory), "web_server.py")
+    if not os.path.exists(target):
+        shutil.copy(os.path.join(ROOT, "web_server.py"), target)
+    for key, value in (env or {}).items():
+        os.environ[key] = value
+    try:
+        spec = importlib.util.spec_from_file_location(f"web_server_test_{next(_web_modules)}", target)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for key in env or {}:
+            os.environ.pop(key, None)
+    return module
+
+
+def close_web_server(module):
+    """测试结束时等待快照写完，并释放web_server副本占用的文件"""
+    module.snapshot_writer.flush()
+    module.event_index.close()
+
+
+@pytest.fixture
+def web(tmp_path):
+    """空数据目录下的web_server模块"""
+    module = load_web_server(tmp_path)
+    yield module
+    close_web_server(module)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""每日归档：逐条读回与原记录一致后才删除原文件，核对失败时保留原文件"""
+
+import os
+import random
+
+import pytest
+
+import blind_box_archive as archive
+from blind_box_index import EventIndex
+
+DAY = "2026-01-05"
+
+
+def write_day(data_dir, count=40, seed=4):
+    """在data_dir中写一天的事件日志，返回写入的记录"""
+    rng = random.Random(seed)
+    ts = 1_767_571_200.0
+    events = []
+    index = EventIndex(os.path.join(data_dir, f"blind_box_events_{DAY}.jsonl"))
+    for _ in range(count):
+        ts += rng.choice([0.4, 1, 5])
+        event = {"ts": ts, "uid": rng.randint(1, 6), "uname": "观众",
+                 "blind_name": rng.choice(["心动盲盒", "星月盲盒"]), "cost": 15000,
+                 "value": rng.choice([0, 5000, 36000]), "room_id": rng.choice([None, 1001])}
+        index.append(event)
+        events.append(event)
+    index.close()
+    return events
+
+
+def restored(event):
+    return (int(event["ts"]), event["uid"], event["blind_name"], event["cost"], event["value"], event["room_id"])
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(archive, "CHUNK_ROWS", 7)
+
+
+def test_compact_round_trip_then_delete(tmp_path, small_chunks):
+    data_dir = str(tmp_path)
+    events = write_day(data_dir)
+    sources = archive.source_files(data_dir, DAY)
+    assert sources
+
+    summary = archive.compact_day(data_dir, DAY)
+    assert summary["count"] == 40 and summary["chunks"] == 6
+    assert summary["cost"] == sum(e["cost"] for e in events)
+    assert not any(os.path.exists(path) for path in sources)
+    assert archive.closed_days(data_dir, "2026-02-01") == []
+    assert archive.archived_days(archive.archive_dir_for(data_dir)) == [DAY]
+
+    with archive.DayArchive(archive.archive_path(archive.archive_dir_for(data_dir), DAY)) as day_archive:
+        assert [restored(e) for e in day_archive.events()] == [restored(e) for e in events]
+        assert day_archive.users().uname(events[0]["uid"]) == "观众"
+
+
+def test_day_rows_same_before_and_after_compaction(tmp_path, small_chunks):
+    data_dir = str(tmp_path)
+    events = write_day(data_dir)
+    since = events[25]["ts"]
+    before = archive.day_rows(data_dir, DAY, since=since)
+    assert len(before) == 15
+    archive.compact_day(data_dir, DAY)
+    after = archive.day_rows(data_dir, DAY, since=int(since))
+    assert [(int(ts), uid, cost, value) for ts, uid, cost, value in before] == after[-15:]
+    assert len(archive.day_rows(data_dir, DAY)) == 40
+
+
+def test_keep_leaves_sources(tmp_path):
+    data_dir = str(tmp_path)
+    write_day(data_dir)
+    sources = archive.source_files(data_dir, DAY)
+    archive.compact_day(data_dir, DAY, keep=True)
+    assert all(os.path.exists(path) for path in sources)
+
+
+def test_mismatch_keeps_sources(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    write_day(data_dir)
+    sources = archive.source_files(data_dir, DAY)
+    events = archive.DayArchive.events
+
+    def shifted(self):
+        for event in events(self):
+            event["ts"] += 1            # 金额合计不变，只有逐条核对能发现
+            yield event
+
+    monkeypatch.setattr(archive.DayArchive, "events", shifted)
+    assert archive.compact(data_dir, before="2026-02-01") == []
+    assert all(os.path.exists(path) for path in sources)
+    assert not os.path.exists(archive.archive_path(archive.archive_dir_for(data_dir), DAY))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""按盲盒类型的统计：分布为精确计数，最大奖、导出和序列化往返"""
+
+import csv
+import io
+import json
+import random
+from collections import Counter
+
+import pytest
+
+from blind_box_types import BoxTypeTable, to_csv
+
+PAYOUTS = [5000, 10000, 15000, 36000, 150000]
+
+
+def test_histogram_is_exact():
+    rng = random.Random(6)
+    table = BoxTypeTable()
+    values = [rng.choice(PAYOUTS) for _ in range(2000)]
+    for value in values:
+        table.add("心动盲盒", 15000, value)
+    stats = table.get("心动盲盒")
+    counts = Counter(values)
+    assert [(item["gift_price"], item["count"]) for item in stats.histogram()] == sorted(counts.items())
+    assert sum(item["probability"] for item in stats.histogram()) == pytest.approx(1)
+    summary = stats.summary()
+    assert summary["max_value"] == max(values) and summary["max_count"] == counts[max(values)]
+    assert summary["profit"] == sum(values) - 15000 * 2000
+    assert summary["return_rate"] == sum(values) / (15000 * 2000) * 100
+
+
+def test_round_trip_and_export():
+    table = BoxTypeTable()
+    table.add("心动盲盒", 15000, 36000)
+    table.add("心动盲盒", 15000, 5000)
+    table.add("星月盲盒", 50000, 150000)
+    restored = BoxTypeTable.from_dict(json.loads(json.dumps(table.to_dict())))
+    assert restored.names() == table.names()
+    for name in table.names():
+        assert restored.get(name).summary() == table.get(name).summary()
+        assert restored.get(name).histogram() == table.get(name).histogram()
+
+    rows = list(csv.DictReader(io.StringIO(to_csv(table.export_rows()))))
+    assert [(row["blind_name"], row["gift_price"], row["count"]) for row in rows] == [
+        ("心动盲盒", "5000", "1"), ("心动盲盒", "36000", "1"), ("星月盲盒", "150000", "1")]
+
+
+def test_box_endpoints(web):
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 36000)
+    web.tracker.add_blind_box(2, "乙", "心动盲盒", 15000, 5000)
+    client = web.app.test_client()
+    box = client.get("/api/boxes/心动盲盒").get_json()
+    assert box["count"] == 2 and box["max_value"] == 36.0
+    assert [item["gift_price"] for item in box["histogram"]] == [5.0, 36.0]
+    assert client.get("/api/boxes/不存在").status_code == 404
+    export = client.get("/api/boxes/export").data.decode("utf-8-sig")
+    assert export.splitlines()[0] == "blind_name,gift_price,count,probability"
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""编解码：MessagePack按字段顺序往返，协商回退到JSON，上报接口两种请求体结果一致"""
+
+import json
+
+import pytest
+
+import blind_box_codec as codec
+
+EVENT = {"uid": 123, "uname": "某观众", "blind_name": "心动盲盒",
+         "blind_price": 15000, "gift_price": 36000, "room_id": 456}
+
+needs_msgpack = pytest.mark.skipif(codec.msgpack is None, reason="需要msgpack")
+
+
+def test_negotiate_falls_back_to_json():
+    assert codec.negotiate([]) == codec.ENCODING_JSON
+    assert codec.negotiate(["brotli"]) == codec.ENCODING_JSON
+    assert codec.negotiate(codec.available_encodings()) == codec.available_encodings()[0]
+
+
+def test_json_event_round_trip():
+    body, content_type = codec.encode_event(EVENT, codec.ENCODING_JSON)
+    assert content_type == codec.CONTENT_TYPE_JSON
+    assert codec.decode_event(body, content_type + "; charset=utf-8") == EVENT
+    assert codec.decode_event(b"", None) == {}
+
+
+@needs_msgpack
+def test_msgpack_event_is_positional_and_round_trips():
+    body, content_type = codec.encode_event(EVENT, codec.ENCODING_MSGPACK)
+    assert content_type == codec.CONTENT_TYPE_MSGPACK
+    assert len(body) < len(json.dumps(EVENT, ensure_ascii=False).encode("utf-8"))
+    assert codec.decode_event(body, content_type) == EVENT
+    records = [{"time": "12:00:00", "uname": "甲", "blind_name": "心动盲盒",
+                "cost": 15.0, "value": 36.0, "profit": 21.0}] * 3
+    packed = codec.unpack(codec.pack_records(records, codec.RECORD_FIELDS))
+    assert [dict(zip(codec.RECORD_FIELDS, row)) for row in packed] == records
+
+
+@needs_msgpack
+def test_ingest_accepts_both_encodings(web):
+    client = web.app.test_client()
+    for encoding in (codec.ENCODING_JSON, codec.ENCODING_MSGPACK):
+        body, content_type = codec.encode_event(EVENT, encoding)
+        response = client.post("/api/blind_box", data=body, content_type=content_type)
+        assert response.status_code == 200
+    assert web.user_stats[123]["count"] == 2
+    assert web.user_stats[123]["value"] == 72000
+    bad = client.post("/api/blind_box", data=b"\xc1", content_type=codec.CONTENT_TYPE_MSGPACK)
+    assert bad.status_code == 400
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""游标翻页：排行榜游标的校验，各接口逐页取完与一次取全部一致，取页期间换日不出错"""
+
+import threading
+from datetime import timedelta
+
+import pytest
+
+from blind_box_index import decode_key_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("value", [
+    [1, 2], [1, 2, 3, 4], "abc", 5, {"a": 1}, [1, "x", 2], [True, 1, 2], [None, 1, 2],
+])
+def test_key_cursor_rejects_wrong_shape(value):
+    with pytest.raises(ValueError):
+        decode_key_cursor(encode_cursor(value))
+
+
+def test_key_cursor_rejects_garbage_and_non_finite():
+    with pytest.raises(ValueError):
+        decode_key_cursor("!!!not-base64")
+    with pytest.raises(ValueError):
+        decode_key_cursor(encode_cursor([float('nan'), 1, 2]))
+
+
+def test_key_cursor_accepts_sort_key():
+    assert decode_key_cursor(None) is None
+    assert decode_key_cursor("") is None
+    assert decode_key_cursor(encode_cursor([-12.5, -3, 7])) == (-12.5, -3, 7)
+
+
+def add_users(web, count):
+    for uid in range(count):
+        web.tracker.add_blind_box(uid, f"用户{uid}", "心动盲盒", 15000, (uid * 7919) % 40000)
+
+
+def walk(client, url):
+    items, cursor = [], None
+    while True:
+        response = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        items.extend(response.get_json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return items
+
+
+def test_ranking_pages_match_full_ranking(web):
+    add_users(web, 57)
+    client = web.app.test_client()
+    full = client.get("/api/ranking?limit=500").get_json()
+    assert walk(client, "/api/ranking?limit=10") == full
+    losses = walk(client, "/api/ranking?limit=4&sign=loss")
+    assert losses == [row for row in full if row["profit"] < 0]
+    assert walk(client, "/api/users?limit=6&sign=profit") != []
+
+
+@pytest.mark.parametrize("url", ["/api/ranking", "/api/users?sign=loss"])
+def test_bad_ranking_cursor_is_rejected(web, url):
+    add_users(web, 3)
+    client = web.app.test_client()
+    joiner = "&" if "?" in url else "?"
+    for cursor in (encode_cursor("abc"), encode_cursor([1, 2]), encode_cursor(5), "%%%"):
+        response = client.get(f"{url}{joiner}cursor={cursor}")
+        assert response.status_code == 400
+
+
+@pytest.mark.parametrize("url", ["/api/ranking?limit=5", "/api/users?limit=5&sign=profit", "/api/ranking/1"])
+def test_rollover_while_building_page(web, monkeypatch, url):
+    add_users(web, 8)
+    client = web.app.test_client()
+    index = web.ranking_index
+    original_page, original_rank = index.page, index.rank
+
+    def roll_over_meanwhile():
+        # 取到uid之后另一个线程换日，读取用户统计前给它一点时间
+        worker = threading.Thread(target=web.tracker.roll_over,
+                                  args=(web.current_day + timedelta(days=1),))
+        worker.start()
+        worker.join(0.2)
+        return worker
+
+    workers = []
+
+    def page(*args, **kwargs):
+        result = original_page(*args, **kwargs)
+        workers.append(roll_over_meanwhile())
+        return result
+
+    def rank(uid):
+        result = original_rank(uid)
+        workers.append(roll_over_meanwhile())
+        return result
+
+    monkeypatch.setattr(index, "page", page)
+    monkeypatch.setattr(index, "rank", rank)
+    response = client.get(url)
+    for worker in workers:
+        worker.join(5)
+    assert response.status_code == 200
+    assert web.total_stats["count"] == 0
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""事件索引：按时间倒序翻页、过滤查询与逐条筛选的结果一致，重新加载后不变"""
+
+import random
+
+import pytest
+
+from blind_box_index import EventIndex, profit_sign
+
+BOXES = ["心动盲盒", "星月盲盒", "奇遇盲盒"]
+
+
+def make_events(count, seed=1):
+    rng = random.Random(seed)
+    ts = 1_700_000_000.0
+    events = []
+    for _ in range(count):
+        ts += rng.choice([0, 0.5, 1, 3])
+        cost = rng.choice([15000, 50000])
+        events.append({"ts": ts, "uid": rng.randint(1, 25), "uname": "观众",
+                       "blind_name": rng.choice(BOXES), "cost": cost,
+                       "value": rng.choice([0, cost, 2 * cost])})
+    return events
+
+
+@pytest.fixture(params=["memory", "file"])
+def index(request, tmp_path):
+    path = str(tmp_path / "events.jsonl") if request.param == "file" else None
+    built = EventIndex(path)
+    for event in make_events(800):
+        built.append(event)
+    yield built
+    built.close()
+
+
+def test_pages_are_newest_first(index):
+    everything = index.page(0, 10000)
+    assert len(everything) == 800
+    assert [e["ts"] for e in everything] == sorted((e["ts"] for e in everything), reverse=True)
+    assert index.page(30, 20) == everything[30:50]
+    assert index.newest(5) == everything[:5]
+    assert index.page(795, 50) == everything[795:]
+
+
+@pytest.mark.parametrize("filters", [
+    {}, {"uid": 3}, {"blind_name": "星月盲盒"}, {"sign": "loss"},
+    {"uid": 7, "sign": "profit"}, {"blind_name": "心动盲盒", "sign": "break_even", "uid": 2},
+])
+def test_query_matches_brute_force(index, filters):
+    everything = index.page(0, 10000)
+    since, until = everything[600]["ts"], everything[100]["ts"]
+    expected = [e for e in everything
+                if since <= e["ts"] <= until
+                and ("uid" not in filters or e["uid"] == filters["uid"])
+                and ("blind_name" not in filters or e["blind_name"] == filters["blind_name"])
+                and ("sign" not in filters or profit_sign(e["value"] - e["cost"]) == filters["sign"])]
+
+    seen, before = [], None
+    while True:
+        result = index.query(since=since, until=until, before=before, limit=17, **filters)
+        seen.extend(result["events"])
+        before = result["next"]
+        if before is None:
+            break
+    assert seen == expected
+    if len(filters) <= 1:
+        assert index.query(since=since, until=until, limit=1, **filters)["matched"] == len(expected)
+
+
+def test_reload_restores_same_index(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    built = EventIndex(path)
+    for event in make_events(300, seed=2):
+        built.append(event)
+    expected = built.page(0, 1000)
+    built.close()
+
+    loaded = EventIndex(path)
+    assert loaded.load() == 300
+    assert loaded.page(0, 1000) == expected
+    assert loaded.query(uid=5, limit=1000)["events"] == [e for e in expected if e["uid"] == 5]
+    loaded.close()
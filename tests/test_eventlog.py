@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""定长事件记录文件：按序号读取、按时间二分查找、截断，记录文件与事件日志不一致时重写"""
+
+import bisect
+import os
+import random
+
+import pytest
+
+from blind_box_eventlog import RECORD, FixedEventLog
+from blind_box_index import EventIndex, records_file
+from test_event_index import make_events
+
+
+def make_records(count, seed=3):
+    rng = random.Random(seed)
+    ts = 1_700_000_000.0
+    records = []
+    for _ in range(count):
+        ts += rng.choice([0, 0.25, 1, 2])
+        records.append((ts, rng.randint(0, 40), 15000, rng.choice([0, 15000, 30000]),
+                        rng.randint(0, 3), rng.randint(0, 2)))
+    return records
+
+
+@pytest.fixture(params=["memory", "file"])
+def log(request, tmp_path):
+    path = str(tmp_path / "events.bin") if request.param == "file" else None
+    built = FixedEventLog(path)
+    built.open()
+    yield built
+    built.close()
+
+
+def test_read_and_bisect_match_list(log):
+    records = make_records(500)
+    for n, record in enumerate(records):
+        assert log.append(*record) == n
+        if n % 97 == 0:
+            assert log.read(n) == record      # 边写边读：映射区不够时重新映射
+    assert [log.read(n) for n in range(len(records))] == records
+    stamps = [record[0] for record in records]
+    for ts in stamps[::37] + [stamps[0] - 1, stamps[-1] + 1]:
+        assert log.bisect_left(ts) == bisect.bisect_left(stamps, ts)
+        assert log.bisect_right(ts) == bisect.bisect_right(stamps, ts)
+        assert log.bisect_left(ts, 100, 200) == bisect.bisect_left(stamps, ts, 100, 200)
+    with pytest.raises(IndexError):
+        log.read(len(records))
+
+
+def test_truncate_then_append(log):
+    records = make_records(50)
+    for record in records:
+        log.append(*record)
+    log.read(49)
+    log.truncate(20)
+    assert len(log) == 20
+    with pytest.raises(IndexError):
+        log.read(20)
+    log.append(*records[-1])
+    assert log.read(20) == records[-1] and log.read(19) == records[19]
+
+
+def test_open_drops_partial_record(tmp_path):
+    path = str(tmp_path / "events.bin")
+    log = FixedEventLog(path)
+    for record in make_records(10):
+        log.append(*record)
+    log.close()
+    with open(path, 'ab') as f:
+        f.write(b"\x01" * (RECORD.size // 2))
+    reopened = FixedEventLog(path)
+    assert reopened.open() == 10
+    assert os.path.getsize(path) == 10 * RECORD.size
+    reopened.close()
+
+
+def build_index(path, events):
+    index = EventIndex(path)
+    for event in events:
+        index.append(event)
+    expected = index.page(0, 10000)
+    index.close()
+    return expected
+
+
+def test_records_rewritten_when_stale(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    expected = build_index(path, make_events(200, seed=5))
+    bin_path = records_file(path)
+    with open(bin_path, 'r+b') as f:
+        f.seek(120 * RECORD.size)
+        f.write(b"\xff" * RECORD.size)         # 第120条与日志不一致
+
+    index = EventIndex(path)
+    assert index.load() == 200
+    assert index.page(0, 10000) == expected
+    index.close()
+    assert os.path.getsize(bin_path) == 200 * RECORD.size
+
+
+@pytest.mark.parametrize("damage", ["missing", "short", "long"])
+def test_records_rebuilt_from_log(tmp_path, damage):
+    path = str(tmp_path / "events.jsonl")
+    expected = build_index(path, make_events(150, seed=6))
+    bin_path = records_file(path)
+    if damage == "missing":
+        os.remove(bin_path)
+    elif damage == "short":
+        with open(bin_path, 'r+b') as f:
+            f.truncate(90 * RECORD.size + 5)
+    else:
+        with open(bin_path, 'ab') as f:
+            f.write(b"\0" * RECORD.size * 3)
+
+    index = EventIndex(path)
+    assert index.load() == 150
+    assert index.page(0, 10000) == expected
+    assert index.replay(140) == index.replay(0)[140:]
+    index.close()
+    assert os.path.getsize(bin_path) == 150 * RECORD.size
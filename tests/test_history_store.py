@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""列式历史记录：各种序列化格式往返一致，按用户的视图与逐行筛选一致，延迟加载截到汇总的行数"""
+
+import json
+import random
+
+from blind_box_store import HistoryStore
+
+
+def make_store(count=400, seed=4):
+    rng = random.Random(seed)
+    store = HistoryStore()
+    for i in range(count):
+        store.append(rng.randint(1, 30), rng.choice(["心动盲盒", "星月盲盒"]),
+                     15000, rng.choice([0, 5000, 36000]), ts=1_700_000_000 + i)
+    return store
+
+
+def rows(store):
+    return [(store.ts[i], store.uid_at(i), store.box_at(i), store.cost[i], store.value[i])
+            for i in range(len(store))]
+
+
+def test_user_history_matches_scan():
+    store = make_store()
+    for uid in (1, 7, 30, 999):
+        expected = [store.row(i) for i in range(len(store)) if store.uid_at(i) == uid]
+        assert list(store.user_history(uid)) == expected
+        assert len(store.user_history(uid)) == len(expected)
+
+
+def test_dict_and_column_round_trips():
+    store = make_store()
+    from_json = HistoryStore.from_dict(json.loads(json.dumps(store.to_dict())))
+    from_columns = HistoryStore.from_columns(store.to_columns())
+    assert rows(from_json) == rows(store)
+    assert rows(from_columns) == rows(store)
+    for uid in (2, 11):
+        assert list(from_columns.user_history(uid)) == list(store.user_history(uid))
+    truncated = HistoryStore.from_columns(store.to_columns(), rows=100)
+    assert rows(truncated) == rows(store)[:100]
+    assert list(truncated.user_history(3)) == [store.row(i) for i in range(100) if store.uid_at(i) == 3]
+
+
+def test_deferred_load_ignores_rows_after_summary(tmp_path):
+    store = make_store()
+    path = tmp_path / "history.json"
+    path.write_text(json.dumps(store.to_dict()), encoding="utf-8")
+    lazy = HistoryStore.deferred(str(path), 250)
+    assert len(lazy) == 250 and not lazy.loaded
+    assert rows(lazy) == rows(store)[:250]
+    assert lazy.loaded
+
+
+def test_legacy_user_history_is_converted_in_time_order():
+    legacy = {
+        1: {"history": [{"time": "2026-03-01 12:00:05", "blind_name": "心动盲盒", "cost": 15, "value": 36}]},
+        2: {"history": [{"time": "2026-03-01 12:00:01", "blind_name": "星月盲盒", "cost": 50, "value": 0.1}]},
+    }
+    store = HistoryStore.from_user_history(legacy)
+    assert [store.uid_at(i) for i in range(len(store))] == [2, 1]
+    assert store.value[0] == 100 and store.cost[1] == 15000
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""批量导入：各种格式的每日数据转换为归档，中断后从进度文件继续，不重复导入"""
+
+import json
+import os
+
+import blind_box_archive as archive
+from blind_box_import import PROGRESS_FILE, Importer
+
+DAYS = ["2026-01-01", "2026-01-02", "2026-01-03"]
+
+
+def write_gui_day(data_dir, day, count):
+    """GUI旧格式：blind_box_history 中每条记录带时分秒，金额为元"""
+    history = [{"time": f"{day} 12:00:{n:02d}", "uid": n % 3, "uname": f"用户{n % 3}",
+                "blind_name": "心动盲盒", "cost": 15.0, "value": 0.5 * n} for n in range(count)]
+    with open(os.path.join(data_dir, f"blind_box_data_{day}.json"), 'w', encoding='utf-8') as f:
+        json.dump({"date": day, "blind_box_count": count, "blind_box_history": history}, f, ensure_ascii=False)
+
+
+def make_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for n, day in enumerate(DAYS):
+        write_gui_day(str(data_dir), day, 5 + n)
+    return str(data_dir), str(tmp_path / "archive")
+
+
+def archived_rows(archive_dir, day):
+    with archive.DayArchive(archive.archive_path(archive_dir, day)) as day_archive:
+        return [(e["ts"], e["uid"], e["cost"], e["value"]) for e in day_archive.events()]
+
+
+def test_import_all_days(tmp_path):
+    data_dir, archive_dir = make_dir(tmp_path)
+    stats = Importer([data_dir], archive_dir, workers=2).run()
+    assert stats["days"] == 3 and stats["failed"] == 0
+    assert stats["events"] == 5 + 6 + 7
+    assert archive.archived_days(archive_dir) == DAYS
+    events, _, _, source = archive.read_day(data_dir, DAYS[1])
+    assert source == "gui"
+    assert archived_rows(archive_dir, DAYS[1]) == [(int(e["ts"]), e["uid"], e["cost"], e["value"]) for e in events]
+    assert events[3]["value"] == 1500      # 1.5元 -> 毫元
+    assert all(os.path.exists(path) for day in DAYS for path in archive.source_files(data_dir, day))
+
+
+def test_resume_from_progress_file(tmp_path):
+    data_dir, archive_dir = make_dir(tmp_path)
+    Importer([data_dir], archive_dir, workers=1).run()
+    progress_file = os.path.join(archive_dir, PROGRESS_FILE)
+    with open(progress_file, encoding='utf-8') as f:
+        progress = json.load(f)
+    assert sorted(progress) == DAYS
+
+    # 模拟中断在第二天：进度文件中只有第一、三天
+    del progress[DAYS[1]]
+    with open(progress_file, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    importer = Importer([data_dir], archive_dir, workers=1)
+    assert [day for _, day, _ in importer.tasks()] == [DAYS[1]]
+    assert importer.run()["days"] == 1
+    assert Importer([data_dir], archive_dir).tasks() == []
+
+
+def test_changed_or_missing_archive_is_imported_again(tmp_path):
+    data_dir, archive_dir = make_dir(tmp_path)
+    Importer([data_dir], archive_dir, workers=1).run()
+    write_gui_day(data_dir, DAYS[0], 9)                      # 原文件变化
+    os.remove(archive.archive_path(archive_dir, DAYS[2]))    # 归档丢失
+    importer = Importer([data_dir], archive_dir, workers=1)
+    assert sorted(day for _, day, _ in importer.tasks()) == [DAYS[0], DAYS[2]]
+    importer.run()
+    assert len(archived_rows(archive_dir, DAYS[0])) == 9
+
+
+def test_unreadable_progress_file_imports_everything(tmp_path):
+    data_dir, archive_dir = make_dir(tmp_path)
+    os.makedirs(archive_dir)
+    with open(os.path.join(archive_dir, PROGRESS_FILE), 'w') as f:
+        f.write("{")
+    assert len(Importer([data_dir], archive_dir).tasks()) == 3
+
+
+def test_same_day_in_two_dirs_imported_once(tmp_path):
+    data_dir, archive_dir = make_dir(tmp_path)
+    other = tmp_path / "other"
+    other.mkdir()
+    write_gui_day(str(other), DAYS[0], 2)
+    tasks = Importer([data_dir, str(other)], archive_dir).tasks()
+    assert [(os.path.basename(d), day) for d, day, _ in tasks] == [("data", day) for day in DAYS]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""用户累计统计：按日期去重，启动补累加可中断后继续，换日时累加前一天"""
+
+from datetime import datetime, time, timedelta
+
+import blind_box_lifetime as lifetime
+from blind_box_index import EventIndex
+from blind_box_lifetime import LifetimeIndex, combine
+from blind_box_store import UserDirectory
+
+
+def write_day(data_dir, day, events):
+    index = EventIndex(str(data_dir / f"blind_box_events_{day}.jsonl"))
+    for ts, uid, uname, cost, value in events:
+        index.append({"ts": ts, "uid": uid, "uname": uname, "blind_name": "心动盲盒",
+                      "cost": cost, "value": value})
+    index.close()
+
+
+def test_catch_up_is_idempotent(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    write_day(data_dir, "2026-03-01", [(1772337600.0, 1, "甲", 15000, 0), (1772341200.0, 2, "乙", 15000, 36000)])
+    write_day(data_dir, "2026-03-02", [(1772424000.0, 1, "甲改名", 15000, 15000)])
+    path = str(tmp_path / "lifetime.json")
+
+    index = LifetimeIndex(path)
+    assert index.catch_up(str(data_dir), before="2026-03-03") == ["2026-03-01", "2026-03-02"]
+    assert index.catch_up(str(data_dir), before="2026-03-03") == []
+    user = index.get(1)
+    assert (user["count"], user["cost"], user["value"], user["days"]) == (2, 30000, 15000, 2)
+    assert user["uname"] == "甲改名"
+
+    reloaded = LifetimeIndex(path)
+    assert reloaded.load() == 2
+    assert reloaded.catch_up(str(data_dir), before="2026-03-03") == []
+    assert reloaded.get(1) == user
+
+
+def test_summary_and_rows_agree(tmp_path):
+    users = UserDirectory()
+    users.update(1, "甲", 10)
+    rows_index = LifetimeIndex(str(tmp_path / "a.json"))
+    rows_index.add_day("2026-03-01", [(10, 1, 100, 50), (20, 1, 200, 0)], users)
+    summary_index = LifetimeIndex(str(tmp_path / "b.json"))
+    summary_index.add_summary("2026-03-01", {1: {"count": 2, "cost": 300, "value": 50,
+                                                 "first_ts": 10, "last_ts": 20}}, users)
+    assert summary_index.get(1) == rows_index.get(1)
+    assert summary_index.add_summary("2026-03-01", {1: {"count": 2, "cost": 300, "value": 50}}, users) == 0
+    assert combine(None, None) is None
+    assert combine(rows_index.get(1), {"count": 1, "cost": 5, "value": 0, "last_ts": 30})["count"] == 3
+
+
+def test_roll_over_during_load_is_kept_once(tmp_path, monkeypatch):
+    """启动补累加读取文件期间发生换日：当天的统计不丢失，文件中已有的日期也不重复累加"""
+    users = UserDirectory()
+    users.update(1, "甲", 10)
+    day1 = {1: {"count": 1, "cost": 100, "value": 0, "first_ts": 10, "last_ts": 10}}
+    day2 = {1: {"count": 2, "cost": 300, "value": 50, "first_ts": 20, "last_ts": 30}}
+    path = str(tmp_path / "lifetime.json")
+    saved = LifetimeIndex(path)
+    saved.add_summary("2026-03-01", day1, users)
+    saved.save()
+
+    index = LifetimeIndex(path)
+    real_load = lifetime.json.load
+
+    def load_then_roll_over(f):
+        data = real_load(f)
+        index.add_summary("2026-03-02", day2, users)     # 换日线程在读取期间累加前一天
+        return data
+
+    monkeypatch.setattr(lifetime.json, "load", load_then_roll_over)
+    assert index.load() == 2
+    monkeypatch.undo()
+    user = index.get(1)
+    assert (user["count"], user["cost"], user["days"], user["last_seen"]) == (3, 400, 2, 30)
+
+    # 换日在读取之前且已保存进文件：读取后不重复累加
+    index.save()
+    again = LifetimeIndex(path)
+    again.add_summary("2026-03-02", day2, users)
+    assert again.load() == 2
+    assert again.get(1) == user
+
+
+def test_roll_over_folds_closed_day_once(web, monkeypatch):
+    class Clock(datetime):
+        current = None
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.current
+
+    old_day = web.current_day
+    monkeypatch.setattr(web, "datetime", Clock)
+    Clock.current = datetime.combine(old_day, time(23, 0))
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 0)
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 36000)
+    Clock.current = datetime.combine(old_day + timedelta(days=1), time(0, 1))
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 15000)
+
+    folded = web.lifetime_index.get(1)
+    assert (folded["count"], folded["cost"], folded["days"]) == (2, 30000, 1)
+    body = web.app.test_client().get("/api/user/1").get_json()
+    assert body["count"] == 3 and body["days"] == 2
+
+    # 启动时的补累加读到同一天的文件，也不会重复计入
+    web.snapshot_writer.flush()
+    web.lifetime_index.catch_up(web.DATA_DIR, before=web.current_day.isoformat())
+    assert web.lifetime_index.get(1)["count"] == 2
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""运气评分：增量刷新与一次全部计算一致，收缩让开得少的幸运用户不排在榜首"""
+
+import random
+import threading
+
+import pytest
+
+import blind_box_luck as luck
+from blind_box_store import HistoryStore
+
+pytestmark = pytest.mark.skipif(not luck.available(), reason="需要numpy")
+
+BOXES = {"心动盲盒": 15000, "星月盲盒": 50000}
+
+
+def fill(store, rng, count, users=60):
+    for _ in range(count):
+        name = rng.choice(list(BOXES))
+        price = BOXES[name]
+        store.append(rng.randint(1, users), name, price, int(price * rng.uniform(0, 2)), ts=0)
+
+
+def test_incremental_refresh_matches_full_computation():
+    rng = random.Random(3)
+    store = HistoryStore()
+    scorer = luck.LuckScorer(store)
+    for _ in range(8):
+        fill(store, rng, 250)
+        scorer.refresh()
+
+    fresh = luck.LuckScorer(store)
+    fresh.refresh()
+    assert fresh.page(0, 1000) == scorer.page(0, 1000)
+    for user_id in fresh.page(0, 1000):
+        assert fresh.entry(user_id)["luck"] == pytest.approx(scorer.entry(user_id)["luck"], abs=1e-9)
+
+
+def test_single_lucky_box_is_shrunk():
+    rng = random.Random(5)
+    store = HistoryStore()
+    fill(store, rng, 3000, users=30)
+    # 稳定偏运气好的老用户：开了400个，每个都开出1.4倍
+    for _ in range(400):
+        store.append(500, "心动盲盒", 15000, 21000, ts=0)
+    # 幸运新人：只开了一个，开出十倍
+    store.append(999, "心动盲盒", 15000, 150000, ts=0)
+    scorer = luck.LuckScorer(store)
+    scorer.refresh()
+    lucky = scorer.entry_for(999)
+    steady = scorer.entry_for(500)
+    assert lucky["excess_rate"] > steady["excess_rate"]
+    assert lucky["shrinkage"] > 0.5 > steady["shrinkage"]
+    assert lucky["lower"] < steady["lower"]
+    assert lucky["luck"] < 0.1 * lucky["excess_rate"]
+
+
+def test_refresh_under_lock_while_appending():
+    """入库和刷新都持有同一把锁时，并发刷新不会读到长度不一致的列"""
+    rng = random.Random(9)
+    store = HistoryStore()
+    scorer = luck.LuckScorer(store)
+    lock = threading.RLock()
+    errors = []
+
+    def writer():
+        for _ in range(2000):
+            with lock:
+                fill(store, rng, 1, users=500)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while thread.is_alive():
+        try:
+            with lock:
+                scorer.refresh()
+        except Exception as e:  # pragma: no cover - 失败时报告
+            errors.append(e)
+            break
+    thread.join()
+    with lock:
+        scorer.refresh()
+    assert not errors
+    assert sum(scorer.entry(user_id)["count"] for user_id in scorer.page(0, 10000)) == len(store)
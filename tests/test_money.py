@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""金额为毫元整数：反复累加没有误差，只在输出时换算为元"""
+
+from blind_box_store import to_milli, to_yuan
+
+
+def test_conversions():
+    assert to_milli(0.1 + 0.2) == 300
+    assert to_milli(15) == 15000
+    assert to_yuan(36000) == 36.0
+    assert to_yuan(to_milli(12.345)) == 12.345
+
+
+def test_repeated_small_amounts_stay_exact(web):
+    for i in range(3000):
+        web.tracker.add_blind_box(i % 7, "观众", "小盲盒", 100, 300)   # 0.1元开出0.3元
+    assert web.total_stats["cost"] == 300000
+    assert web.total_stats["profit"] == 600000
+    assert all(isinstance(user["profit"], int) for user in web.user_stats.values())
+
+    body = web.app.test_client().get("/api/stats?limit=1").get_json()
+    assert body["total"]["profit"] == 600.0
+    assert body["recent"][0]["cost"] == 0.1 and body["recent"][0]["profit"] == 0.2
+    ranking = web.app.test_client().get("/api/ranking?limit=1").get_json()
+    assert ranking[0]["profit_rate"] == 200.0
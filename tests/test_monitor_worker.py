@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""监听器子进程管理：输出读取、退出码处理、停止与启动的竞争"""
+
+import sys
+import time
+
+import monitor_worker
+from monitor_worker import MonitorWorker
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+
+def test_output_is_drained_into_log_ring():
+    worker = MonitorWorker(python("for i in range(5000): print('line', i)"), log_size=100)
+    worker.start()
+    assert wait_until(lambda: not worker.running)
+    logs = worker.logs(limit=0)
+    texts = [line['text'] for line in logs['lines']]
+    assert "line 4999" in texts
+    assert len(logs['lines']) == 100
+
+
+def test_clean_exit_is_not_restarted():
+    worker = MonitorWorker(python("print('bye')"))
+    worker.start()
+    assert wait_until(lambda: not worker.running)
+    assert worker.restarts == 0
+    assert worker.last_exit_code == 0
+
+
+def test_clean_exit_restarts_when_configured(monkeypatch):
+    monkeypatch.setattr(monitor_worker, "RESTART_BACKOFF_BASE", 0.01)
+    worker = MonitorWorker(python("print('bye')"), restart_on_clean_exit=True)
+    worker.start()
+    assert wait_until(lambda: worker.restarts >= 2)
+    worker.stop()
+    assert not worker.running
+
+
+def test_failure_is_restarted_with_backoff(monkeypatch):
+    monkeypatch.setattr(monitor_worker, "RESTART_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(monitor_worker, "MAX_RESTARTS", 3)
+    worker = MonitorWorker(python("raise SystemExit(3)"))
+    worker.start()
+    assert wait_until(lambda: not worker.running)
+    assert worker.restarts == 3
+    assert worker.last_exit_code == 3
+
+
+def test_stop_during_spawn_does_not_orphan_child():
+    spawned = []
+
+    class RacingWorker(MonitorWorker):
+        def _spawn(self):
+            process = super()._spawn()
+            spawned.append(process)
+            # stop() 在子进程发布之前执行：看不到进程，只设置停止标志
+            self.stop(timeout=0)
+            return process
+
+    worker = RacingWorker(python("import time; time.sleep(60)"))
+    worker.start()
+    assert wait_until(lambda: spawned and spawned[0].poll() is not None)
+    assert wait_until(lambda: not worker.running)
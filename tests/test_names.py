@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""名称驻留：编号不变，改名记录可由时间线和JSON重建，事件日志重新加载后保留"""
+
+import json
+
+from blind_box_index import EventIndex
+from blind_box_store import NameTable, UserDirectory
+
+
+def test_name_table_ids_are_stable():
+    table = NameTable(["心动盲盒"])
+    assert table.intern("星月盲盒") == 1
+    assert table.intern("心动盲盒") == 0
+    assert table.id_of("未出现") is None
+    assert table[1] == "星月盲盒" and len(table) == 2
+
+
+def test_renames_survive_timeline_and_json():
+    users = UserDirectory()
+    assert users.update(1, "甲", 100)
+    assert not users.update(1, "甲", 150)
+    assert users.update(1, "甲二", 200)
+    assert users.update(1, "甲三", 300)
+    users.update(2, "乙", 120)
+
+    rebuilt = UserDirectory()
+    for uid, uname, ts in users.timeline():
+        rebuilt.update(uid, uname, ts)
+    restored = UserDirectory.from_dict(json.loads(json.dumps(users.to_dict())))
+    for copy in (rebuilt, restored):
+        assert copy.uname(1) == "甲三" and copy.uname(2) == "乙"
+        assert [item["uname"] for item in copy.renames(1)] == ["甲", "甲二"]
+    assert users.uname(3) == "未知"
+
+
+def test_event_log_reload_keeps_names(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    index = EventIndex(path)
+    index.append({"ts": 100.0, "uid": 1, "uname": "甲", "blind_name": "心动盲盒", "cost": 1, "value": 0})
+    index.append({"ts": 200.0, "uid": 1, "uname": "甲改", "blind_name": "心动盲盒", "cost": 1, "value": 0})
+    index.append({"ts": 300.0, "uid": 1, "uname": "甲改", "blind_name": "心动盲盒", "cost": 1, "value": 0})
+    index.close()
+    with open(path, encoding="utf-8") as f:
+        definitions = [line for line in f if '"def"' in line]
+    assert len(definitions) == 3   # 一个盲盒类型 + 两次用户名
+
+    users = UserDirectory()
+    loaded = EventIndex(path, users=users)
+    loaded.load()
+    assert users.uname(1) == "甲改"
+    assert [item["uname"] for item in users.renames(1)] == ["甲"]
+    assert [event["uname"] for event in loaded.page(0, 10)] == ["甲改"] * 3
+    loaded.close()
+
+
+def test_rename_is_reported_by_api(web):
+    web.tracker.add_blind_box(5, "旧名", "心动盲盒", 15000, 0)
+    web.tracker.add_blind_box(5, "新名", "心动盲盒", 15000, 0)
+    body = web.app.test_client().get("/api/ranking/5").get_json()
+    assert body["uname"] == "新名"
+    assert [item["uname"] for item in body["renames"]] == ["旧名"]
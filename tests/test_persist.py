@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""后台原子保存：临时文件替换、同一文件只写最新一份、失败计数"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from blind_box_persist import SnapshotWriter, atomic_write, dump_json
+
+
+def test_atomic_write_replaces_file_without_leftovers(tmp_path):
+    path = tmp_path / "sub" / "data.json"
+    atomic_write(str(path), dump_json({"a": 1}))
+    atomic_write(str(path), dump_json({"a": 2, "名": "甲"}))
+    assert json.loads(path.read_bytes()) == {"a": 2, "名": "甲"}
+    assert os.listdir(path.parent) == ["data.json"]
+
+
+def test_failed_encode_keeps_previous_file(tmp_path):
+    path = tmp_path / "data.json"
+    atomic_write(str(path), dump_json({"ok": True}))
+    writer = SnapshotWriter()
+    try:
+        def broken(data):
+            raise ValueError("编码失败")
+        writer.submit(str(path), {"ok": False}, encode=broken)
+        assert writer.flush(5)
+        assert writer.failed == 1 and writer.written == 0
+        assert json.loads(path.read_bytes()) == {"ok": True}
+    finally:
+        writer.close(5)
+
+
+def test_only_latest_pending_snapshot_is_written(tmp_path):
+    path = str(tmp_path / "data.json")
+    other = str(tmp_path / "other.json")
+    gate = threading.Event()
+    done = []
+    writer = SnapshotWriter()
+    try:
+        # 第一份写入阻塞在编码里，其间提交的同一文件只保留最后一份
+        writer.submit(other, {"n": 0}, encode=lambda data: gate.wait(5) and dump_json(data))
+        for n in range(1, 6):
+            writer.submit(path, {"n": n}, on_done=lambda n=n: done.append(n))
+        gate.set()
+        assert writer.flush(5)
+        assert done == [5]
+        assert writer.written == 2
+        assert json.loads(open(path, 'rb').read()) == {"n": 5}
+    finally:
+        writer.close(5)
+
+
+def test_submit_after_close_raises(tmp_path):
+    writer = SnapshotWriter()
+    writer.submit(str(tmp_path / "a.json"), {"x": 1})
+    assert writer.close(5)
+    assert (tmp_path / "a.json").exists()
+    with pytest.raises(RuntimeError):
+        writer.submit(str(tmp_path / "b.json"), {"x": 2})
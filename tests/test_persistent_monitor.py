@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""持久化监听器：跨天结束当天、长期榜折叠、快照与预写日志"""
+
+import importlib.util
+import json
+import itertools
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from conftest import ROOT
+
+_modules = itertools.count()
+
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    """工作目录为tmp_path的一份独立monitor_v4_persistent"""
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location(
+        f"monitor_persistent_test_{next(_modules)}", os.path.join(ROOT, "monitor_v4_persistent.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.snapshot_writer.flush()
+    module.wal.close()
+
+
+def ts_on(day: date, hour: int = 12) -> float:
+    return datetime(day.year, day.month, day.day, hour).timestamp()
+
+
+def test_winning_days_ignore_losing_days(monitor):
+    tracker = monitor.BlindBoxTracker()
+    day1 = date(2026, 3, 1)
+    day2 = day1 + timedelta(days=1)
+    monitor.current_day = day1
+    tracker.apply_event(ts_on(day1), 1, "甲", "心动盲盒", 10000, 20000)   # +10元
+    tracker.apply_event(ts_on(day1), 2, "乙", "心动盲盒", 10000, 5000)    # -5元
+    tracker.apply_event(ts_on(day2), 1, "甲", "心动盲盒", 30000, 0)       # 第二天 -30元
+    assert monitor.current_day == day2
+    tracker.close_day(next_day=day2 + timedelta(days=1))
+
+    # 盈利日累计：甲第一天+10元，第二天亏损不扣减；乙从未盈利
+    assert monitor.top_winning_days.estimate(1) == 10000
+    assert 2 not in monitor.top_winning_days
+    assert monitor.top_spenders.estimate(1) == 40000
+    assert monitor.horizon_start == day1
+
+
+def test_old_snapshot_key_is_still_loaded(monitor):
+    tracker = monitor.BlindBoxTracker()
+    monitor.top_winning_days.add(7, 1234, "丙")
+    tracker.save_to_file()
+    monitor.snapshot_writer.flush()
+
+    with open(monitor.DATA_FILE, encoding="utf-8") as f:
+        data = json.load(f)
+    data["top_winners"] = data.pop("top_winning_days")
+    with open(monitor.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    monitor.top_winning_days = monitor.SpaceSaving()
+    tracker.load_snapshot()
+    assert monitor.top_winning_days.estimate(7) == 1234
+
+
+def test_wal_replay_restores_events_after_snapshot(monitor):
+    tracker = monitor.BlindBoxTracker()
+    tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 36000)
+    tracker.save_to_file()
+    monitor.snapshot_writer.flush()
+    tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 5000)
+    tracker.add_blind_box(2, "乙", "心动盲盒", 15000, 15000)
+    monitor.wal.close()
+
+    monitor.wal = monitor.WriteAheadLog(monitor.WAL_FILE)
+    monitor.user_stats = {}
+    monitor.total_stats = {"count": 0, "cost": 0, "value": 0, "profit": 0}
+    tracker.load_from_file()
+    assert monitor.total_stats["count"] == 3
+    assert monitor.user_stats[1]["count"] == 2
+    assert monitor.user_stats[1]["profit"] == 36000 + 5000 - 30000
+
+
+def test_periodic_snapshot_keeps_history_and_wal(monitor):
+    """定期快照不重写历史记录：重启后文件之后的记录从预写日志补齐，最后一次快照写入完整记录"""
+    tracker = monitor.BlindBoxTracker()
+    for n in range(3):
+        tracker.add_blind_box(n, f"用户{n}", "心动盲盒", 15000, 1000 * n)
+    tracker.save_to_file(final=True)
+    monitor.snapshot_writer.flush()
+    history_path = monitor.history_file(monitor.DATA_FILE)
+    stat = os.stat(history_path)
+    assert os.path.getsize(monitor.WAL_FILE) == 0
+
+    for n in range(3, 7):
+        tracker.add_blind_box(n, f"用户{n}", "心动盲盒", 15000, 1000 * n)
+    tracker.save_to_file()
+    monitor.snapshot_writer.flush()
+    tracker.add_blind_box(7, "用户7", "心动盲盒", 15000, 7000)     # 快照之后，由重放恢复
+    assert os.stat(history_path).st_mtime_ns == stat.st_mtime_ns
+    assert os.path.getsize(history_path) == stat.st_size
+    monitor.wal.close()
+
+    monitor.wal = monitor.WriteAheadLog(monitor.WAL_FILE)
+    monitor.history_store = monitor.HistoryStore()
+    tracker.load_from_file()
+    assert list(monitor.history_store.value) == [1000 * n for n in range(8)]
+    assert list(monitor.history_store.user_history(5)) == [monitor.history_store.row(5)]
+
+    tracker.save_to_file(final=True)
+    monitor.snapshot_writer.flush()
+    assert os.path.getsize(monitor.WAL_FILE) == 0
+    with open(history_path, encoding="utf-8") as f:
+        assert json.load(f)["value"] == [1000 * n for n in range(8)]
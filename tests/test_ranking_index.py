@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""排行榜跳表：随机更新后名次、前N名、游标翻页和按方向计数都与排序后的参照一致"""
+
+import random
+
+import pytest
+
+from blind_box_index import RankingIndex
+
+
+def reference(stats, order, min_count=1):
+    """参照：全部用户排序（盈亏率降序、盲盒数降序、先上榜的在前）"""
+    rows = [(-RankingIndex.profit_rate(cost, value), -count, order[uid], uid)
+            for uid, (cost, value, count) in stats.items() if count >= min_count]
+    return [row[3] for row in sorted(rows)]
+
+
+@pytest.fixture
+def filled():
+    rng = random.Random(42)
+    index = RankingIndex(min_count=2)
+    stats, order = {}, {}
+    for _ in range(3000):
+        uid = rng.randint(1, 300)
+        cost, value, count = stats.get(uid, (0, 0, 0))
+        price = rng.choice([15000, 50000])
+        stats[uid] = (cost + price, value + rng.choice([0, price, 2 * price, price // 2]), count + 1)
+        if stats[uid][2] >= 2:
+            order.setdefault(uid, len(order))   # 同分时按首次上榜的先后
+        index.update(uid, *stats[uid])
+    for uid in rng.sample(sorted(stats), 20):
+        index.discard(uid)
+        del stats[uid]
+    return index, stats, order
+
+
+def test_top_and_rank_match_reference(filled):
+    index, stats, order = filled
+    expected = reference(stats, order, min_count=2)
+    assert len(index) == len(expected)
+    assert index.top() == expected
+    assert index.top(25, 40) == expected[40:65]
+    for position in (0, 1, len(expected) // 2, len(expected) - 1):
+        assert index.rank(expected[position]) == position
+
+
+@pytest.mark.parametrize("sign", [None, "profit", "loss", "break_even"])
+def test_cursor_pages_match_reference(filled, sign):
+    index, stats, order = filled
+    expected = reference(stats, order, min_count=2)
+    if sign is not None:
+        def direction(uid):
+            cost, value, _ = stats[uid]
+            return "profit" if value > cost else "loss" if value < cost else "break_even"
+        expected = [uid for uid in expected if direction(uid) == sign]
+
+    seen, cursor = [], None
+    while True:
+        uids, cursor = index.page(cursor and tuple(cursor), 13, sign)
+        seen.extend(uids)
+        if cursor is None:
+            break
+    assert seen == expected
+    assert index.count(sign) == len(expected)
+
+
+def test_clear_empties_index(filled):
+    index, _, _ = filled
+    index.clear()
+    assert len(index) == 0 and index.top() == [] and index.page() == ([], None)
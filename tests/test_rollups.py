@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""分钟/小时汇总：与逐条分组的结果一致，乱序记录、时间范围、序列化往返"""
+
+import json
+import random
+from collections import defaultdict
+
+import pytest
+
+from blind_box_rollup import Rollups
+from blind_box_store import HistoryStore
+
+BASE = 1_700_000_000 // 3600 * 3600
+
+
+def make_events(seed=8):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(1500):
+        ts = BASE + rng.randint(0, 4 * 3600)
+        events.append((ts, rng.randint(1, 20), rng.choice(["心动盲盒", "星月盲盒"]),
+                       15000, rng.choice([0, 15000, 36000])))
+    return events   # 时间乱序
+
+
+def grouped(events, seconds, blind_name=None):
+    buckets = defaultdict(lambda: [0, 0, 0, set()])
+    for ts, uid, name, cost, value in events:
+        if blind_name is not None and name != blind_name:
+            continue
+        bucket = buckets[ts // seconds * seconds]
+        bucket[0] += 1
+        bucket[1] += cost
+        bucket[2] += value
+        bucket[3].add(uid)
+    return buckets
+
+
+@pytest.mark.parametrize("resolution,seconds", [("minute", 60), ("hour", 3600)])
+def test_points_match_grouping(resolution, seconds):
+    events = make_events()
+    rollups = Rollups()
+    for event in events:
+        rollups.add(*event)
+    expected = grouped(events, seconds)
+    points = rollups.query(resolution)
+    assert [p["ts"] for p in points] == sorted(expected)
+    for point in points:
+        count, cost, value, users = expected[point["ts"]]
+        assert (point["count"], point["cost"], point["value"], point["users"]) == (count, cost, value, len(users))
+        assert point["profit"] == value - cost
+        assert sum(box["count"] for box in point["boxes"].values()) == count
+
+    boxes = grouped(events, seconds, "星月盲盒")
+    assert {p["ts"]: p["count"] for p in rollups.query(resolution, blind_name="星月盲盒")} == \
+        {start: bucket[0] for start, bucket in boxes.items()}
+
+
+def test_range_and_round_trip():
+    events = make_events()
+    rollups = Rollups()
+    for event in events:
+        rollups.add(*event)
+    since, until = BASE + 3600 + 30, BASE + 2 * 3600
+    points = rollups.query("minute", since, until)
+    assert points[0]["ts"] == BASE + 3600 and points[-1]["ts"] <= until
+
+    restored = Rollups.from_dict(json.loads(json.dumps(rollups.to_dict())))
+    assert restored.query("minute") == rollups.query("minute")
+    store = HistoryStore()
+    for ts, uid, name, cost, value in sorted(events):
+        store.append(uid, name, cost, value, ts=ts)
+    assert Rollups.from_history(store).query("hour") == rollups.query("hour")
+    with pytest.raises(ValueError):
+        rollups.query("day")
+
+
+def test_timeseries_endpoint(web):
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 36000)
+    web.tracker.add_blind_box(2, "乙", "心动盲盒", 15000, 0)
+    client = web.app.test_client()
+    body = client.get("/api/timeseries?resolution=hour").get_json()
+    assert sum(p["count"] for p in body["points"]) == 2
+    assert sum(p["profit"] for p in body["points"]) == 6.0
+    assert client.get("/api/timeseries?resolution=week").status_code == 400
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""分位数估计：误差在声明的相对误差内，合并等于一起统计，删除旧值后与重新统计一致"""
+
+import json
+import random
+
+import pytest
+
+from blind_box_sketch import RELATIVE_ACCURACY, DailySketches, QuantileSketch, box_scope, room_scope
+
+QS = (0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1)
+
+
+def exact(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def assert_within_bound(sketch, values):
+    for q in QS:
+        truth = exact(values, q)
+        estimate = sketch.quantile(q)
+        assert abs(estimate - truth) <= RELATIVE_ACCURACY * abs(truth) + 1e-9, (q, estimate, truth)
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_error_within_relative_accuracy(seed):
+    rng = random.Random(seed)
+    values = [round(rng.lognormvariate(9, 2)) * rng.choice([1, -1, 0]) for _ in range(20000)]
+    sketch = QuantileSketch()
+    for value in values:
+        sketch.add(value)
+    assert len(sketch) == len(values)
+    assert_within_bound(sketch, values)
+
+
+def test_merge_and_remove():
+    rng = random.Random(9)
+    parts = [[rng.randint(-50000, 200000) for _ in range(3000)] for _ in range(3)]
+    sketches = []
+    for part in parts:
+        sketch = QuantileSketch()
+        for value in part:
+            sketch.add(value)
+        sketches.append(sketch)
+    merged = QuantileSketch.merged(sketches)
+    together = QuantileSketch()
+    for value in sum(parts, []):
+        together.add(value)
+    assert merged.quantiles(QS) == together.quantiles(QS)
+
+    for value in parts[0]:
+        together.remove(value)
+    rest = QuantileSketch.merged(sketches[1:])
+    assert together.quantiles(QS) == rest.quantiles(QS)
+    restored = QuantileSketch.from_dict(json.loads(json.dumps(rest.to_dict())))
+    assert restored.quantiles(QS) == rest.quantiles(QS)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_daily_spend_tracks_running_user_totals():
+    rng = random.Random(12)
+    daily = DailySketches()
+    spends, room_spends = {}, {}
+    for _ in range(5000):
+        uid = rng.randint(1, 300)
+        cost = rng.choice([15000, 50000])
+        room = rng.choice([1, 2])
+        daily.add(uid, "心动盲盒", cost, rng.choice([0, 36000]), room)
+        spends[uid] = spends.get(uid, 0) + cost
+        if room == 1:
+            room_spends[uid] = room_spends.get(uid, 0) + cost
+    assert_within_bound(daily.get("spend"), list(spends.values()))
+    assert_within_bound(daily.get("spend", room_scope(1)), list(room_spends.values()))
+    assert daily.get("profit", box_scope("心动盲盒")).count == 5000
+
+    restored = DailySketches.from_dict(json.loads(json.dumps(daily.to_dict())))
+    restored.add(1, "心动盲盒", 15000, 0, 1)
+    spends[1] = spends.get(1, 0) + 15000
+    assert_within_bound(restored.get("spend"), list(spends.values()))
+
+
+def test_quantiles_endpoint(web):
+    for uid in range(50):
+        web.tracker.add_blind_box(uid, "观众", "心动盲盒", 15000, 1000 * uid)
+    client = web.app.test_client()
+    body = client.get("/api/quantiles?metric=spend&q=0.5").get_json()
+    assert body["count"] == 50
+    assert body["quantiles"]["p50"] == pytest.approx(15.0, rel=RELATIVE_ACCURACY)
+    profit = client.get("/api/quantiles?metric=profit&q=0,1").get_json()["quantiles"]
+    assert profit["p0"] == pytest.approx(-15.0, rel=RELATIVE_ACCURACY)
+    assert profit["p100"] == pytest.approx(34.0, rel=RELATIVE_ACCURACY)
+    assert client.get("/api/quantiles?q=2").status_code == 400
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""二进制快照：往返一致、CRC校验失败时回退到JSON数据文件或事件日志"""
+
+import os
+import threading
+from array import array
+
+import pytest
+
+import blind_box_snapshot as snapshot
+from blind_box_store import history_file
+from conftest import close_web_server, load_web_server
+
+BINARY = {"BLIND_BOX_SNAPSHOT": "binary"}
+
+
+def wait_warm_up():
+    for thread in threading.enumerate():
+        if thread.name == "history-warm-up":
+            thread.join(5)
+
+
+def corrupt(path, offset=-3):
+    raw = bytearray(open(path, 'rb').read())
+    raw[offset] ^= 0xFF
+    with open(path, 'wb') as f:
+        f.write(raw)
+
+
+def fill(web, start, stop):
+    for n in range(start, stop):
+        web.tracker.add_blind_box(n % 5, f"用户{n % 5}", "心动盲盒", 15000, 700 * n)
+
+
+def test_sections_round_trip(tmp_path):
+    path = tmp_path / "x.snap"
+    ts = array('d', [1.5, 2.5, 3.5])
+    cost = array('q', [15000, -1, 2 ** 40])
+    path.write_bytes(snapshot.encode({"ts": ts, "cost": cost, "state": {"名": [1, 2], "n": None}}))
+    with snapshot.SnapshotReader(str(path)) as reader:
+        assert reader.get("ts") == ts and reader.get("cost") == cost
+        assert reader.get("state") == {"名": [1, 2], "n": None}
+        with reader.view("cost") as view:
+            assert view.tolist() == cost.tolist()
+        with pytest.raises(snapshot.SnapshotError):
+            reader.get("missing")
+
+    compressed = tmp_path / "z.snap"
+    compressed.write_bytes(snapshot.encode({"cost": cost}, compress=True))
+    with snapshot.SnapshotReader(str(compressed)) as reader:
+        assert reader.get("cost") == cost
+
+
+def test_crc_mismatch_raises(tmp_path):
+    path = tmp_path / "x.snap"
+    path.write_bytes(snapshot.encode({"state": {"count": 3}}))
+    corrupt(path)
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.read_state(str(path))
+    path.write_bytes(b"")
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.read_state(str(path))
+
+
+def test_corrupt_state_falls_back_to_previous_json(tmp_path):
+    web = load_web_server(tmp_path)
+    fill(web, 0, 20)
+    web.tracker.save_to_file(wait=True)      # JSON数据文件（切换到二进制之前的版本）
+    close_web_server(web)
+
+    binary = load_web_server(tmp_path, BINARY)
+    fill(binary, 20, 35)
+    binary.tracker.save_to_file(wait=True)
+    fill(binary, 35, 40)
+    expected = {uid: dict(user) for uid, user in binary.user_stats.items()}
+    snap = snapshot.snapshot_file(binary.day_data_file(binary.current_day))
+    close_web_server(binary)
+    corrupt(snap)
+
+    again = load_web_server(tmp_path, BINARY)
+    try:
+        assert again.tracker.snapshot_seq == 20   # JSON数据文件之后的记录从事件日志重放
+        assert again.total_stats["count"] == 40
+        assert again.user_stats == expected
+        wait_warm_up()
+        assert again.tracker.check_aggregates() == []
+    finally:
+        close_web_server(again)
+
+
+def test_corrupt_state_without_json_replays_event_log(tmp_path):
+    web = load_web_server(tmp_path, BINARY)
+    fill(web, 0, 25)
+    web.tracker.save_to_file(wait=True)
+    snap = snapshot.snapshot_file(web.day_data_file(web.current_day))
+    close_web_server(web)
+    corrupt(snap)
+    assert not os.path.exists(web.day_data_file(web.current_day))
+
+    again = load_web_server(tmp_path, BINARY)
+    try:
+        assert again.total_stats["count"] == 25
+        wait_warm_up()
+        assert again.tracker.check_aggregates() == []
+    finally:
+        close_web_server(again)
+
+
+def test_corrupt_history_snapshot_is_rebuilt_from_event_log(tmp_path):
+    web = load_web_server(tmp_path, BINARY)
+    fill(web, 0, 20)
+    web.tracker.save_to_file(wait=True, final=True)
+    expected = [web.history_store.row(i) for i in range(20)]
+    data_file = web.day_data_file(web.current_day)
+    close_web_server(web)
+    corrupt(snapshot.snapshot_file(history_file(data_file)))
+
+    again = load_web_server(tmp_path, BINARY)
+    try:
+        wait_warm_up()
+        assert [again.history_store.row(i) for i in range(20)] == expected
+        assert again.tracker.check_aggregates() == []
+    finally:
+        close_web_server(again)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""SQLite存储：批量写入由写入线程完成，(ts, id)游标翻页，排行榜用户名取最后一天"""
+
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import blind_box_sqlite
+from blind_box_sqlite import SqliteStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    db = SqliteStore(str(tmp_path / "blind_box.db"), flush_interval=0.05)
+    yield db
+    db.close()
+
+
+def test_full_buffer_wakes_writer_instead_of_flushing_inline(tmp_path, monkeypatch):
+    monkeypatch.setattr(blind_box_sqlite, "MAX_BATCH", 10)
+    db = SqliteStore(str(tmp_path / "blind_box.db"), flush_interval=60)
+    flushed_by = []
+    original = db.flush
+
+    def flush():
+        flushed_by.append(threading.current_thread().name)
+        return original()
+
+    db.flush = flush
+    try:
+        for i in range(10):
+            db.add(1000.0 + i, 1, "甲", "心动盲盒", 15000, 0)
+        deadline = time.time() + 5
+        while time.time() < deadline and not db.events(limit=100)["events"]:
+            time.sleep(0.01)
+        assert len(db.events(limit=100)["events"]) == 10
+        assert flushed_by and set(flushed_by) == {"sqlite-writer"}
+    finally:
+        db.close()
+
+
+def test_cursor_pages_cover_every_event_once(store):
+    # 补写的记录id不随时间递增，且有同一时刻的多条记录
+    times = [100.0, 300.0, 200.0, 200.0, 200.0, 50.0, 300.0, 150.0, 200.0, 10.0]
+    for i, ts in enumerate(times):
+        store.add(ts, i, f"用户{i}", "心动盲盒", 15000, 0)
+    store.flush()
+    store.add(250.0, 99, "补写", "心动盲盒", 15000, 0)
+    store.add(250.0, 98, "补写", "心动盲盒", 15000, 0)
+    store.flush()
+
+    full = store.events(limit=1000)["events"]
+    assert [event["ts"] for event in full] == sorted((event["ts"] for event in full), reverse=True)
+    for size in (1, 2, 3, 5):
+        seen, cursor = [], None
+        while True:
+            page = store.events(before=cursor, limit=size)
+            seen.extend(page["events"])
+            cursor = page["next"]
+            if cursor is None:
+                break
+        assert [event["id"] for event in seen] == [event["id"] for event in full]
+
+
+def test_ranking_uses_latest_name(store):
+    day1 = datetime(2026, 3, 1, 12).timestamp()
+    day2 = datetime(2026, 3, 2, 12).timestamp()
+    store.add(day1, 1, "Zed", "心动盲盒", 15000, 0)
+    store.add(day2, 1, "Alice", "心动盲盒", 15000, 0)
+    store.add(day2, 2, None, "心动盲盒", 1000, 0)
+    store.add(day1, 2, "乙", "心动盲盒", 1000, 0)
+    store.flush()
+
+    rows = store.ranking(order="cost")
+    assert [(row["uid"], row["uname"], row["cost"]) for row in rows] == [(1, "Alice", 30000), (2, "乙", 2000)]
+    rows = store.ranking(until="2026-03-01")
+    assert rows[0]["uname"] == "Zed"
+    assert [row["uid"] for row in store.ranking(limit=1, offset=1)] == [2]
+
+
+def test_db_events_endpoint_pages_and_rejects_bad_cursor(tmp_path):
+    from blind_box_index import encode_cursor
+    from conftest import close_web_server, load_web_server
+
+    web = load_web_server(tmp_path, env={"BLIND_BOX_SQLITE": "1"})
+    try:
+        for uid in range(7):
+            web.tracker.add_blind_box(uid, f"用户{uid}", "心动盲盒", 15000, 0)
+        web.db_store.flush()
+        client = web.app.test_client()
+        ids, cursor = [], None
+        while True:
+            body = client.get("/api/db/events?limit=3" + (f"&cursor={cursor}" if cursor else "")).get_json()
+            ids.extend(item["id"] for item in body["items"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        assert sorted(ids) == sorted(set(ids)) and len(ids) == 7
+        assert client.get(f"/api/db/events?cursor={encode_cursor(5)}").status_code == 400
+    finally:
+        web.db_store.close()
+        close_web_server(web)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""预写日志与后台追加线程（GUI的持久化方式）：序号连续、半行截断、快照后清空、按提交顺序执行"""
+
+import os
+import threading
+
+from blind_box_wal import LogWriter, WriteAheadLog
+
+
+def record(n):
+    return {"ts": 1_700_000_000 + n, "uid": n % 3, "uname": "观众", "blind_name": "心动盲盒",
+            "cost": 15000, "value": 1000 * n}
+
+
+def test_append_many_numbers_continue(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal.jsonl"))
+    assert wal.append(record(0)) == 0
+    assert wal.append_many([record(1), record(2)]) == 3
+    assert wal.append(record(3)) == 3
+    wal.close()
+
+    again = WriteAheadLog(wal.path)
+    assert [r["value"] for r in again.replay(2)] == [2000, 3000]
+    assert again.seq == 4 and again.pending == 2
+
+
+def test_replay_truncates_partial_last_line(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal.jsonl"))
+    wal.append_many([record(n) for n in range(5)])
+    wal.close()
+    valid_size = os.path.getsize(wal.path)
+    with open(wal.path, 'ab') as f:
+        f.write(b'{"seq":5,"ts":1700000005,"ui')
+
+    again = WriteAheadLog(wal.path)
+    assert len(list(again.replay(0))) == 5
+    assert os.path.getsize(wal.path) == valid_size
+    assert again.append(record(5)) == 5
+    again.close()
+    assert [r["value"] for r in WriteAheadLog(wal.path).replay(0)] == [1000 * n for n in range(6)]
+
+
+def test_truncate_keeps_records_after_snapshot(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal.jsonl"))
+    wal.append_many([record(n) for n in range(3)])
+    upto = wal.checkpoint()
+    wal.append(record(3))                 # 快照之后又有记录
+    wal.truncate(upto)
+    assert wal.remove(upto) is False
+    assert [r["value"] for r in wal.read()] == [3000]
+    assert [r["value"] for r in wal.read(0, upto)] == []
+    wal.append(record(4))                 # 删除前面的记录后继续追加
+    assert [r["value"] for r in wal.read(upto)] == [3000, 4000]
+
+    upto = wal.checkpoint()
+    wal.truncate(upto)
+    assert os.path.getsize(wal.path) == 0
+    wal.append(record(4))                 # 清空后序号继续
+    wal.close()
+    assert [r["value"] for r in WriteAheadLog(wal.path).replay(upto)] == [4000]
+
+    wal = WriteAheadLog(wal.path)
+    list(wal.replay(upto))
+    assert wal.remove(wal.seq) is True and not os.path.exists(wal.path)
+
+
+def test_log_writer_runs_calls_after_earlier_records(tmp_path):
+    first = WriteAheadLog(str(tmp_path / "a.jsonl"))
+    second = WriteAheadLog(str(tmp_path / "b.jsonl"))
+    writer = LogWriter()
+    seen = []
+    try:
+        for n in range(50):
+            writer.append(first if n % 10 else second, record(n))
+            if n == 24:
+                writer.call(lambda: seen.append((first.seq, second.seq)))
+        assert writer.flush(5)
+        assert seen == [(22, 3)]
+        assert first.seq + second.seq == 50 and writer.failed == 0
+        first.close()
+        assert [r["value"] for r in WriteAheadLog(first.path).replay(0)] == \
+            [1000 * n for n in range(50) if n % 10]
+    finally:
+        writer.close(5)
+        first.close()
+        second.close()
+
+
+def test_gui_save_sequence_keeps_records_after_snapshot(tmp_path):
+    """GUI的顺序：记录交给写入线程，快照写完后在写入线程清空到快照包含的序号"""
+    wal = WriteAheadLog(str(tmp_path / "wal.jsonl"))
+    writer = LogWriter()
+    gate = threading.Event()
+    try:
+        for n in range(10):
+            writer.append(wal, record(n))
+        wal_seq = 10                                   # 快照包含前10条
+        writer.call(lambda: gate.wait(5))              # 快照还在写入
+        for n in range(10, 13):
+            writer.append(wal, record(n))
+        writer.call(lambda: wal.truncate(wal_seq))     # 快照写完：之后已有新记录，不能清空
+        gate.set()
+        assert writer.flush(5)
+        wal.close()
+        assert [r["value"] for r in WriteAheadLog(wal.path).replay(wal_seq)] == [10000, 11000, 12000]
+    finally:
+        writer.close(5)
+        wal.close()
+
+
+def test_failed_append_is_counted(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("x")
+    wal = WriteAheadLog(str(blocker / "wal.jsonl"))     # 目录位置是文件，无法创建
+    writer = LogWriter()
+    try:
+        writer.append(wal, record(0))
+        writer.append(wal, record(1))
+        assert writer.flush(5)
+        assert writer.failed == 2
+    finally:
+        writer.close(5)
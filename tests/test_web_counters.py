@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""web_server的盈亏分布计数器：增量计数与全量重算一致，旧数据文件加载时补算"""
+
+import json
+import random
+from datetime import date
+
+from conftest import close_web_server, load_web_server
+
+
+def test_running_counters_match_recompute(web):
+    rng = random.Random(11)
+    for _ in range(500):
+        cost = rng.choice([15000, 50000])
+        web.tracker.add_blind_box(rng.randint(1, 40), "观众", "心动盲盒", cost,
+                                  rng.choice([0, cost, cost * 2, 5000]))
+    assert web.tracker.check_aggregates() == []
+    body = web.app.test_client().get("/api/stats").get_json()
+    distribution = body["profit_distribution"]
+    assert sum(distribution.values()) == 500
+    assert distribution["profit"] == web.total_stats["profit_count"]
+
+
+def test_legacy_file_without_counters_is_derived(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    today = date.today().isoformat()
+    legacy = {
+        "date": today,
+        "user_stats": {
+            "1": {"uname": "甲", "count": 3, "cost": 45000, "value": 51000, "profit": 6.0,
+                  "history": [{"profit": 21.0}, {"profit": -15.0}, {"profit": 0.0}]},
+        },
+        "total_stats": {"count": 3, "cost": 45000, "value": 51000, "profit": 6.0},
+    }
+    (data_dir / f"blind_box_data_{today}.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+    web = load_web_server(tmp_path)
+    try:
+        user = web.user_stats[1]
+        assert (user["profit_count"], user["loss_count"], user["break_even_count"]) == (1, 1, 1)
+        assert web.total_stats["break_even_count"] == 1
+        assert web.total_stats["profit"] == 6000
+        assert web.user_names.uname(1) == "甲"
+    finally:
+        close_web_server(web)
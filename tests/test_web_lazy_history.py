@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+延迟加载：汇总文件只记录历史行数，重启后先提供统计，历史记录第一次访问时读取；
+定期快照不重写历史记录，文件之后的部分从事件日志补齐
+"""
+
+import json
+import os
+import threading
+
+from blind_box_store import history_file
+from conftest import close_web_server, load_web_server
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def wait_warm_up():
+    for thread in threading.enumerate():
+        if thread.name == "history-warm-up":
+            thread.join(5)
+
+
+def add(web, start, stop):
+    for n in range(start, stop):
+        web.tracker.add_blind_box(n % 4, f"用户{n % 4}", "心动盲盒", 15000, 1000 * n)
+
+
+def fill(web):
+    add(web, 0, 30)
+    web.tracker.save_to_file(wait=True, final=True)
+    close_web_server(web)
+
+
+def test_summary_header_holds_row_count_only(tmp_path, web):
+    add(web, 0, 30)
+    web.tracker.save_to_file(wait=True)
+    data_file = web.day_data_file(web.current_day)
+    header = read_json(data_file)
+    assert header["history_rows"] == 30 and "history" not in header
+    # 定期快照不写历史记录，最后一次快照才写
+    assert not os.path.exists(history_file(data_file))
+    web.tracker.save_to_file(wait=True, final=True)
+    assert len(read_json(history_file(data_file))["ts"]) == 30
+
+
+def test_periodic_snapshots_keep_history_file(tmp_path):
+    web = load_web_server(tmp_path)
+    fill(web)
+    path = history_file(web.day_data_file(web.current_day))
+    written = os.path.getmtime(path), os.path.getsize(path)
+
+    again = load_web_server(tmp_path)
+    try:
+        add(again, 30, 45)
+        again.tracker.save_to_file(wait=True)
+        assert (os.path.getmtime(path), os.path.getsize(path)) == written
+        expected = [again.history_store.row(i) for i in range(45)]
+    finally:
+        close_web_server(again)
+
+    third = load_web_server(tmp_path)
+    try:
+        wait_warm_up()
+        assert len(third.history_store) == 45
+        assert [third.history_store.row(i) for i in range(45)] == expected
+        assert third.tracker.check_aggregates() == []
+    finally:
+        close_web_server(third)
+
+
+def test_restart_serves_stats_and_pages_history(tmp_path):
+    web = load_web_server(tmp_path)
+    fill(web)
+    expected = [web.history_store.row(i) for i in range(30)]
+
+    again = load_web_server(tmp_path)
+    try:
+        response = again.app.test_client().get('/api/stats')
+        assert response.get_json()["total"]["count"] == 30
+        assert len(again.history_store) == 30
+        wait_warm_up()
+        assert [again.history_store.row(i) for i in range(30)] == expected
+        assert again.tracker.check_aggregates() == []
+    finally:
+        close_web_server(again)
+
+
+def test_missing_history_file_is_rebuilt_from_event_log(tmp_path):
+    web = load_web_server(tmp_path)
+    fill(web)
+    expected = [web.history_store.row(i) for i in range(30)]
+    os.remove(history_file(web.day_data_file(web.current_day)))
+
+    again = load_web_server(tmp_path)
+    try:
+        wait_warm_up()
+        assert again.total_stats["count"] == 30
+        assert [again.history_store.row(i) for i in range(30)] == expected
+        assert again.tracker.check_aggregates() == []
+    finally:
+        close_web_server(again)
+
+
+def test_short_history_file_is_extended_from_event_log(tmp_path):
+    web = load_web_server(tmp_path)
+    fill(web)
+    expected = [web.history_store.row(i) for i in range(30)]
+    path = history_file(web.day_data_file(web.current_day))
+    columns = read_json(path)
+    for name in ("ts", "uid", "box", "cost", "value"):
+        columns[name] = columns[name][:18]      # 历史记录文件只写到第18条
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(columns, f)
+
+    again = load_web_server(tmp_path)
+    try:
+        wait_warm_up()
+        assert len(again.history_store) == 30
+        assert [again.history_store.row(i) for i in range(30)] == expected
+        assert again.tracker.check_aggregates() == []
+    finally:
+        close_web_server(again)
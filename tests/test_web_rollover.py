@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""web_server换日：前一天的最后一次快照、事件日志切换、统计清空"""
+
+import json
+from datetime import datetime, time, timedelta
+
+from conftest import close_web_server, load_web_server
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Clock:
+    """替换web_server中的datetime，入库时间由测试控制"""
+
+    def __init__(self, now):
+        self.now = now
+        clock = self
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now
+
+        self.datetime = FakeDatetime
+
+
+def test_first_event_after_midnight_closes_previous_day(web, monkeypatch):
+    old_day = web.current_day
+    new_day = old_day + timedelta(days=1)
+    clock = Clock(datetime.combine(old_day, time(23, 59, 30)))
+    monkeypatch.setattr(web, "datetime", clock.datetime)
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 36000)
+    web.tracker.add_blind_box(2, "乙", "心动盲盒", 15000, 5000)
+    assert web.current_day == old_day
+
+    clock.now = datetime.combine(new_day, time(0, 0, 10))
+    web.tracker.add_blind_box(3, "丙", "心动盲盒", 15000, 15000)
+    assert web.current_day == new_day
+    assert not web.tracker.roll_over(new_day)
+    web.snapshot_writer.flush()
+
+    closed = read_json(web.day_data_file(old_day))
+    assert closed["date"] == old_day.isoformat()
+    assert closed["total_stats"]["count"] == 2
+    assert closed["wal_seq"] == 2
+
+    assert web.CURRENT_EVENTS_FILE == web.day_events_file(new_day)
+    assert list(web.user_stats) == [3] and web.total_stats["count"] == 1
+    assert len(web.event_index) == 1 and len(web.ranking_index) == 1 and web.user_order == [3]
+    # 跨零点的滑动窗口不清空
+    assert len(web.window_boards.get("24h")) == 3
+
+    web.tracker.save_to_file(wait=True)
+    fresh = read_json(web.day_data_file(new_day))
+    assert fresh["date"] == new_day.isoformat()
+    assert list(fresh["user_stats"]) == ["3"]
+    assert read_json(web.day_data_file(old_day))["total_stats"]["count"] == 2
+
+    client = web.app.test_client()
+    assert client.get("/api/stats").get_json()["total"]["count"] == 1
+    # 前一天的分位数估计直接取换日时的内存副本
+    assert web.day_sketches(old_day) is not None
+
+
+def test_closed_day_restarts_from_its_own_files(tmp_path):
+    web = load_web_server(tmp_path)
+    day = web.current_day
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 36000)
+    web.tracker.save_to_file(wait=True)
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 0)   # 只在事件日志中
+    close_web_server(web)
+
+    again = load_web_server(tmp_path)
+    try:
+        assert again.current_day == day
+        assert again.total_stats["count"] == 2
+        assert again.user_stats[1]["value"] == 36000
+    finally:
+        close_web_server(again)
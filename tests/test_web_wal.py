@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""事件日志作为预写日志：重启时重放快照之后的记录，崩溃留下的半行被截掉"""
+
+import os
+
+from conftest import close_web_server, load_web_server
+
+
+def test_replay_after_truncated_last_line(tmp_path):
+    web = load_web_server(tmp_path)
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 36000)
+    web.tracker.add_blind_box(2, "乙", "心动盲盒", 15000, 0)
+    web.tracker.save_to_file(wait=True)
+    web.tracker.add_blind_box(1, "甲", "心动盲盒", 15000, 15000)   # 只在事件日志中
+    events_file = web.CURRENT_EVENTS_FILE
+    close_web_server(web)
+    valid_size = os.path.getsize(events_file)
+    with open(events_file, "ab") as f:
+        f.write(b'{"ts": 1700000000, "uid": 3, "box": 0, "co')       # 写到一半崩溃
+
+    again = load_web_server(tmp_path)
+    try:
+        assert again.total_stats["count"] == 3
+        assert again.user_stats[1]["count"] == 2 and 3 not in again.user_stats
+        assert again.tracker.check_aggregates() == []
+        assert os.path.getsize(events_file) == valid_size
+        # 截掉半行后继续追加，重新加载仍然一致
+        again.tracker.add_blind_box(3, "丙", "心动盲盒", 15000, 0)
+        assert len(again.event_index) == 4
+    finally:
+        close_web_server(again)
+
+    third = load_web_server(tmp_path)
+    try:
+        assert third.total_stats["count"] == 4
+    finally:
+        close_web_server(third)
+
+
+def test_snapshot_seq_skips_already_applied_events(tmp_path):
+    web = load_web_server(tmp_path)
+    for uid in range(5):
+        web.tracker.add_blind_box(uid, "观众", "心动盲盒", 15000, 0)
+    web.tracker.save_to_file(wait=True)
+    assert web.tracker.pending_events() == 0
+    close_web_server(web)
+
+    again = load_web_server(tmp_path)
+    try:
+        assert again.total_stats["count"] == 5
+        assert again.tracker.snapshot_seq == 5
+    finally:
+        close_web_server(again)
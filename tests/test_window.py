@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""滑动窗口排行榜：与逐条重算的结果一致，重启后24小时窗口包含前一天的记录"""
+
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from blind_box_index import EventIndex
+from blind_box_store import HistoryStore
+from blind_box_window import WindowBoards, WindowLeaderboard
+
+from conftest import close_web_server, load_web_server
+
+
+def test_window_matches_brute_force():
+    rng = random.Random(7)
+    board = WindowLeaderboard(600, 10)
+    events = []
+    ts = 1_700_000_000
+    for _ in range(3000):
+        ts += rng.randint(0, 5)
+        event = (ts, rng.randint(1, 40), rng.randint(1, 50) * 1000, rng.randint(0, 100) * 1000)
+        events.append(event)
+        board.add(*event)
+
+    # 窗口边界精度为一个桶：桶的终点晚于窗口起点就整桶保留
+    cutoff = ts - 600
+    expected = {}
+    for event_ts, uid, cost, value in events:
+        if event_ts // 10 * 10 + 10 > cutoff:
+            stats = expected.setdefault(uid, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += cost
+            stats[2] += value
+    top = board.top(100, "spend", now=ts)
+    assert {item["uid"]: [item["count"], item["cost"], item["value"]] for item in top} == expected
+    assert [item["cost"] for item in top] == sorted((item["cost"] for item in top), reverse=True)
+
+
+def test_expired_users_leave_the_board():
+    board = WindowLeaderboard(60, 10)
+    board.add(1000, 1, 100, 0)
+    board.add(1055, 2, 100, 0)
+    assert board.expire(now=1075)
+    assert [item["uid"] for item in board.top(10, now=1075)] == [2]
+
+
+def test_from_history_uses_earlier_rows():
+    now = 1_700_000_000
+    store = HistoryStore()
+    store.append(1, "心动盲盒", 1000, 0, ts=now - 60)
+    earlier = [(now - 86400 - 3600, 2, 5000, 0), (now - 7200, 3, 7000, 0)]
+    boards = WindowBoards.from_history(store, now=now, earlier=earlier)
+    day = {item["uid"] for item in boards.get("24h").top(10, now=now)}
+    hour = {item["uid"] for item in boards.get("1h").top(10, now=now)}
+    assert day == {1, 3}
+    assert hour == {1}
+
+
+def test_restart_seeds_24h_board_from_previous_day(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    yesterday = date.today() - timedelta(days=1)
+    midnight = datetime.combine(date.today(), datetime.min.time()).timestamp()
+    index = EventIndex(str(data_dir / f"blind_box_events_{yesterday.isoformat()}.jsonl"))
+    index.append({"ts": midnight - 60, "uid": 42, "uname": "夜猫子", "blind_name": "心动盲盒",
+                  "cost": 15000, "value": 0})
+    index.close()
+
+    web = load_web_server(tmp_path)
+    try:
+        web.tracker.add_blind_box(7, "白天", "心动盲盒", 15000, 36000)
+        web.tracker.warm_up()
+        day = {item["uid"] for item in web.window_boards.get("24h").top(10)}
+        hour = {item["uid"] for item in web.window_boards.get("1h").top(10)}
+        assert {7, 42} <= day
+        if time.time() - midnight > 3600:
+            assert 42 not in hour
+    finally:
+        close_web_server(web)
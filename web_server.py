@@ -5,15 +5,31 @@
 支持按日期保存、Web控制监听器
 """
 
-from flask import Flask, render_template, jsonify, request
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, jsonify, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
+import atexit
 import json
 import os
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import threading
 import time
-import subprocess
-import signal
+import sys
+from typing import Optional
+
+import blind_box_codec as codec
+import blind_box_archive as archive
+import blind_box_lifetime as lifetime
+import blind_box_luck as luck
+import blind_box_snapshot as snapshot
+from blind_box_store import HistoryStore, UserDirectory, history_file, to_yuan, uid_key
+from blind_box_rollup import Rollups
+from blind_box_types import BoxTypeTable, to_csv
+from blind_box_window import WindowBoards, WINDOWS
+from blind_box_sketch import DailySketches, QuantileSketch, SCOPE_ALL, room_scope, box_scope
+from blind_box_persist import SnapshotWriter
+from blind_box_sqlite import SqliteStore
+from blind_box_index import EventIndex, RankingIndex, SIGNS, encode_cursor, decode_cursor, decode_key_cursor
+from monitor_worker import MonitorWorker
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'blind_box_secret_key_2024'
@@ -23,18 +39,135 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# 当前日期的数据文件
-CURRENT_DATA_FILE = os.path.join(DATA_DIR, f"blind_box_data_{date.today().isoformat()}.json")
 
-MAX_RECENT_RECORDS = 500  # 增加到500条记录
-MAX_USER_HISTORY = 1000   # 每个用户最多保存1000条历史
+def day_data_file(day: date) -> str:
+    """某天的数据文件"""
+    return os.path.join(DATA_DIR, f"blind_box_data_{day.isoformat()}.json")
+
+
+def day_events_file(day: date) -> str:
+    """某天的事件日志（按时间追加，供翻页查询，同时是数据文件的预写日志）"""
+    return os.path.join(DATA_DIR, f"blind_box_events_{day.isoformat()}.jsonl")
+
+
+# 内存中的统计所属的日期，过了零点由 roll_over 切换，保存、加载都使用这个日期
+current_day = date.today()
+CURRENT_DATA_FILE = day_data_file(current_day)
+CURRENT_EVENTS_FILE = day_events_file(current_day)
+
+MAX_RECENT_RECORDS = 500  # /api/stats 默认返回的最近记录数
+MIN_BLIND_BOXES = 1       # 上排行榜的最少盲盒数
+DEFAULT_PAGE_SIZE = 100   # 列表接口默认每页条数
+MAX_PAGE_SIZE = 500       # 列表接口每页上限
+WINDOW_PUSH_INTERVAL = 2  # 滑动窗口排行榜的推送检查间隔（秒）
+WINDOW_PUSH_SIZE = 10     # 滑动窗口排行榜推送的名次数
+SNAPSHOT_INTERVAL = 60    # 数据文件快照间隔（秒），期间的记录只追加到事件日志
+SNAPSHOT_EVENTS = 1000    # 距上次快照新增这么多条记录时提前保存快照
+
+# 校验模式：每次入库后用全量重算结果核对增量计数器（仅用于排查问题）
+AGGREGATE_CHECK = os.environ.get("BLIND_BOX_AGGREGATE_CHECK", "") == "1"
+
+# 可选的SQLite存储：全部日期的记录和每日汇总，供 /api/db/* 按范围查询
+SQLITE_ENABLED = os.environ.get("BLIND_BOX_SQLITE", "") == "1"
+SQLITE_FILE = os.path.join(DATA_DIR, "blind_box.db")
+
+# 跨日期的用户累计统计，启动时累加之前尚未累加的日期
+LIFETIME_FILE = os.path.join(DATA_DIR, lifetime.LIFETIME_FILE)
+
+# 快照格式：json（默认）或 binary（二进制快照 *.snap，重启时加载更快，读取失败时回退到JSON数据文件）
+SNAPSHOT_BINARY = os.environ.get("BLIND_BOX_SNAPSHOT", "json") == "binary"
+
+# 盈亏分布计数字段
+DIST_FIELDS = ("profit_count", "loss_count", "break_even_count")
+
+
+def read_day_data(data_file: str):
+    """
+    读取某天的数据文件，返回 (数据, 是否为二进制快照)，文件不存在时数据为None
+    启用二进制快照时优先读取 *.snap，缺失、版本不符或校验失败时回退到JSON数据文件
+    """
+    if SNAPSHOT_BINARY:
+        snap_file = snapshot.snapshot_file(data_file)
+        if os.path.exists(snap_file):
+            try:
+                return snapshot.read_state(snap_file), True
+            except (OSError, ValueError) as e:
+                print(f"[提示] 二进制快照 {snap_file} 不可用（{e}），改用JSON数据文件")
+    if not os.path.exists(data_file):
+        return None, False
+    with open(data_file, 'r', encoding='utf-8') as f:
+        return json.load(f), False
+
+
+def load_history(path: str, rows: int, binary: bool = False) -> HistoryStore:
+    """
+    读取单独保存的历史记录（供 HistoryStore.deferred 使用）
+    历史记录与当天事件日志按同一顺序写入：文件缺失、损坏或快照校验失败时用事件日志的前rows条重建，
+    文件少于rows条时用事件日志中之后的记录补齐
+    """
+    try:
+        if binary:
+            store = snapshot.load_history(path, rows)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                store = HistoryStore.from_dict(json.load(f), rows)
+    except (OSError, ValueError) as e:
+        print(f"[提示] 历史记录 {path} 不可用（{e}），从事件日志重建")
+        store = HistoryStore()
+    start = len(store)
+    if start < rows:
+        if start:
+            print(f"[提示] 历史记录 {path} 只有{start}条，其余{rows - start}条从事件日志补齐")
+        for event in event_index.replay(start, rows):
+            store.append(event["uid"], event["blind_name"], event["cost"], event["value"], ts=event["ts"])
+    return store
+
+
+def new_total_stats() -> dict:
+    """空的总体统计，金额均为毫元整数"""
+    return {"count": 0, "cost": 0, "value": 0, "profit": 0,
+            "profit_count": 0, "loss_count": 0, "break_even_count": 0}
+
+
+def dist_field(profit) -> str:
+    """单次盈亏对应的分布计数字段"""
+    if profit > 0:
+        return "profit_count"
+    elif profit < 0:
+        return "loss_count"
+    return "break_even_count"
+
 
 user_stats = {}
-total_stats = {"count": 0, "cost": 0, "value": 0, "profit": 0, "profit_count": 0, "loss_count": 0}
-recent_records = []  # 保存最近的记录
+total_stats = new_total_stats()
+user_names = UserDirectory()  # uid -> 当前用户名（含改名记录），用户统计里不再重复保存
+history_store = HistoryStore()  # 当日全部盲盒记录（列式存储）
+event_index = EventIndex(CURRENT_EVENTS_FILE, users=user_names)  # 全局按时间排序的事件索引
+ranking_index = RankingIndex(MIN_BLIND_BOXES)  # 运气排行榜索引
+rollups = Rollups()  # 分钟/小时汇总，供趋势图使用
+box_types = BoxTypeTable()  # 按盲盒类型的统计和礼物价格分布
+sketches = DailySketches()  # 当日盈亏和用户花费的分位数估计
+past_sketches = {}  # 日期 -> 已结束那天的分位数估计（从数据文件读取后缓存）
+lifetime_index = lifetime.LifetimeIndex(LIFETIME_FILE)  # uid -> 之前各天的累计统计
+window_boards = WindowBoards()  # 最近10分钟/1小时/24小时排行榜
+luck_scorer = luck.LuckScorer(history_store) if luck.available() else None  # 运气评分（需要numpy）
+user_order = []  # 按首次出现顺序排列的uid，用于用户列表翻页
+state_lock = threading.RLock()  # 入库与取快照副本互斥，快照内容与wal_seq一致
+snapshot_writer = SnapshotWriter()  # 数据文件的后台写入线程
+atexit.register(snapshot_writer.close, 10)
+db_store = SqliteStore(SQLITE_FILE) if SQLITE_ENABLED else None  # SQLite存储（未启用时为None）
+if db_store is not None:
+    atexit.register(db_store.close)
+
+# Socket.IO房间：按客户端协商的编码分组推送，未协商的旧客户端默认JSON
+CODEC_ROOMS = {
+    codec.ENCODING_JSON: "codec_json",
+    codec.ENCODING_MSGPACK: "codec_msgpack"
+}
+binary_clients = set()  # 选择二进制推送的客户端sid
 
 # 监听器进程控制
-monitor_process = None
+monitor_worker = None
 monitor_config = {
     "room_id": "",
     "cookie": "",
@@ -42,50 +175,127 @@ monitor_config = {
 }
 
 
+def broadcast(event: str, payload, fields=None):
+    """推送数据事件，二进制客户端收到MessagePack，其余客户端收到JSON"""
+    socketio.emit(event, payload, to=CODEC_ROOMS[codec.ENCODING_JSON])
+    if binary_clients:
+        socketio.emit(event, codec.pack(payload, fields),
+                      to=CODEC_ROOMS[codec.ENCODING_MSGPACK])
+
+
 class BlindBoxTracker:
     """盲盒统计追踪器"""
 
     def __init__(self):
+        self.snapshot_seq = 0   # 数据文件快照已包含的事件数（事件日志序号）
         self.load_from_file()
+        self.load_event_index()
+        self.replay_event_log()
+        self.sync_sqlite()
+        self.rebuild_indexes()
+        # 历史记录在后台读取，启动时只等待汇总
+        threading.Thread(target=self.warm_up, name="history-warm-up", daemon=True).start()
+        threading.Thread(target=self.catch_up_lifetime, name="lifetime-catch-up", daemon=True).start()
 
     def add_blind_box(self, uid: int, uname: str, blind_name: str,
-                     blind_price: int, gift_price: int):
+                     blind_price: int, gift_price: int, room_id=None):
         """添加盲盒记录 - 修复字段名称"""
-        global user_stats, total_stats, recent_records
+        # 金额全程使用毫元整数，只在输出时换算为元
+        profit = gift_price - blind_price
+        now = datetime.now()
+        room_id = room_id or monitor_config.get("room_id") or None
+
+        with state_lock:
+            if now.date() != current_day:
+                self.roll_over(now.date())
+            box = self.apply_event(now.timestamp(), uid, uname, blind_name,
+                                   blind_price, gift_price, room_id)
+
+            # 追加到全局事件索引（同时是预写日志，数据文件只需定期快照）
+            logged = event_index.append({
+                "ts": now.timestamp(),
+                "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+                "uid": uid,
+                "uname": uname,
+                "blind_name": blind_name,
+                "cost": blind_price,
+                "value": gift_price,
+                "room_id": room_id
+            })
+            if db_store is not None:
+                db_store.add(now.timestamp(), uid, uname, blind_name, blind_price, gift_price,
+                             room_id, seq=logged["seq"])
+        if self.pending_events() >= SNAPSHOT_EVENTS:
+            snapshot_due.set()
+
+        # 推送的实时记录 - 使用正确的字段名
+        record = {
+            "time": now.strftime("%H:%M:%S"),
+            "uname": uname,
+            "blind_name": blind_name,  # 修复：使用盲盒名称而不是爆出礼物名称
+            "cost": to_yuan(blind_price),
+            "value": to_yuan(gift_price),
+            "profit": to_yuan(profit)
+        }
+
+        # 通过WebSocket推送新记录
+        broadcast('new_blind_box', record, codec.RECORD_FIELDS)
 
-        profit = (gift_price - blind_price) / 1000
-        blind_price_yuan = blind_price / 1000
-        gift_price_yuan = gift_price / 1000
+        if AGGREGATE_CHECK:
+            self.check_aggregates()
+
+        # 推送该盲盒类型的最新统计，供直播叠加层实时显示
+        broadcast('box_stats', box_entry(box))
+
+        # 通过WebSocket推送统计更新，盈亏分布直接取增量计数器
+        broadcast('stats_update', {
+            'total': public_totals(total_stats),
+            'user_count': len(user_stats),
+            'profit_distribution': profit_distribution()
+        })
+
+    def apply_event(self, ts: float, uid, uname: str, blind_name: str,
+                    blind_price: int, gift_price: int, room_id=None):
+        """把一条记录累加到内存中的各项统计（入库和重放事件日志共用），返回该盲盒类型的统计"""
+        global user_stats, total_stats
+
+        profit = gift_price - blind_price
+        dist_key = dist_field(profit)
+
+        # 登记用户名，观众改名时保留旧名
+        if user_names.update(uid, uname, ts) and uid in user_stats:
+            print(f"[改名] {uid}: {user_names.renames(uid)[-1]['uname']} -> {uname}")
 
         # 更新用户统计
         if uid not in user_stats:
+            user_order.append(uid)
             user_stats[uid] = {
                 "uid": uid,
-                "uname": uname,
                 "count": 0,
                 "cost": 0,
                 "value": 0,
                 "profit": 0,
-                "history": []
+                "profit_count": 0,
+                "loss_count": 0,
+                "break_even_count": 0,
+                "first_ts": ts
             }
 
         user_stats[uid]["count"] += 1
         user_stats[uid]["cost"] += blind_price
         user_stats[uid]["value"] += gift_price
         user_stats[uid]["profit"] += profit
-
-        # 添加历史记录，限制数量
-        user_stats[uid]["history"].append({
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "blind_name": blind_name,
-            "cost": blind_price_yuan,
-            "value": gift_price_yuan,
-            "profit": profit
-        })
-
-        # 限制用户历史记录数量
-        if len(user_stats[uid]["history"]) > MAX_USER_HISTORY:
-            user_stats[uid]["history"] = user_stats[uid]["history"][-MAX_USER_HISTORY:]
+        user_stats[uid][dist_key] = user_stats[uid].get(dist_key, 0) + 1
+        user_stats[uid]["last_ts"] = ts
+        ranking_index.update(uid, user_stats[uid]["cost"], user_stats[uid]["value"],
+                             user_stats[uid]["count"])
+
+        # 添加历史记录（列式存储，不再截断）
+        history_store.append(uid, blind_name, blind_price, gift_price, ts=ts)
+        rollups.add(ts, uid, blind_name, blind_price, gift_price)
+        box = box_types.add(blind_name, blind_price, gift_price)
+        window_boards.add(ts, uid, blind_price, gift_price)
+        sketches.add(uid, blind_name, blind_price, gift_price, room_id)
 
         # 更新总体统计
         total_stats["count"] += 1
@@ -93,116 +303,399 @@ class BlindBoxTracker:
         total_stats["value"] += gift_price
         total_stats["profit"] += profit
 
-        # 更新盈利/亏损计数
-        if profit > 0:
-            total_stats["profit_count"] = total_stats.get("profit_count", 0) + 1
-        elif profit < 0:
-            total_stats["loss_count"] = total_stats.get("loss_count", 0) + 1
+        # 更新盈利/亏损/持平计数
+        total_stats[dist_key] = total_stats.get(dist_key, 0) + 1
+        return box
 
-        # 添加到最近记录 - 使用正确的字段名
-        record = {
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "uname": uname,
-            "blind_name": blind_name,  # 修复：使用盲盒名称而不是爆出礼物名称
-            "cost": blind_price_yuan,
-            "value": gift_price_yuan,
-            "profit": profit
-        }
-        recent_records.insert(0, record)
+    def pending_events(self) -> int:
+        """上次提交快照之后入库的记录数"""
+        return len(event_index) - self.snapshot_seq
 
-        # 限制最近记录数量，但保留更多
-        if len(recent_records) > MAX_RECENT_RECORDS:
-            recent_records.pop()
-
-        # 通过WebSocket推送新记录
-        socketio.emit('new_blind_box', record)
-
-        # 通过WebSocket推送统计更新
-        # 计算盈亏分布
-        profit_dist = {'profit': 0, 'loss': 0, 'break_even': 0}
+    def recompute_aggregates(self) -> dict:
+        """全量重算总体统计，与增量计数器格式一致（用于加载旧数据和校验）"""
+        totals = new_total_stats()
         for user in user_stats.values():
-            for record in user.get("history", []):
-                if record["profit"] > 0:
-                    profit_dist['profit'] += 1
-                elif record["profit"] < 0:
-                    profit_dist['loss'] += 1
+            totals["count"] += user.get("count", 0)
+            totals["cost"] += user.get("cost", 0)
+            totals["value"] += user.get("value", 0)
+            totals["profit"] += user.get("profit", 0)
+            for field in DIST_FIELDS:
+                totals[field] += user.get(field, 0)
+        return totals
+
+    def check_aggregates(self) -> list:
+        """
+        对比增量计数器与全量重算结果，返回不一致的字段
+        并用每个用户的历史记录核对其盈亏分布
+        """
+        mismatches = []
+        expected = self.recompute_aggregates()
+        for field, value in expected.items():
+            if total_stats.get(field, 0) != value:
+                mismatches.append(f"total.{field}: {total_stats.get(field, 0)} != {value}")
+
+        for uid, user in user_stats.items():
+            rows = history_store.user_history(uid).rows
+            if len(rows) != user.get("count", 0):
+                mismatches.append(f"user[{uid}].count: {user.get('count', 0)} != {len(rows)}")
+                continue
+            counts = dict.fromkeys(DIST_FIELDS, 0)
+            for row in rows:
+                counts[dist_field(history_store.value[row] - history_store.cost[row])] += 1
+            for field, value in counts.items():
+                if user.get(field, 0) != value:
+                    mismatches.append(f"user[{uid}].{field}: {user.get(field, 0)} != {value}")
+
+        if mismatches:
+            print(f"[校验] 增量统计与全量重算不一致: {'; '.join(mismatches)}")
+        return mismatches
+
+    def save_to_file(self, wait: bool = False, final: bool = False):
+        """
+        保存快照到数据文件
+        持有state_lock取一份副本（各结构的to_dict返回新对象），期间不会有记录入库；
+        序列化和写入（临时文件 + fsync + rename）在后台写入线程完成，wait为True时等待写完
+        wal_seq为快照包含的事件数，启动时从事件日志的这个位置开始重放
+        汇总文件只记录历史记录的行数：定期快照不重写历史记录，启动时文件之后的部分从事件日志补齐；
+        final为True时（换日、退出前的最后一次快照）另外写入完整的历史记录（先于汇总写入）
+        """
+        with state_lock:
+            data_file = day_data_file(current_day)
+            wal_seq = len(event_index)
+            if final and history_store.loaded:
+                # 未读取过的历史记录没有变化，文件不用重写
+                if SNAPSHOT_BINARY:
+                    snapshot_writer.submit(snapshot.snapshot_file(history_file(data_file)),
+                                           history_store.to_columns(), encode=snapshot.encode)
                 else:
-                    profit_dist['break_even'] += 1
-
-        socketio.emit('stats_update', {
-            'total': total_stats,
-            'user_count': len(user_stats),
-            'profit_distribution': profit_dist
-        })
+                    snapshot_writer.submit(history_file(data_file), history_store.to_dict())
+            data = {
+                "date": current_day.isoformat(),
+                "wal_seq": wal_seq,
+                "user_stats": {uid: dict(user) for uid, user in user_stats.items()},
+                "users": user_names.to_dict(),
+                "total_stats": dict(total_stats),
+                "history_rows": len(history_store),
+                "rollups": rollups.to_dict(),
+                "box_types": box_types.to_dict(),
+                "sketches": sketches.to_dict(),
+                "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            self.snapshot_seq = wal_seq
 
-    def save_to_file(self):
-        """保存数据到文件"""
-        data = {
-            "date": date.today().isoformat(),
-            "user_stats": user_stats,
-            "total_stats": total_stats,
-            "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        try:
-            # 使用当前日期的文件
-            data_file = os.path.join(DATA_DIR, f"blind_box_data_{date.today().isoformat()}.json")
-            with open(data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"[保存] 数据已保存到 {data_file}")
-        except Exception as e:
-            print(f"[ERROR] 保存数据失败: {e}")
+        if SNAPSHOT_BINARY:
+            data_file = snapshot.snapshot_file(data_file)
+            snapshot_writer.submit(data_file, {"state": data}, lambda: print(f"[保存] 数据已保存到 {data_file}"),
+                                   encode=snapshot.encode)
+        else:
+            snapshot_writer.submit(data_file, data, lambda: print(f"[保存] 数据已保存到 {data_file}"))
+        if wait:
+            snapshot_writer.flush()
 
     def load_from_file(self):
         """从文件加载数据"""
-        global user_stats, total_stats
+        global user_stats, total_stats, history_store, rollups, box_types, sketches
 
         # 使用当前日期的文件
-        data_file = os.path.join(DATA_DIR, f"blind_box_data_{date.today().isoformat()}.json")
-
-        if not os.path.exists(data_file):
-            print(f"[提示] 未找到今日数据文件，从空白开始")
-            return
+        data_file = day_data_file(current_day)
 
         try:
-            with open(data_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-                # 检查日期是否匹配
-                if data.get("date") != date.today().isoformat():
-                    print(f"[提示] 数据文件日期不匹配，创建新记录")
-                    return
-
-                loaded_stats = data.get("user_stats", {})
-
-                # 修复：JSON中的uid会被转为字符串，需要转回整数
-                user_stats = {}
-                for uid_str, user_data in loaded_stats.items():
-                    try:
-                        uid = int(uid_str)
-                        user_stats[uid] = user_data
-                    except ValueError:
-                        # 如果不是数字，保持原样
-                        user_stats[uid_str] = user_data
-
-                total_stats = data.get("total_stats",
-                    {"count": 0, "cost": 0, "value": 0, "profit": 0, "profit_count": 0, "loss_count": 0})
-
-                # 兼容旧版本数据格式（包含cost/value但没有profit_count/loss_count）
-                if "cost" in total_stats and "profit_count" not in total_stats:
-                    # 旧格式，添加新字段
-                    total_stats["profit_count"] = 0
-                    total_stats["loss_count"] = 0
-
-            # 限制历史记录大小，防止数据过大
-            for uid in user_stats:
-                if len(user_stats[uid].get("history", [])) > MAX_USER_HISTORY:
-                    user_stats[uid]["history"] = user_stats[uid]["history"][-MAX_USER_HISTORY:]
+            data, binary = read_day_data(data_file)
+            if data is None:
+                print(f"[提示] 未找到今日数据文件，从空白开始")
+                return
+
+            # 检查日期是否匹配
+            if data.get("date") != current_day.isoformat():
+                print(f"[提示] 数据文件日期不匹配，创建新记录")
+                return
+
+            loaded_stats = data.get("user_stats", {})
+
+            # 修复：JSON中的uid会被转为字符串，需要转回整数
+            user_stats = {uid_key(uid): user_data for uid, user_data in loaded_stats.items()}
+
+            total_stats = data.get("total_stats", new_total_stats())
+            # 旧数据文件没有wal_seq：当时事件日志与总盲盒数同步写入
+            self.snapshot_seq = data.get("wal_seq", total_stats.get("count", 0))
+            history_data = data.get("history")
+            history_rows = data.get("history_rows")
+            rollups_data = data.get("rollups")
+            box_types_data = data.get("box_types")
+            sketches_data = data.get("sketches")
+            users_data = data.get("users")
+
+            # 兼容旧版本数据格式：用户没有盈亏分布计数时从历史记录补算
+            for user in user_stats.values():
+                if any(field not in user for field in DIST_FIELDS):
+                    counts = dict.fromkeys(DIST_FIELDS, 0)
+                    for record in user.get("history", []):
+                        counts[dist_field(record["profit"])] += 1
+                    user.update(counts)
+
+            # 盈亏一律由毫元整数重新得出（旧版本按元累加的浮点盈亏会有误差）
+            for user in user_stats.values():
+                user["profit"] = user.get("value", 0) - user.get("cost", 0)
+            total_stats["profit"] = total_stats.get("value", 0) - total_stats.get("cost", 0)
+
+            # 旧版本总体统计缺少持平计数，按用户统计重建一次
+            if any(field not in total_stats for field in DIST_FIELDS):
+                total_stats = self.recompute_aggregates()
+
+            # 历史记录：新格式单独保存、第一次访问时读取；
+            # 上一版本与汇总保存在一起；旧格式从每个用户的 history 列表转换
+            if history_rows is not None and binary:
+                history_store = HistoryStore.deferred(snapshot.snapshot_file(history_file(data_file)),
+                                                      history_rows, lambda path, rows: load_history(path, rows, True))
+            elif history_rows is not None:
+                history_store = HistoryStore.deferred(history_file(data_file), history_rows, load_history)
+            elif history_data is not None:
+                history_store = HistoryStore.from_dict(history_data)
+            else:
+                history_store = HistoryStore.from_user_history(user_stats)
+            for user in user_stats.values():
+                user.pop("history", None)
+
+            # 时间桶汇总：旧数据文件没有时从历史记录补算一次
+            if rollups_data is not None:
+                rollups = Rollups.from_dict(rollups_data)
+            else:
+                rollups = Rollups.from_history(history_store)
+            if box_types_data is not None:
+                box_types = BoxTypeTable.from_dict(box_types_data)
+            else:
+                box_types = BoxTypeTable.from_history(history_store)
+            if sketches_data is not None:
+                sketches = DailySketches.from_dict(sketches_data)
+            else:
+                sketches = DailySketches.from_history(history_store)
+
+            # 用户名表：旧格式的用户名保存在每个用户统计里
+            if users_data is not None:
+                loaded_names = UserDirectory.from_dict(users_data)
+            else:
+                loaded_names = UserDirectory.from_user_stats(user_stats)
+            for user in user_stats.values():
+                user.pop("uname", None)
+            user_names.replace(loaded_names)
 
             print(f"[加载] 已加载今日数据，共{len(user_stats)}位用户，"
                   f"{total_stats['count']}个盲盒记录")
         except Exception as e:
             print(f"[ERROR] 加载数据失败: {e}")
 
+    def load_event_index(self):
+        """加载当日事件日志；旧数据没有事件日志时，从用户历史记录重建一次"""
+        try:
+            count = event_index.load()
+        except Exception as e:
+            print(f"[ERROR] 加载事件日志失败: {e}")
+            return
+
+        if count or not user_stats:
+            return
+
+        events = []
+        for row in range(len(history_store)):
+            uid = history_store.uid_at(row)
+            events.append({
+                "ts": history_store.ts[row],
+                "uid": uid,
+                "uname": user_names.uname(uid),
+                "blind_name": history_store.box_at(row),
+                "cost": history_store.cost[row],
+                "value": history_store.value[row]
+            })
+        event_index.rebuild(events)
+        self.snapshot_seq = len(event_index)
+        print(f"[加载] 已从历史记录重建事件索引，共{len(event_index)}条")
+
+    def replay_event_log(self):
+        """重放事件日志中快照之后的记录（上次快照后到崩溃或退出前入库的部分）"""
+        try:
+            events = event_index.replay(self.snapshot_seq)
+        except Exception as e:
+            print(f"[ERROR] 重放事件日志失败: {e}")
+            return
+        for event in events:
+            self.apply_event(event["ts"], event["uid"], event["uname"], event["blind_name"],
+                             event["cost"], event["value"], event.get("room_id"))
+        if events:
+            print(f"[加载] 已从事件日志重放快照之后的{len(events)}条记录")
+
+    def sync_sqlite(self):
+        """SQLite按刷新间隔批量写入，退出前未写入的部分从当日事件日志补写"""
+        if db_store is None:
+            return
+        try:
+            events = event_index.replay(db_store.next_seq(current_day.isoformat()))
+            for event in events:
+                db_store.add(event["ts"], event["uid"], event["uname"], event["blind_name"],
+                             event["cost"], event["value"], event.get("room_id"), seq=event["seq"])
+            db_store.flush()
+        except Exception as e:
+            print(f"[ERROR] 同步SQLite失败: {e}")
+            return
+        if events:
+            print(f"[加载] 已向SQLite补写{len(events)}条记录")
+
+    def rebuild_indexes(self):
+        """按当前用户统计重建排行榜索引和用户顺序（不读取历史记录）"""
+        if luck_scorer is not None:
+            luck_scorer.reset(history_store)
+        user_order[:] = list(user_stats)
+        ranking_index.clear()
+        for uid, user in user_stats.items():
+            ranking_index.update(uid, user.get("cost", 0), user.get("value", 0), user.get("count", 0))
+
+    def warm_up(self):
+        """
+        后台读取历史记录并重建滑动窗口排行榜，期间入库的记录等待重建完成
+        24小时窗口中零点之前的部分从前一天的事件日志或归档读取（在锁外读取）
+        """
+        global window_boards
+        now = time.time()
+        yesterday = (current_day - timedelta(days=1)).isoformat()
+        try:
+            earlier = archive.day_rows(DATA_DIR, yesterday, since=now - WINDOWS["24h"][0])
+        except Exception as e:
+            print(f"[ERROR] 读取 {yesterday} 的记录失败: {e}，24小时排行榜只包含今天")
+            earlier = []
+        try:
+            with state_lock:
+                window_boards = WindowBoards.from_history(history_store, earlier=earlier)
+        except Exception as e:
+            print(f"[ERROR] 读取历史记录失败: {e}")
+
+    def catch_up_lifetime(self):
+        """后台读取用户累计统计，并累加今天之前尚未累加的日期（数据文件或归档）"""
+        try:
+            lifetime_index.load()
+            lifetime_index.catch_up(DATA_DIR, before=current_day.isoformat())
+        except Exception as e:
+            print(f"[ERROR] 更新用户累计统计失败: {e}")
+
+    def roll_over(self, today: Optional[date] = None) -> bool:
+        """
+        换日：过了零点后第一条记录入库前、或快照线程醒来时调用，已是当天时不做任何事
+        持有state_lock完成：前一天的最后一次快照（交给写入线程），前一天并入用户累计统计，
+        事件索引改用新一天的日志，清空当天的统计；滑动窗口排行榜跨越零点，保留不动
+        """
+        global current_day, CURRENT_DATA_FILE, CURRENT_EVENTS_FILE, event_index
+        global user_stats, total_stats, history_store, rollups, box_types, sketches
+        today = today or date.today()
+        with state_lock:
+            if today == current_day:
+                return False
+            closed = current_day
+            self.save_to_file(final=True)
+            past_sketches[closed] = sketches
+            # 前一天并入用户累计统计（按日期去重，启动时的补累加不会重复计入）
+            folded = lifetime_index.add_summary(closed.isoformat(), user_stats, user_names)
+
+            event_index.close()
+            current_day = today
+            CURRENT_DATA_FILE = day_data_file(today)
+            CURRENT_EVENTS_FILE = day_events_file(today)
+            user_stats = {}
+            total_stats = new_total_stats()
+            user_names.clear()
+            history_store = HistoryStore()
+            rollups = Rollups()
+            box_types = BoxTypeTable()
+            sketches = DailySketches()
+            event_index = EventIndex(CURRENT_EVENTS_FILE, users=user_names)
+            self.snapshot_seq = 0
+            # 新一天的日志已有记录时（例如换日前后重启过）从日志恢复
+            self.load_event_index()
+            self.replay_event_log()
+            self.rebuild_indexes()
+        if folded:
+            threading.Thread(target=lifetime_index.save, name="lifetime-save", daemon=True).start()
+        print(f"[提示] 已切换到 {today.isoformat()}，{closed.isoformat()} 的数据已保存")
+        return True
+
+
+def public_totals(stats: dict) -> dict:
+    """对外输出的总体统计：cost/value保持毫元，profit换算为元（与旧接口一致）"""
+    output = dict(stats)
+    output["profit"] = to_yuan(stats.get("profit", 0))
+    return output
+
+
+def event_entry(event: dict) -> dict:
+    """事件索引中的记录转为对外格式（金额为元）"""
+    output = dict(event)
+    output["cost"] = to_yuan(event["cost"])
+    output["value"] = to_yuan(event["value"])
+    output["profit"] = to_yuan(event["value"] - event["cost"])
+    return output
+
+
+def box_entry(stats, histogram: bool = False) -> dict:
+    """盲盒类型统计的对外格式（金额为元）"""
+    output = stats.summary()
+    for field in ('cost', 'value', 'profit', 'max_value'):
+        output[field] = to_yuan(output[field])
+    output['prices'] = [to_yuan(price) for price in output['prices']]
+    if histogram:
+        output['histogram'] = [dict(item, gift_price=to_yuan(item['gift_price']))
+                               for item in stats.histogram()]
+    return output
+
+
+def day_sketches(day: date):
+    """某一天的分位数估计：当天取内存，之前的从当天数据文件或归档读取（只读一次）"""
+    if day == current_day:
+        return sketches
+    if day not in past_sketches:
+        data_file = day_data_file(day)
+        loaded = None
+        try:
+            data, _ = read_day_data(data_file)
+            sketches_data = data.get("sketches") if data is not None else \
+                archive.day_sketches(archive.archive_dir_for(DATA_DIR), day.isoformat())
+            if sketches_data is not None:
+                loaded = DailySketches.from_dict(sketches_data)
+        except Exception as e:
+            print(f"[ERROR] 读取 {day} 的分位数估计失败: {e}")
+            return None
+        past_sketches[day] = loaded
+    return past_sketches[day]
+
+
+def window_entry(item: dict) -> dict:
+    """滑动窗口排行榜中的一行（金额为元）"""
+    return {
+        'uid': item['uid'],
+        'uname': user_names.uname(item['uid']),
+        'count': item['count'],
+        'cost': to_yuan(item['cost']),
+        'value': to_yuan(item['value']),
+        'profit': to_yuan(item['profit'])
+    }
+
+
+def window_ranking(name: str, limit: int, order: str = 'spend') -> dict:
+    """某个窗口的排行榜"""
+    board = window_boards.get(name)
+    return {
+        'window': name,
+        'window_seconds': board.window_seconds,
+        'order': order,
+        'user_count': len(board),
+        'ranking': [window_entry(item) for item in board.top(limit, order)]
+    }
+
+
+def profit_distribution() -> dict:
+    """当前盈亏分布"""
+    return {
+        'profit': total_stats.get("profit_count", 0),
+        'loss': total_stats.get("loss_count", 0),
+        'break_even': total_stats.get("break_even_count", 0)
+    }
+
 
 tracker = BlindBoxTracker()
 
@@ -214,6 +707,8 @@ if os.path.exists(config_file):
             monitor_config.update(json.load(f))
     except Exception as e:
         print(f"[ERROR] 加载监听器配置失败: {e}")
+# 运行状态只反映本进程内的监听器，不从配置文件恢复
+monitor_config['is_running'] = False
 
 
 # ==================== 路由 ====================
@@ -226,126 +721,590 @@ def index():
 
 @app.route('/api/stats')
 def get_stats():
-    """获取统计数据 - 包含盈亏分布"""
-    # 计算盈亏分布和总统计数据
-    profit_count = 0
-    loss_count = 0
-    break_even_count = 0
-    total_cost = 0
-    total_value = 0
-
-    for uid, user in user_stats.items():
-        total_cost += user.get("cost", 0)
-        total_value += user.get("value", 0)
-        for record in user.get("history", []):
-            if record["profit"] > 0:
-                profit_count += 1
-            elif record["profit"] < 0:
-                loss_count += 1
-            else:
-                break_even_count += 1
-
-    # 重新计算总盈亏
-    total_profit = (total_value - total_cost) / 1000  # 转换为元
-
-    # 更新 total_stats 确保数据一致
-    total_stats["count"] = sum(user.get("count", 0) for user in user_stats.values())
-    total_stats["cost"] = total_cost
-    total_stats["value"] = total_value
-    total_stats["profit"] = total_profit
-    total_stats["profit_count"] = profit_count
-    total_stats["loss_count"] = loss_count
-
-    # 收集所有历史记录用于翻页
-    all_history = []
-    for uid, user in user_stats.items():
-        uname = user.get("uname", "未知")
-        for record in user.get("history", []):
-            all_history.append({
-                "time": record["time"],
-                "uname": uname,
-                "blind_name": record["blind_name"],
-                "value": record["value"],
-                "profit": record["profit"]
-            })
-
-    # 按时间倒序排序
-    all_history.sort(key=lambda x: x["time"], reverse=True)
+    """获取统计数据 - 包含盈亏分布，最近记录支持 offset/limit 翻页（只读）"""
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(0, request.args.get('limit', MAX_RECENT_RECORDS, type=int)), MAX_RECENT_RECORDS)
 
     return jsonify({
-        'total': total_stats,
+        'total': public_totals(total_stats),
         'user_count': len(user_stats),
-        'recent': all_history[:500],  # 返回更多历史记录
-        'profit_distribution': {
-            'profit': profit_count,
-            'loss': loss_count,
-            'break_even': break_even_count
-        }
+        'recent': [event_entry(event) for event in event_index.page(offset, limit)],
+        'event_count': len(event_index),
+        'profit_distribution': profit_distribution()
     })
 
 
+def ranking_entry(uid) -> dict:
+    """排行榜中的一行，只读取用户统计，不写回；调用方持有state_lock（换日会清空用户统计）"""
+    user = user_stats[uid]
+    return {
+        'uname': user_names.uname(uid),
+        'count': user['count'],
+        'cost': to_yuan(user['cost']),
+        'value': to_yuan(user['value']),
+        'profit': to_yuan(user['profit']),
+        'profit_rate': RankingIndex.profit_rate(user['cost'], user['value'])
+    }
+
+
+def luck_entry(detail: dict) -> dict:
+    """运气评分明细，期望价值换算为元，评分和置信区间为超额收益率"""
+    return {
+        'luck': round(detail['luck'], 4),
+        'luck_lower': round(detail['lower'], 4),
+        'luck_upper': round(detail['upper'], 4),
+        'excess_rate': round(detail['excess_rate'], 4),
+        'expected_value': to_yuan(int(round(detail['expected']))),
+        'shrinkage': round(detail['shrinkage'], 4)
+    }
+
+
+def luck_ranking(limit: int):
+    """按运气评分排序的排行榜，cursor为名次偏移"""
+    if luck_scorer is None:
+        return jsonify({'status': 'error', 'message': '服务器未安装numpy，无法按运气评分排序'}), 503
+    cursor = decode_cursor(request.args.get('cursor'))
+    offset = cursor if isinstance(cursor, int) and cursor > 0 else 0
+
+    ranking = []
+    # 持有state_lock：评分读取的各列长度一致，换日时用户编号不会对应到新的一天
+    with state_lock:
+        luck_scorer.refresh()
+        for user_id in luck_scorer.page(offset, limit):
+            uid = history_store.uids[user_id]
+            if uid not in user_stats:
+                continue
+            entry = ranking_entry(uid)
+            entry['uid'] = uid
+            entry.update(luck_entry(luck_scorer.entry(user_id)))
+            ranking.append(entry)
+        total = len(luck_scorer)
+
+    next_offset = offset + limit if offset + limit < total else None
+    return list_response(ranking, next_offset, total)
+
+
+def user_entry(uid) -> dict:
+    """用户列表中的一行，调用方持有state_lock"""
+    user = user_stats[uid]
+    return {
+        'uid': uid,
+        'uname': user_names.uname(uid),
+        'count': user['count'],
+        'cost': to_yuan(user['cost']),
+        'value': to_yuan(user['value']),
+        'profit': to_yuan(user['profit'])
+    }
+
+
+def lifetime_entry(uid):
+    """之前各天的累计统计加上今天的用户统计，没有记录时返回None；调用方持有state_lock"""
+    today = user_stats.get(uid)
+    merged = lifetime.combine(lifetime_index.get(uid), today)
+    if merged is None:
+        return None
+    return {
+        'uid': uid,
+        'uname': user_names.uname(uid, merged['uname'] or "未知"),
+        'count': merged['count'],
+        'cost': to_yuan(merged['cost']),
+        'value': to_yuan(merged['value']),
+        'profit': to_yuan(merged['value'] - merged['cost']),
+        'days': merged['days'],
+        'first_seen': format_ts(merged['first_seen']),
+        'last_seen': format_ts(merged['last_seen']),
+        'today': user_entry(uid) if today is not None else None
+    }
+
+
+def format_ts(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts is not None else None
+
+
+def parse_uid(uid_str: str):
+    """路径中的uid，数字uid转为整数"""
+    try:
+        return int(uid_str)
+    except ValueError:
+        return uid_str
+
+
+def parse_time_arg(value):
+    """
+    解析时间范围参数，返回时间戳
+    支持时间戳、'YYYY-MM-DD HH:MM:SS'、'YYYY-MM-DD' 和当天的 'HH:MM[:SS]'
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    for fmt in ("%H:%M:%S", "%H:%M"):
+        try:
+            parsed = datetime.strptime(value, fmt).time()
+            return datetime.combine(date.today(), parsed).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"无法解析时间: {value}")
+
+
+def page_limit() -> int:
+    """列表接口的每页条数"""
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return min(max(1, limit), MAX_PAGE_SIZE)
+
+
+def page_sign():
+    """盈亏方向过滤参数，非法值视为请求错误"""
+    sign = request.args.get('sign') or None
+    if sign is not None and sign not in SIGNS:
+        raise ValueError(f"sign只能是 {', '.join(SIGNS)}")
+    return sign
+
+
+def list_response(items: list, next_cursor, total: int):
+    """
+    列表响应：正文保持数组格式兼容旧页面，
+    下一页游标和总数放在 X-Next-Cursor / X-Total-Count 响应头
+    """
+    response = jsonify(items)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = encode_cursor(next_cursor)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+
 @app.route('/api/ranking')
 def get_ranking():
-    """获取排行榜 - 按运气排序"""
-    MIN_BLIND_BOXES = 1  # 最少盲盒数要求
-
-    # 过滤出至少送了MIN_BLIND_BOXES个盲盒的用户
-    qualified_users = [u for u in user_stats.values() if u["count"] >= MIN_BLIND_BOXES]
+    """
+    获取排行榜 - 按运气排序（盈亏率高的在前，同盈亏率送得多的在前）
+    参数：cursor（上一页的 X-Next-Cursor）、limit、sign（profit/loss/break_even）、
+    order=luck（按盲盒类型期望收益修正并收缩后的运气评分排序，不支持sign）
+    """
+    try:
+        sign = page_sign()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    limit = page_limit()
 
-    # 计算每个用户的运气指标
-    for user in qualified_users:
-        cost = user["cost"]
-        value = user["value"]
+    if request.args.get('order') == 'luck':
+        return luck_ranking(limit)
 
-        # 盈亏率（百分比）
-        if cost > 0:
-            user["profit_rate"] = (value - cost) / cost * 100
+    try:
+        after = decode_key_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    # 持有state_lock：取页和读取用户统计之间不会换日
+    with state_lock:
+        if 'offset' in request.args and 'cursor' not in request.args and sign is None:
+            # 兼容按名次偏移翻页
+            offset = max(0, request.args.get('offset', 0, type=int))
+            uids = ranking_index.top(limit, offset)
+            next_cursor = None
+            if uids and offset + len(uids) < len(ranking_index):
+                next_cursor = ranking_index.key_of(uids[-1])
+                next_cursor = list(next_cursor) if next_cursor else None
         else:
-            user["profit_rate"] = 0
+            uids, next_cursor = ranking_index.page(after, limit, sign)
+        ranking = [ranking_entry(uid) for uid in uids]
+        total = ranking_index.count(sign)
+    return list_response(ranking, next_cursor, total)
 
-        # 总盈亏
-        user["total_profit"] = user["profit"]
 
-    # 按盈亏率排序（盈亏率高的运气好）
-    # 次要排序：盲盒数量（相同样本数下，送更多的优先）
-    sorted_users = sorted(qualified_users,
-                         key=lambda x: (x["profit_rate"], x["count"]),
-                         reverse=True)  # 移除数量限制，显示全部用户
+def _window_route(name: str):
+    """为每个窗口注册独立的接口 /api/ranking/window/<窗口>"""
+    def handler():
+        try:
+            return jsonify(window_ranking(name, page_limit(), request.args.get('order', 'spend')))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+    handler.__doc__ = f"最近{name}的排行榜，参数：order（spend/profit/count，默认spend）、limit"
+    app.add_url_rule(f'/api/ranking/window/{name}', f'window_ranking_{name}', handler)
 
-    ranking = []
-    for user in sorted_users:
-        ranking.append({
-            'uname': user['uname'],
-            'count': user['count'],
-            'cost': user['cost'] / 1000,
-            'value': user['value'] / 1000,
-            'profit': user['profit'],
-            'profit_rate': user['profit_rate']
-        })
 
-    return jsonify(ranking)
+for _window_name in WINDOWS:
+    _window_route(_window_name)
+
+
+@app.route('/api/ranking/<uid_str>')
+def get_user_rank(uid_str):
+    """查询单个用户的名次"""
+    uid = parse_uid(uid_str)
+    with state_lock:
+        rank = ranking_index.rank(uid)
+        if rank is None:
+            return jsonify({'status': 'error', 'message': '用户不在排行榜上'}), 404
+
+        entry = ranking_entry(uid)
+        entry.update({'uid': uid, 'rank': rank + 1, 'total': len(ranking_index),
+                      'renames': user_names.renames(uid)})
+        if luck_scorer is not None:
+            luck_scorer.refresh()
+            detail = luck_scorer.entry_for(uid)
+            if detail is not None:
+                entry.update(luck_entry(detail))
+    return jsonify(entry)
 
 
 @app.route('/api/users')
 def get_users():
-    """获取所有用户列表"""
-    users = []
-    for uid, user in user_stats.items():
-        users.append({
-            'uid': uid,
-            'uname': user['uname'],
-            'count': user['count'],
-            'cost': user['cost'] / 1000,
-            'value': user['value'] / 1000,
-            'profit': user['profit']
-        })
-    return jsonify(users)
+    """
+    获取用户列表，按首次出现顺序分页
+    参数：cursor、limit、uid（单个用户）、blind_name（开过该盲盒的用户）、
+    sign（按总盈亏方向，此时按排行榜顺序）
+    """
+    try:
+        sign = page_sign()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    limit = page_limit()
+    cursor = decode_cursor(request.args.get('cursor'))
+
+    if request.args.get('uid'):
+        uid = parse_uid(request.args['uid'])
+        with state_lock:
+            users = [user_entry(uid)] if uid in user_stats else []
+        return list_response(users, None, len(users))
+
+    if sign is not None:
+        try:
+            after = decode_key_cursor(request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        with state_lock:
+            uids, next_cursor = ranking_index.page(after, limit, sign)
+            users = [user_entry(uid) for uid in uids]
+            total = ranking_index.count(sign)
+        return list_response(users, next_cursor, total)
+
+    with state_lock:
+        if request.args.get('blind_name'):
+            ordered = event_index.box_users(request.args['blind_name'])
+        else:
+            ordered = user_order
+
+        start = cursor if isinstance(cursor, int) and cursor > 0 else 0
+        uids = ordered[start:start + limit]
+        next_cursor = start + len(uids) if start + len(uids) < len(ordered) else None
+        users = [user_entry(uid) for uid in uids if uid in user_stats]
+        total = len(ordered)
+    return list_response(users, next_cursor, total)
+
+
+@app.route('/api/user/<uid_str>')
+def get_user_lifetime(uid_str):
+    """单个用户有记录以来的累计统计（之前各天 + 今天），today 为今天的部分"""
+    with state_lock:
+        entry = lifetime_entry(parse_uid(uid_str))
+    if entry is None:
+        return jsonify({'status': 'error', 'message': '没有该用户的记录'}), 404
+    entry['closed_days'] = len(lifetime_index.days)
+    return jsonify(entry)
+
+
+@app.route('/api/history')
+def get_history():
+    """
+    盲盒记录查询，按时间倒序游标翻页
+    参数：cursor、limit、uid、blind_name、sign、since、until（时间戳或 'YYYY-MM-DD HH:MM:SS' / 'HH:MM'）
+    过滤由事件索引的倒排表完成，不扫描全部记录
+    """
+    try:
+        sign = page_sign()
+        since = parse_time_arg(request.args.get('since'))
+        until = parse_time_arg(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    uid = parse_uid(request.args['uid']) if request.args.get('uid') else None
+    before = decode_cursor(request.args.get('cursor'))
+    result = event_index.query(
+        uid=uid,
+        blind_name=request.args.get('blind_name') or None,
+        sign=sign,
+        since=since,
+        until=until,
+        before=before if isinstance(before, int) else None,
+        limit=page_limit()
+    )
+
+    with state_lock:
+        total = user_entry(uid) if uid in user_stats else public_totals(total_stats)
+    return jsonify({
+        'items': [event_entry(event) for event in result['events']],
+        'next_cursor': encode_cursor(result['next']) if result['next'] is not None else None,
+        'matched': result['matched'],
+        'total': total
+    })
+
+
+@app.route('/api/timeseries')
+def get_timeseries():
+    """
+    趋势数据：按分钟或小时汇总的盲盒数、花费、价值、盈亏、独立用户数和各盲盒类型分项
+    参数：resolution（minute/hour，默认minute）、since、until、blind_name（只看某种盲盒）
+    没有记录的时间桶不返回
+    """
+    resolution = request.args.get('resolution', 'minute')
+    try:
+        since = parse_time_arg(request.args.get('since'))
+        until = parse_time_arg(request.args.get('until'))
+        points = rollups.query(resolution, since, until, request.args.get('blind_name') or None)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    for point in points:
+        for field in ('cost', 'value', 'profit'):
+            point[field] = to_yuan(point[field])
+        for box in point.get('boxes', {}).values():
+            box['profit'] = to_yuan(box['value'] - box['cost'])
+            box['cost'] = to_yuan(box['cost'])
+            box['value'] = to_yuan(box['value'])
+
+    return jsonify({
+        'resolution': resolution,
+        'bucket_seconds': rollups.series[resolution].bucket_seconds,
+        'points': points
+    })
+
+
+@app.route('/api/boxes')
+def get_boxes():
+    """全部盲盒类型的统计（返还率、最大奖及其出现频率等），按首次出现顺序"""
+    items = [box_entry(box_types.get(name)) for name in box_types.names()]
+    return jsonify({'items': items, 'total': len(items)})
+
+
+@app.route('/api/boxes/export')
+def export_boxes():
+    """
+    导出各盲盒类型的礼物价格分布
+    参数：format=csv（默认）或 json；每个(盲盒, 礼物价格)一行，价格为元
+    """
+    rows = [dict(row, gift_price=to_yuan(row['gift_price'])) for row in box_types.export_rows()]
+    if request.args.get('format', 'csv') == 'json':
+        return jsonify({'items': rows})
+    filename = f"blind_box_types_{current_day.isoformat()}.csv"
+    # 带BOM，方便Excel直接打开中文
+    return Response('\ufeff' + to_csv(rows), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@app.route('/api/boxes/<path:blind_name>')
+def get_box(blind_name):
+    """单种盲盒的统计和礼物价格分布"""
+    stats = box_types.get(blind_name)
+    if stats is None:
+        return jsonify({'status': 'error', 'message': '没有该盲盒的记录'}), 404
+    return jsonify(box_entry(stats, histogram=True))
+
+
+@app.route('/api/quantiles')
+def get_quantiles():
+    """
+    盈亏/花费分布的分位数
+    参数：metric（profit单个盲盒盈亏，spend用户当日累计花费，默认profit）、
+    room（直播间）、blind_name（盲盒类型，仅profit）、
+    since/until（日期 YYYY-MM-DD，默认当天）、q（逗号分隔，默认0.5,0.9,0.99）
+    多天、多个范围的估计直接合并，结果的相对误差不超过1%
+    """
+    metric = request.args.get('metric', 'profit')
+    try:
+        today = current_day
+        since = date.fromisoformat(request.args['since']) if request.args.get('since') else today
+        until = date.fromisoformat(request.args['until']) if request.args.get('until') else today
+        qs = [float(q) for q in request.args.get('q', '0.5,0.9,0.99').split(',')]
+        if any(not 0 <= q <= 1 for q in qs):
+            raise ValueError("q必须在0到1之间")
+        if until < since or (until - since).days > 366:
+            raise ValueError("日期范围无效")
+
+        if request.args.get('blind_name'):
+            if metric != 'profit':
+                raise ValueError("blind_name只适用于metric=profit")
+            scope = box_scope(request.args['blind_name'])
+        elif request.args.get('room'):
+            scope = room_scope(request.args['room'])
+        else:
+            scope = SCOPE_ALL
+
+        days = [since + timedelta(days=i) for i in range((until - since).days + 1)]
+        parts = []
+        for day in days:
+            daily = day_sketches(day)
+            if daily is not None:
+                parts.append(daily.get(metric, scope))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    merged = QuantileSketch.merged(parts)
+    return jsonify({
+        'metric': metric,
+        'scope': scope,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'count': merged.count,
+        'quantiles': {f"p{q * 100:g}": (round(to_yuan(value), 2) if value is not None else None)
+                      for q, value in merged.quantiles(qs).items()}
+    })
+
+
+# ==================== SQLite查询API ====================
+
+def db_unavailable():
+    return jsonify({'status': 'error',
+                    'message': '未启用SQLite存储（设置环境变量 BLIND_BOX_SQLITE=1）'}), 503
+
+
+def db_day_range():
+    """日期范围参数 since/until（YYYY-MM-DD），返回ISO字符串或None"""
+    since = request.args.get('since') or None
+    until = request.args.get('until') or None
+    for value in (since, until):
+        if value is not None:
+            date.fromisoformat(value)
+    return since, until
+
+
+def db_amounts(item: dict) -> dict:
+    """SQLite查询结果的金额换算为元，补充盈亏"""
+    item['profit'] = to_yuan(item['value'] - item['cost'])
+    item['cost'] = to_yuan(item['cost'])
+    item['value'] = to_yuan(item['value'])
+    return item
+
+
+@app.route('/api/db/events')
+def get_db_events():
+    """
+    跨日期的盲盒记录查询，按时间倒序游标翻页
+    参数：since、until（同 /api/history）、uid、blind_name、cursor、limit
+    """
+    if db_store is None:
+        return db_unavailable()
+    try:
+        since = parse_time_arg(request.args.get('since'))
+        until = parse_time_arg(request.args.get('until'))
+        before = decode_key_cursor(request.args.get('cursor'), length=2)  # (ts, id)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    result = db_store.events(
+        since=since,
+        until=until,
+        uid=parse_uid(request.args['uid']) if request.args.get('uid') else None,
+        blind_name=request.args.get('blind_name') or None,
+        before=before,
+        limit=page_limit()
+    )
+    items = []
+    for event in result['events']:
+        event['time'] = datetime.fromtimestamp(event['ts']).strftime("%Y-%m-%d %H:%M:%S")
+        items.append(db_amounts(event))
+    return jsonify({
+        'items': items,
+        'next_cursor': encode_cursor(result['next']) if result['next'] is not None else None
+    })
+
+
+@app.route('/api/db/users/<uid_str>')
+def get_db_user(uid_str):
+    """单个用户每天的汇总和合计，参数：since、until（YYYY-MM-DD）"""
+    if db_store is None:
+        return db_unavailable()
+    try:
+        since, until = db_day_range()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '日期格式应为 YYYY-MM-DD'}), 400
+
+    uid = parse_uid(uid_str)
+    days = db_store.user_days(uid, since, until)
+    if not days:
+        return jsonify({'status': 'error', 'message': '没有该用户的记录'}), 404
+    total = {'count': 0, 'cost': 0, 'value': 0}
+    for day in days:
+        for field in total:
+            total[field] += day[field]
+    return jsonify({
+        'uid': uid,
+        'uname': days[-1]['uname'],
+        'total': db_amounts(total),
+        'days': [db_amounts(day) for day in days]
+    })
+
+
+@app.route('/api/db/ranking')
+def get_db_ranking():
+    """日期范围内按用户合计的排行，参数：since、until、order（cost/value/profit/count）、cursor、limit"""
+    if db_store is None:
+        return db_unavailable()
+    try:
+        since, until = db_day_range()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '日期格式应为 YYYY-MM-DD'}), 400
+    cursor = decode_cursor(request.args.get('cursor'))
+    offset = cursor if isinstance(cursor, int) and cursor > 0 else 0
+    limit = page_limit()
+    try:
+        rows = db_store.ranking(since, until, request.args.get('order', 'cost'), limit, offset)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    total = db_store.user_count(since, until)
+    next_cursor = offset + limit if offset + limit < total else None
+    return list_response([db_amounts(row) for row in rows], next_cursor, total)
+
+
+@app.route('/api/db/boxes')
+def get_db_boxes():
+    """日期范围内按盲盒类型的合计，参数：since、until"""
+    if db_store is None:
+        return db_unavailable()
+    try:
+        since, until = db_day_range()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '日期格式应为 YYYY-MM-DD'}), 400
+    return jsonify({'items': [db_amounts(row) for row in db_store.boxes(since, until)]})
+
+
+@app.route('/api/db/days')
+def get_db_days():
+    """每天的总计（盲盒数、花费、价值、盈亏、参与人数），参数：since、until"""
+    if db_store is None:
+        return db_unavailable()
+    try:
+        since, until = db_day_range()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '日期格式应为 YYYY-MM-DD'}), 400
+    return jsonify({'items': [db_amounts(row) for row in db_store.days(since, until)]})
+
+
+@app.route('/api/codec')
+def get_codec():
+    """支持的传输编码，供监听器和浏览器协商"""
+    return jsonify({
+        'encodings': codec.available_encodings(),
+        'event_fields': codec.EVENT_FIELDS,
+        'record_fields': codec.RECORD_FIELDS
+    })
 
 
 @app.route('/api/blind_box', methods=['POST'])
 def add_blind_box():
-    """接收盲盒数据 - 修复字段映射"""
-    data = request.json
+    """接收盲盒数据 - 修复字段映射，支持JSON和MessagePack请求体"""
+    try:
+        data = codec.decode_event(request.get_data(), request.content_type)
+    except RuntimeError as e:
+        # 本机未安装msgpack，让监听器回退到JSON
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except Exception:
+        return jsonify({'status': 'error', 'message': '请求体解析失败'}), 400
 
     # 修正字段名：从gift_name改为blind_name
     tracker.add_blind_box(
@@ -353,7 +1312,8 @@ def add_blind_box():
         uname=data.get('uname', '未知'),
         blind_name=data.get('blind_name', data.get('gift_name', '未知')),  # 兼容处理
         blind_price=data.get('blind_price', 0),
-        gift_price=data.get('gift_price', 0)
+        gift_price=data.get('gift_price', 0),
+        room_id=data.get('room_id')
     )
     return jsonify({'status': 'success'})
 
@@ -383,10 +1343,16 @@ def handle_monitor_config():
     return jsonify(monitor_config)
 
 
+def on_monitor_status(running: bool):
+    """监听器进程状态变化（启动、退出、放弃重启）"""
+    monitor_config['is_running'] = running
+    socketio.emit('monitor_status', {'running': running})
+
+
 @app.route('/api/monitor/start', methods=['POST'])
 def start_monitor():
     """启动监听器"""
-    global monitor_process, monitor_config
+    global monitor_worker, monitor_config
 
     if monitor_config['is_running']:
         return jsonify({'status': 'error', 'message': '监听器已在运行'})
@@ -406,22 +1372,14 @@ def start_monitor():
         with open(config_file, 'w', encoding='utf-8') as f:
             json.dump(temp_config, f, ensure_ascii=False, indent=2)
 
-        # 启动monitor_with_web.py进程
-        import sys
+        # 启动monitor_with_web.py进程，输出由管理器持续读取，退出后自动重启
         script_path = os.path.join(os.path.dirname(__file__), 'monitor_with_web.py')
-
-        # 使用subprocess启动监听器
-        monitor_process = subprocess.Popen(
+        monitor_worker = MonitorWorker(
             [sys.executable, script_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=os.path.dirname(__file__)
+            cwd=os.path.dirname(__file__) or None,
+            on_status=on_monitor_status
         )
-
-        monitor_config['is_running'] = True
-
-        # 通过WebSocket通知所有客户端
-        socketio.emit('monitor_status', {'running': True})
+        monitor_worker.start()
 
         return jsonify({'status': 'success', 'message': '监听器已启动'})
     except Exception as e:
@@ -431,21 +1389,14 @@ def start_monitor():
 @app.route('/api/monitor/stop', methods=['POST'])
 def stop_monitor():
     """停止监听器"""
-    global monitor_process, monitor_config
+    global monitor_worker, monitor_config
 
     if not monitor_config['is_running']:
         return jsonify({'status': 'error', 'message': '监听器未运行'})
 
     try:
-        if monitor_process:
-            monitor_process.terminate()
-            monitor_process.wait(timeout=5)
-            monitor_process = None
-
-        monitor_config['is_running'] = False
-
-        # 通过WebSocket通知所有客户端
-        socketio.emit('monitor_status', {'running': False})
+        if monitor_worker:
+            monitor_worker.stop(timeout=5)
 
         return jsonify({'status': 'success', 'message': '监听器已停止'})
     except Exception as e:
@@ -455,44 +1406,141 @@ def stop_monitor():
 @app.route('/api/monitor/status', methods=['GET'])
 def monitor_status():
     """获取监听器状态"""
-    return jsonify({
+    status = {
         'running': monitor_config['is_running'],
         'room_id': monitor_config['room_id']
-    })
+    }
+    if monitor_worker:
+        worker_status = monitor_worker.status()
+        status.update({
+            'pid': worker_status['pid'],
+            'restarts': worker_status['restarts'],
+            'last_exit_code': worker_status['last_exit_code'],
+            'next_restart_in': worker_status['next_restart_in']
+        })
+    return jsonify(status)
+
+
+@app.route('/api/monitor/logs', methods=['GET'])
+def monitor_logs():
+    """获取监听器输出，after为上次拿到的最大序号，用于增量轮询"""
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', 200, type=int)
+    if not monitor_worker:
+        return jsonify({'lines': [], 'last_seq': 0})
+    return jsonify(monitor_worker.logs(after=after, limit=limit))
 
 
 # ==================== WebSocket事件 ====================
 
+def _join_codec_room(encoding: str):
+    """把当前客户端放入对应编码的推送房间"""
+    if encoding != codec.ENCODING_MSGPACK or codec.msgpack is None:
+        encoding = codec.ENCODING_JSON
+
+    for room in CODEC_ROOMS.values():
+        leave_room(room)
+    join_room(CODEC_ROOMS[encoding])
+
+    if encoding == codec.ENCODING_MSGPACK:
+        binary_clients.add(request.sid)
+    else:
+        binary_clients.discard(request.sid)
+    return encoding
+
+
+def _emit_snapshot(encoding: str):
+    """向当前客户端发送初始统计和最近记录"""
+    stats = {
+        'total': public_totals(total_stats),
+        'user_count': len(user_stats),
+        'profit_distribution': profit_distribution()
+    }
+    records = [event_entry(event) for event in event_index.newest(20)]
+    if encoding == codec.ENCODING_MSGPACK:
+        emit('stats_update', codec.pack(stats))
+        emit('recent_records', codec.pack_records(records, codec.RECORD_FIELDS))
+    else:
+        emit('stats_update', stats)
+        emit('recent_records', records)
+
+
 @socketio.on('connect')
-def handle_connect():
-    """客户端连接"""
-    emit('stats_update', {
-        'total': total_stats,
-        'user_count': len(user_stats)
-    })
-    emit('recent_records', recent_records[:20])
+def handle_connect(auth=None):
+    """客户端连接，可通过 ?encoding=msgpack 或 auth 选择二进制推送"""
+    requested = request.args.get('encoding')
+    if isinstance(auth, dict):
+        requested = auth.get('encoding', requested)
+    encoding = _join_codec_room(requested or codec.ENCODING_JSON)
+    emit('codec', {'encoding': encoding, 'record_fields': codec.RECORD_FIELDS})
+    _emit_snapshot(encoding)
+
+
+@socketio.on('set_encoding')
+def handle_set_encoding(data):
+    """连接后切换推送编码"""
+    requested = data.get('encoding') if isinstance(data, dict) else data
+    encoding = _join_codec_room(requested or codec.ENCODING_JSON)
+    emit('codec', {'encoding': encoding, 'record_fields': codec.RECORD_FIELDS})
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """客户端断开"""
-    pass
+    binary_clients.discard(request.sid)
 
 
 # ==================== 自动保存 ====================
 
+snapshot_due = threading.Event()  # 新增记录达到 SNAPSHOT_EVENTS 时提前唤醒快照线程
+
+
 def auto_save():
-    """自动保存线程"""
+    """
+    快照线程：每 SNAPSHOT_INTERVAL 秒或新增记录达到 SNAPSHOT_EVENTS 条时保存一次，
+    没有新记录时跳过；两次快照之间的记录已在事件日志中
+    每次醒来先检查是否过了零点，没有新记录时也能按时结束前一天
+    """
     while True:
-        time.sleep(60)
+        snapshot_due.wait(SNAPSHOT_INTERVAL)
+        snapshot_due.clear()
+        try:
+            tracker.roll_over()
+        except Exception as e:
+            print(f"[ERROR] 换日失败: {e}")
+        if tracker.pending_events() <= 0:
+            continue
         tracker.save_to_file()
-        print(f"[INFO] 数据已自动保存")
 
 
 save_thread = threading.Thread(target=auto_save, daemon=True)
 save_thread.start()
 
 
+def push_windows():
+    """
+    滑动窗口排行榜推送线程
+    每个窗口单独推送（ranking_10m / ranking_1h / ranking_24h），
+    有新记录或有记录滑出窗口时才推送
+    """
+    pushed = {}
+    while True:
+        time.sleep(WINDOW_PUSH_INTERVAL)
+        try:
+            for name, board in window_boards.boards.items():
+                board.expire()
+                if pushed.get(name) == (id(board), board.version):
+                    continue
+                pushed[name] = (id(board), board.version)
+                broadcast(f'ranking_{name}', window_ranking(name, WINDOW_PUSH_SIZE))
+        except Exception as e:
+            print(f"[ERROR] 推送滑动窗口排行榜失败: {e}")
+
+
+window_thread = threading.Thread(target=push_windows, daemon=True)
+window_thread.start()
+
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("盲盒统计Web服务器启动")
@@ -502,4 +1550,8 @@ if __name__ == '__main__':
     print(f"最大记录数: {MAX_RECENT_RECORDS}")
     print("="*60 + "\n")
 
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    try:
+        socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    finally:
+        # 退出前写入完整的历史记录，下次启动不用从事件日志补齐
+        tracker.save_to_file(wait=True, final=True)